@@ -24,6 +24,8 @@ def create_app(config=None):
 	
 	app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_port=1)
 	db.init_app(app)
+	from utils.database import init_database
+	init_database(app)
 	migrate.init_app(app, db)
 	bcrypt.init_app(app)
 	login_manager.init_app(app)
@@ -65,5 +67,13 @@ def create_app(config=None):
 def initialize_database_and_setup():
 	db.create_all()
 	from utils.setup import initialize_app
+	from utils.database import upgrade_schema
+	from utils.log_store import upgrade_partitions, migrate_legacy_logs
 	from flask import current_app
+	# Tables of older versions get the columns added since, create_all() leaves existing tables alone
+	for column in upgrade_schema():
+		print(f"Added column {column} to the database")
+	# Log partitions of older versions get the new fields, the entries of their Log table move to the logs database
+	upgrade_partitions()
+	migrate_legacy_logs(current_app.config.get('LOG_PARTITION_INTERVAL', 'day'))
 	initialize_app(current_app) 
\ No newline at end of file
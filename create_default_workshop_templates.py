@@ -17,7 +17,6 @@ from models.user import User, Group
 from models.workshop import WorkshopTemplate, Workshop, UserWorkshop
 from models.tenant import Tenant
 from utils.permissions import *
-from models.log import Log
 
 def create_default_templates():
     """Crée les templates de workshops par défaut"""
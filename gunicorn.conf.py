@@ -43,11 +43,40 @@ def on_starting(server):
 	temp_app = Flask(__name__)
 	configure_app(temp_app)
 	db.init_app(temp_app)
+	from utils.database import init_database
+	init_database(temp_app)
 	
 	with temp_app.app_context():
 		initialize_database_and_setup()
 	
 	cleanup_containers()
+
+	# Launches that were running when Flowcase stopped can never finish
+	from services.provisioning import fail_stale_jobs, prune_jobs
+	from services.warm_pool import reset_warm_pools, warm_pool
+	from services.idle_reaper import idle_reaper
+	from utils.resources import reconcile_resources
+	from utils.timing import prune_launch_phases
+	from utils.nodes import ensure_local_node, cleanup_node_containers
+	with temp_app.app_context():
+		ensure_local_node()
+		cleanup_node_containers()
+		fail_stale_jobs()
+		reset_warm_pools()
+		# Reservations of containers that are gone are released, the ledger totals are rebuilt
+		reconcile_resources(rebuild=True)
+
+	# Login password checks are bounded across all the workers forked after this
+	from services.password_verifier import share_capacity
+	share_capacity(temp_app.config['PASSWORD_WORKERS'])
+
+	# Write the routing files of the configured nginx routing mode
+	from utils.nginx import init_routing
+	with temp_app.app_context():
+		try:
+			init_routing()
+		except Exception as e:
+			print(f"Error initializing nginx routing: {e}")
 	
 	# start background thread for periodic image checks
 	def pull_images_worker():
@@ -60,4 +89,48 @@ def on_starting(server):
 				print(f"Error in pull_images_worker: {e}")
 	
 	thread = threading.Thread(target=pull_images_worker, daemon=True)
-	thread.start()
\ No newline at end of file
+	thread.start()
+
+	# start background thread keeping the warm pools topped up
+	def warm_pool_worker():
+		while True:
+			try:
+				time.sleep(30)
+				with temp_app.app_context():
+					warm_pool.maintain()
+					reconcile_resources()
+					prune_launch_phases(temp_app.config['LAUNCH_TIMING_RETENTION_DAYS'])
+					prune_jobs(temp_app.config['PROVISION_JOB_RETENTION_DAYS'])
+			except Exception as e:
+				print(f"Error in warm_pool_worker: {e}")
+
+	thread = threading.Thread(target=warm_pool_worker, daemon=True)
+	thread.start()
+
+	# start background thread removing the instances nobody uses anymore
+	def idle_reaper_worker():
+		while True:
+			try:
+				time.sleep(60)
+				with temp_app.app_context():
+					idle_reaper.run(temp_app.config['BULK_LAUNCH_PARALLELISM'])
+			except Exception as e:
+				print(f"Error in idle_reaper_worker: {e}")
+
+	thread = threading.Thread(target=idle_reaper_worker, daemon=True)
+	thread.start()
+
+	# start background thread archiving and dropping the log partitions past their retention
+	def log_retention_worker():
+		from utils.logger import prune_logs
+		while True:
+			try:
+				time.sleep(3600)
+				if temp_app.config['LOG_RETENTION_DAYS']:
+					with temp_app.app_context():
+						prune_logs(temp_app.config['LOG_RETENTION_DAYS'])
+			except Exception as e:
+				print(f"Error in log_retention_worker: {e}")
+
+	thread = threading.Thread(target=log_retention_worker, daemon=True)
+	thread.start()
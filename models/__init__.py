@@ -1,6 +1,8 @@
-from models.user import User, Group
-from models.droplet import Droplet, DropletInstance
+from models.user import User, Group, PermissionVersion
+from models.droplet import Droplet, DropletInstance, ProvisioningJob, WarmContainer, InstanceReclaim, LaunchPhase
 from models.registry import Registry
-from models.log import Log
+from models.log import log_table
 from models.workshop import WorkshopTemplate, Workshop, UserWorkshop
-from models.tenant import Tenant
\ No newline at end of file
+from models.tenant import Tenant
+from models.resources import ResourceLedger, ResourceReservation
+from models.node import DockerNode
\ No newline at end of file
@@ -36,6 +36,18 @@ class Droplet(db.Model):
 	environment_vars = db.Column(db.Text, nullable=True)  # JSON: {"KEY": "value"}
 	docker_labels = db.Column(db.Text, nullable=True)  # JSON: {"label": "value"}
 	
+	# Readiness probe run before an instance is handed out, defaults depend on the droplet type
+	readiness_probe = db.Column(db.Text, nullable=True)  # JSON: {"type": "tcp", "port": 6901, "timeout": 60}
+	
+	# Warm Pool Configuration (container droplets only)
+	warm_pool_min = db.Column(db.Integer, nullable=False, default=0)  # pre-started containers to keep ready
+	warm_pool_max = db.Column(db.Integer, nullable=False, default=0)  # upper bound of the pool
+	
+	# Minutes without access after which the idle reaper removes an instance, None uses the global default, 0 never
+	idle_timeout = db.Column(db.Integer, nullable=True)
+	# Minutes without access after which an instance's container is paused until the user returns, same defaults
+	freeze_timeout = db.Column(db.Integer, nullable=True)
+	
 	# Metadata
 	created_at = db.Column(db.DateTime, server_default=func.now())
 	updated_at = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now())
@@ -67,6 +79,23 @@ class Droplet(db.Model):
 		"""Set environment variables from dict"""
 		self.environment_vars = json.dumps(env_dict)
 	
+	def get_readiness_probe(self):
+		"""Parse and return the readiness probe, falling back to the droplet type default"""
+		from utils.probes import DEFAULT_PROBES
+		
+		if self.readiness_probe:
+			try:
+				return json.loads(self.readiness_probe)
+			except:
+				pass
+		if self.droplet_type == "container":
+			return dict(DEFAULT_PROBES["container"])
+		return dict(DEFAULT_PROBES["guacamole"])
+	
+	def set_readiness_probe(self, probe_dict):
+		"""Set readiness probe from dict, None restores the default"""
+		self.readiness_probe = json.dumps(probe_dict) if probe_dict else None
+	
 	def get_exposed_ports(self):
 		"""Parse and return exposed ports as list"""
 		if self.exposed_ports:
@@ -90,6 +119,11 @@ class Droplet(db.Model):
 			'persistent_volumes': self.get_persistent_volumes(),
 			'environment_vars': self.get_environment_vars(),
 			'exposed_ports': self.get_exposed_ports(),
+			'readiness_probe': self.get_readiness_probe(),
+			'warm_pool_min': self.warm_pool_min,
+			'warm_pool_max': self.warm_pool_max,
+			'idle_timeout': self.idle_timeout,
+			'freeze_timeout': self.freeze_timeout,
 			'is_active': self.is_active,
 			'created_at': self.created_at.isoformat() if self.created_at else None,
 			'updated_at': self.updated_at.isoformat() if self.updated_at else None
@@ -104,20 +138,25 @@ class DropletInstance(db.Model):
 	# Container Information
 	container_id = db.Column(db.String(255), nullable=True)  # Docker container ID
 	container_name = db.Column(db.String(255), nullable=True)
-	container_status = db.Column(db.String(50), default='created')  # created, running, stopped, error
+	container_status = db.Column(db.String(50), default='created')  # created, running, paused, stopped, error
+	vnc_password = db.Column(db.String(80), nullable=True)  # set when the container was started without the user's token (warm pool)
 	
 	# Volume Information
 	volume_ids = db.Column(db.Text, nullable=True)  # JSON: ["volume_id_1", "volume_id_2"]
 	volume_path = db.Column(db.String(255), nullable=True)  # Host path for persistent data
 	
 	# Network Information
+	ip = db.Column(db.String(45), nullable=True)  # container address nginx routes to, set once the instance is routed
+	node_id = db.Column(db.String(36), nullable=True)  # DockerNode the container runs on, None for the local node
 	assigned_port = db.Column(db.Integer, nullable=True)
 	access_url = db.Column(db.String(255), nullable=True)
 	
 	# Timestamps
 	created_at = db.Column(db.DateTime, server_default=func.now())
 	updated_at = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now())
-	last_accessed = db.Column(db.DateTime, nullable=True)
+	last_accessed = db.Column(db.DateTime, nullable=True)  # throttled, see services/idle_reaper.py
+	idle_warned_at = db.Column(db.DateTime, nullable=True)  # set once the instance entered its idle grace period
+	paused_at = db.Column(db.DateTime, nullable=True)  # frozen by the idle reaper, unpaused on the next access
 	stopped_at = db.Column(db.DateTime, nullable=True)
 	
 	def get_volume_ids(self):
@@ -144,6 +183,94 @@ class DropletInstance(db.Model):
 			'container_status': self.container_status,
 			'volume_ids': self.get_volume_ids(),
 			'access_url': self.access_url,
+			'node_id': self.node_id,
+			'created_at': self.created_at.isoformat() if self.created_at else None,
+			'last_accessed': self.last_accessed.isoformat() if self.last_accessed else None,
+			'paused_at': self.paused_at.isoformat() if self.paused_at else None
+		} 
+
+class ProvisioningJob(db.Model):
+	"""Background launch of a droplet instance, polled by the dashboard"""
+	id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+	instance_id = db.Column(db.String(36), nullable=False)  # not a foreign key, the instance is deleted if the launch fails
+	droplet_id = db.Column(db.String(36), db.ForeignKey('droplet.id'), nullable=False)
+	user_id = db.Column(db.String(36), db.ForeignKey('user.id'), nullable=False)
+	resolution = db.Column(db.String(20), nullable=True)
+	batch_id = db.Column(db.String(36), nullable=True, index=True)  # set for jobs of an admin bulk launch
+	
+	# State
+	status = db.Column(db.String(20), default='queued')  # queued, running, ready, failed
+	stage = db.Column(db.String(40), nullable=True)  # current launch stage while running
+	error = db.Column(db.String(255), nullable=True)
+	
+	# Timestamps
+	created_at = db.Column(db.DateTime, server_default=func.now())
+	updated_at = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now())
+	finished_at = db.Column(db.DateTime, nullable=True)
+	
+	def is_finished(self):
+		return self.status in ['ready', 'failed']
+	
+	def to_dict(self):
+		"""Convert job to dictionary"""
+		return {
+			'id': self.id,
+			'instance_id': self.instance_id,
+			'droplet_id': self.droplet_id,
+			'user_id': self.user_id,
+			'batch_id': self.batch_id,
+			'status': self.status,
+			'stage': self.stage,
+			'error': self.error,
 			'created_at': self.created_at.isoformat() if self.created_at else None,
-			'last_accessed': self.last_accessed.isoformat() if self.last_accessed else None
-		} 
\ No newline at end of file
+			'finished_at': self.finished_at.isoformat() if self.finished_at else None
+		}
+
+class WarmContainer(db.Model):
+	"""Pre-started container of a droplet waiting to be claimed by a user"""
+	id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))  # becomes the DropletInstance id once claimed
+	droplet_id = db.Column(db.String(36), db.ForeignKey('droplet.id'), nullable=False)
+	container_id = db.Column(db.String(255), nullable=True)
+	vnc_password = db.Column(db.String(80), nullable=False)
+	ip = db.Column(db.String(45), nullable=True)
+	node_id = db.Column(db.String(36), nullable=True)  # DockerNode the container runs on, None for the local node
+	status = db.Column(db.String(20), default='starting')  # starting, ready, claimed
+	created_at = db.Column(db.DateTime, server_default=func.now())
+	claimed_at = db.Column(db.DateTime, nullable=True)
+
+class InstanceReclaim(db.Model):
+	"""Instance paused or removed by the idle reaper, with the resources it gave back"""
+	id = db.Column(db.Integer, primary_key=True)
+	instance_id = db.Column(db.String(36), nullable=False)
+	droplet_id = db.Column(db.String(36), nullable=False)
+	user_id = db.Column(db.String(36), nullable=False)
+	node_id = db.Column(db.String(36), nullable=True)
+	cores = db.Column(db.Float, nullable=False, default=0)
+	memory = db.Column(db.Integer, nullable=False, default=0)  # MB
+	idle_seconds = db.Column(db.Integer, nullable=False)
+	action = db.Column(db.String(20), nullable=False, default='removed')  # paused (cores only), removed
+	reclaimed_at = db.Column(db.DateTime, server_default=func.now(), index=True)
+
+	def to_dict(self):
+		return {
+			'instance_id': self.instance_id,
+			'droplet_id': self.droplet_id,
+			'user_id': self.user_id,
+			'node_id': self.node_id,
+			'cores': self.cores,
+			'memory': self.memory,
+			'idle_seconds': self.idle_seconds,
+			'action': self.action,
+			'reclaimed_at': self.reclaimed_at.isoformat() if self.reclaimed_at else None
+		}
+
+class LaunchPhase(db.Model):
+	"""Duration of one phase of an instance launch, see utils/timing.py"""
+	id = db.Column(db.Integer, primary_key=True)
+	instance_id = db.Column(db.String(36), nullable=False)
+	droplet_id = db.Column(db.String(36), nullable=False, index=True)
+	node_id = db.Column(db.String(36), nullable=True)  # None for the local node
+	phase = db.Column(db.String(20), nullable=False)
+	duration_ms = db.Column(db.Integer, nullable=False)
+	success = db.Column(db.Boolean, nullable=False, default=True)  # False if the launch failed
+	recorded_at = db.Column(db.DateTime, server_default=func.now(), index=True)
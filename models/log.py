@@ -1,8 +1,38 @@
-from sqlalchemy.sql import func
-from __init__ import db
-
-class Log(db.Model):
-	id = db.Column(db.Integer, primary_key=True)
-	created_at = db.Column(db.DateTime, server_default=func.now())
-	level = db.Column(db.String(8), nullable=False) #DEBUG, INFO, WARNING, ERROR
-	message = db.Column(db.String(1024), nullable=False) 
\ No newline at end of file
+import threading
+from sqlalchemy import MetaData, Table, Column, Index, Integer, DateTime, String
+
+# Logs are kept in their own database (the "logs" bind), in one table per day or week named
+# after the partition's first day, so retention drops whole tables. See utils.log_store.
+LOG_PARTITION_PREFIX = "log_"
+
+# Filterable fields of an entry, each indexed together with created_at
+LOG_FIELDS = ["level", "category", "instance_id", "droplet_id", "user_id"]
+
+log_metadata = MetaData()
+_log_tables_lock = threading.Lock()
+
+def log_table(name: str) -> Table:
+	"""Table of one log partition, created by utils.log_store when its first entry is written"""
+	with _log_tables_lock:
+		if name in log_metadata.tables:
+			return log_metadata.tables[name]
+		table = Table(
+			name, log_metadata,
+			Column('id', Integer, primary_key=True),
+			Column('created_at', DateTime, nullable=False, index=True),
+			Column('level', String(8), nullable=False), #DEBUG, INFO, WARNING, ERROR
+			Column('message', String(1024), nullable=False),
+			Column('category', String(32), nullable=True), #image, instance, volume, docker
+			Column('instance_id', String(36), nullable=True),
+			Column('droplet_id', String(36), nullable=True),
+			Column('user_id', String(36), nullable=True)
+		)
+		for field in LOG_FIELDS:
+			Index(f"ix_{name}_{field}_created_at", table.c[field], table.c.created_at)
+		return table
+
+def forget_log_table(name: str):
+	"""Drop a partition's Table from the metadata, after the table itself was dropped"""
+	with _log_tables_lock:
+		if name in log_metadata.tables:
+			log_metadata.remove(log_metadata.tables[name])
@@ -0,0 +1,48 @@
+import uuid
+import json
+from sqlalchemy.sql import func
+from __init__ import db
+
+# Id of the node row of the Docker daemon Flowcase itself runs on
+LOCAL_NODE_ID = "local"
+
+class DockerNode(db.Model):
+	"""Docker daemon droplet containers can be placed on"""
+	id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+	name = db.Column(db.String(80), nullable=False, unique=True)
+	base_url = db.Column(db.String(255), nullable=False)  # unix:// or tcp:// endpoint of the daemon
+	network = db.Column(db.String(80), nullable=False, default='flowcase_default_network')  # must be routable from nginx
+	max_cores = db.Column(db.Float, nullable=True)  # None on the local node: derived from the host
+	max_memory = db.Column(db.Integer, nullable=True)  # MB
+	labels = db.Column(db.Text, nullable=True)  # JSON: {"gpu": "true"}
+	status = db.Column(db.String(20), nullable=False, default='active')  # active, draining
+	created_at = db.Column(db.DateTime, server_default=func.now())
+
+	def is_local(self):
+		return self.id == LOCAL_NODE_ID
+
+	def get_labels(self):
+		"""Parse and return labels as dict"""
+		if self.labels:
+			try:
+				return json.loads(self.labels)
+			except:
+				return {}
+		return {}
+
+	def set_labels(self, labels_dict):
+		"""Set labels from dict"""
+		self.labels = json.dumps(labels_dict) if labels_dict else None
+
+	def to_dict(self):
+		return {
+			'id': self.id,
+			'name': self.name,
+			'base_url': self.base_url,
+			'network': self.network,
+			'max_cores': self.max_cores,
+			'max_memory': self.max_memory,
+			'labels': self.get_labels(),
+			'status': self.status,
+			'created_at': self.created_at.isoformat() if self.created_at else None
+		}
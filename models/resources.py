@@ -0,0 +1,28 @@
+from sqlalchemy.sql import func
+from __init__ import db
+
+class ResourceLedger(db.Model):
+	"""Running totals of reserved cores and memory, one row per scope ('host', 'node:<id>' or 'tenant:<id>')"""
+	scope = db.Column(db.String(64), primary_key=True)
+	cores = db.Column(db.Float, nullable=False, default=0)
+	memory = db.Column(db.Integer, nullable=False, default=0)  # MB
+	updated_at = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now())
+
+	def to_dict(self):
+		return {
+			'scope': self.scope,
+			'cores': self.cores,
+			'memory': self.memory,
+			'updated_at': self.updated_at.isoformat() if self.updated_at else None
+		}
+
+class ResourceReservation(db.Model):
+	"""Resources held by one instance or warm container, released exactly once"""
+	id = db.Column(db.String(36), primary_key=True)  # DropletInstance or WarmContainer id
+	droplet_id = db.Column(db.String(36), nullable=False)
+	tenant_id = db.Column(db.String(36), nullable=True)
+	node_id = db.Column(db.String(36), nullable=True)  # None for the local node
+	cores = db.Column(db.Float, nullable=False)
+	memory = db.Column(db.Integer, nullable=False)
+	status = db.Column(db.String(20), nullable=False, default='reserved')  # reserved, committed, paused (holds no cores)
+	created_at = db.Column(db.DateTime, server_default=func.now())
@@ -11,6 +11,7 @@ class User(UserMixin, db.Model):
 	email = db.Column(db.String(120), unique=True, nullable=True)
 	password = db.Column(db.String(80), nullable=False)
 	auth_token = db.Column(db.String(80), nullable=False)
+	session_epoch = db.Column(db.Integer, nullable=False, default=0)  # bumped on logout, revokes the desktop cookies
 	created_at = db.Column(db.DateTime, server_default=func.now())
 	groups = db.Column(db.String(255), nullable=False)
 	
@@ -20,6 +21,11 @@ class User(UserMixin, db.Model):
 	def get_groups(self):
 		return self.groups.split(',')
  
+class PermissionVersion(db.Model):
+	"""Single row bumped whenever users or groups change, workers drop their cached permissions when it moves"""
+	id = db.Column(db.Integer, primary_key=True)
+	version = db.Column(db.Integer, nullable=False, default=0)
+
 class Group(db.Model):
 	id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
 	display_name = db.Column(db.String(80), nullable=False)
@@ -1,23 +1,44 @@
+import json
+import math
 import platform
 import sys
 import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+import uuid
 import random, string
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
 from sqlalchemy.sql import func
 from __init__ import db, bcrypt, __version__
 from models.user import User, Group
-from models.droplet import Droplet, DropletInstance
+from models.droplet import Droplet, DropletInstance, ProvisioningJob, WarmContainer, InstanceReclaim
+from models.node import DockerNode, LOCAL_NODE_ID
+from models.workshop import UserWorkshop, Workshop, WorkshopTemplate
 from models.registry import Registry
-from models.log import Log
+from utils.log_store import query_logs, query_logs_page, count_logs_cached, iter_logs, log_to_dict
+from models.resources import ResourceLedger
 from utils.permissions import Permissions
+from utils.probes import validate_probe
 import utils.docker
 from utils.schemas import DropletCreateSchema, UserCreateSchema, GroupCreateSchema, RegistryCreateSchema
 from marshmallow import ValidationError
-from utils.logger import prune_logs
+from utils.logger import log, prune_logs, get_log_writer_metrics
+from utils.resources import get_resource_limits, get_node_limits, get_daemon_limits, get_allocated_resources, node_scope
+from utils.timing import get_phase_percentiles
+from utils.nodes import ensure_local_node, get_client, get_node_network, connect, forget_client
+from services.provisioning import provisioning_service, delete_jobs
+from services.scheduler import scheduler
+from services.warm_pool import warm_pool
+from services.password_verifier import password_verifier
+from utils.nginx import reload_coalescer
 
 admin_bp = Blueprint('admin', __name__)
 
+# Streamed bulk launch progress ends before gunicorn's sync worker timeout, clients reconnect
+BULK_LAUNCH_STREAM_WINDOW = 20
+
 @admin_bp.route('/system_info', methods=['GET'])
 @login_required
 def api_admin_system():
@@ -57,6 +78,7 @@ def api_admin_users():
 		return jsonify({"success": False, "error": "Unauthorized"}), 403
 	
 	users = User.query.all()
+	groups = Group.query.all()
  
 	response = {
 		"success": True,
@@ -72,7 +94,6 @@ def api_admin_users():
 		})
 		
 		user_groups = user.groups.split(",")
-		groups = Group.query.all()
 		for group in groups:
 			if group.id in user_groups:
 				response["users"][-1]["groups"].append({
@@ -105,12 +126,13 @@ def api_admin_instances():
 		try:
 			droplet = Droplet.query.filter_by(id=instance.droplet_id).first()
 			user = User.query.filter_by(id=instance.user_id).first()
-			container = utils.docker.docker_client.containers.get(f"flowcase_generated_{instance.id}")
+			container = get_client(instance.node_id).containers.get(f"flowcase_generated_{instance.id}")
 			response["instances"].append({
 				"id": instance.id,
 				"created_at": instance.created_at,
 				"updated_at": instance.updated_at,
-				"ip": container.attrs['NetworkSettings']['Networks']['flowcase_default_network']['IPAddress'],
+				"ip": container.attrs['NetworkSettings']['Networks'][get_node_network(instance.node_id)]['IPAddress'],
+				"node_id": instance.node_id or LOCAL_NODE_ID,
 				"droplet": {
 					"id": droplet.id,
 					"display_name": droplet.display_name,
@@ -132,6 +154,137 @@ def api_admin_instances():
  
 	return jsonify(response)
 
+@admin_bp.route('/instances/bulk', methods=['POST'])
+@login_required
+def api_admin_bulk_launch():
+	"""Launch one instance of a droplet for each of a list of users"""
+	if not Permissions.check_permission(current_user.id, Permissions.EDIT_INSTANCES):
+		return jsonify({"success": False, "error": "Unauthorized"}), 403
+
+	droplet = Droplet.query.filter_by(id=request.json.get('droplet_id')).first()
+	if not droplet:
+		return jsonify({"success": False, "error": "Droplet not found"}), 404
+
+	user_ids = list(dict.fromkeys(request.json.get('user_ids') or []))
+	if not user_ids:
+		return jsonify({"success": False, "error": "No users given"}), 400
+	if len(user_ids) > current_app.config.get('BULK_LAUNCH_MAX_USERS', 200):
+		return jsonify({"success": False, "error": f"At most {current_app.config.get('BULK_LAUNCH_MAX_USERS', 200)} users can be launched at once"}), 400
+
+	if not utils.docker.docker_client:
+		return jsonify({"success": False, "error": "Docker service is not available"}), 503
+
+	users = {user.id: user for user in User.query.filter(User.id.in_(user_ids)).all()}
+	rejected = [{"user_id": user_id, "error": "User not found"} for user_id in user_ids if user_id not in users]
+	users = [users[user_id] for user_id in user_ids if user_id in users]
+	if not users:
+		return jsonify({"success": False, "error": "No valid users given", "rejected": rejected}), 400
+
+	if not scheduler.has_image(droplet):
+		return jsonify({"success": False, "error": "Docker image not found. Image might still be downloading."}), 400
+
+	request_resolution = request.json.get('resolution') or ""
+	if len(request_resolution) < 10 and re.match(r"[0-9]+x[0-9]+", request_resolution):
+		resolution = request_resolution
+	else:
+		resolution = "1280x720"
+
+	batch_id = str(uuid.uuid4())
+	jobs = []
+	instances = []
+	for user in users:
+		instance = DropletInstance(droplet_id=droplet.id, user_id=user.id, container_status='creating')
+		db.session.add(instance)
+		db.session.flush()
+		job = ProvisioningJob(instance_id=instance.id, droplet_id=droplet.id, user_id=user.id, resolution=resolution, batch_id=batch_id)
+		db.session.add(job)
+		jobs.append(job)
+		instances.append(instance)
+
+	# The whole batch is admitted in one transaction, each instance on the node that fits it best,
+	# a refused batch leaves nothing behind. Guacamole droplets are recorded but not limited.
+	success, error = scheduler.place_batch(droplet, instances, [user.tenant_id for user in users], f"bulk launch by {current_user.username}",
+										   enforce=droplet.droplet_type not in ["vnc", "rdp", "ssh"], require_image=True)
+	if not success:
+		return jsonify({"success": False, "error": error}), 400
+
+	job_ids = [job.id for job in jobs]
+	parallelism = current_app.config.get('BULK_LAUNCH_PARALLELISM', 8)
+	if not provisioning_service.submit_task(current_app._get_current_object(), provisioning_service.run_batch, job_ids, parallelism):
+		provisioning_service.destroy_instances([job.instance_id for job in jobs])
+		ProvisioningJob.query.filter_by(batch_id=batch_id).delete(synchronize_session=False)
+		db.session.commit()
+		return jsonify({"success": False, "error": "Too many instances are being launched right now. Please try again in a moment."}), 503
+
+	log("INFO", f"User {current_user.username} started a bulk launch of {len(jobs)} instances of droplet {droplet.display_name}")
+
+	return jsonify({
+		"success": True,
+		"batch_id": batch_id,
+		"jobs": [{"user_id": job.user_id, "job_id": job.id, "instance_id": job.instance_id} for job in jobs],
+		"rejected": rejected
+	}), 202
+
+def _bulk_launch_progress(jobs):
+	"""Summary line of a bulk launch"""
+	counts = {status: 0 for status in ['queued', 'running', 'ready', 'failed']}
+	for job in jobs:
+		counts[job.status] = counts.get(job.status, 0) + 1
+	return {
+		"type": "summary",
+		"total": len(jobs),
+		"counts": counts,
+		"finished": all(job.is_finished() for job in jobs)
+	}
+
+@admin_bp.route('/instances/bulk/<string:batch_id>', methods=['GET'])
+@login_required
+def api_admin_bulk_launch_status(batch_id):
+	"""
+	Progress of a bulk launch
+
+	With ?stream=1 per-user progress is streamed as NDJSON, one line per job status
+	change, until the batch finishes or BULK_LAUNCH_STREAM_WINDOW passes. Clients
+	reconnect to keep following a batch that is still running.
+	"""
+	if not Permissions.check_permission(current_user.id, Permissions.VIEW_INSTANCES):
+		return jsonify({"success": False, "error": "Unauthorized"}), 403
+
+	jobs = ProvisioningJob.query.filter_by(batch_id=batch_id).all()
+	if not jobs:
+		return jsonify({"success": False, "error": "Batch not found"}), 404
+
+	usernames = {user.id: user.username for user in User.query.filter(User.id.in_([job.user_id for job in jobs])).all()}
+
+	def job_line(job):
+		return dict(job.to_dict(), type="job", username=usernames.get(job.user_id))
+
+	if request.args.get('stream') != '1':
+		return jsonify({
+			"success": True,
+			"jobs": [job_line(job) for job in jobs],
+			"summary": _bulk_launch_progress(jobs)
+		})
+
+	def generate():
+		deadline = time.monotonic() + BULK_LAUNCH_STREAM_WINDOW
+		seen = {}
+		while True:
+			db.session.expire_all()
+			jobs = ProvisioningJob.query.filter_by(batch_id=batch_id).all()
+			for job in jobs:
+				if seen.get(job.id) != (job.status, job.stage):
+					seen[job.id] = (job.status, job.stage)
+					yield json.dumps(job_line(job), default=str) + "\n"
+
+			summary = _bulk_launch_progress(jobs)
+			if summary["finished"] or time.monotonic() >= deadline:
+				yield json.dumps(summary) + "\n"
+				return
+			time.sleep(0.5)
+
+	return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
 @admin_bp.route('/droplets', methods=['GET'])
 @login_required
 def api_admin_droplets():
@@ -158,6 +311,11 @@ def api_admin_droplets():
 			"container_cores": droplet.container_cores,
 			"container_memory": droplet.container_memory,
 			"container_persistent_profile_path": droplet.container_persistent_profile_path,
+			"readiness_probe": droplet.readiness_probe,
+			"warm_pool_min": droplet.warm_pool_min,
+			"warm_pool_max": droplet.warm_pool_max,
+			"idle_timeout": droplet.idle_timeout,
+			"freeze_timeout": droplet.freeze_timeout,
 			"server_ip": droplet.server_ip,
 			"server_port": droplet.server_port,
 			"server_username": droplet.server_username,
@@ -180,10 +338,14 @@ def api_admin_edit_droplet():
 		create_new = True
 		droplet = Droplet()
   
-	# Validate input using schema
+	# Validate input using schema, an empty timeout uses the global default
+	payload = dict(request.get_json())
+	for key in ('idle_timeout', 'freeze_timeout'):
+		if payload.get(key) == "":
+			payload[key] = None
 	schema = DropletCreateSchema()
 	try:
-		data = schema.load(request.get_json())
+		data = schema.load(payload)
 	except ValidationError as err:
 		return jsonify({"success": False, "error": err.messages}), 400
 
@@ -198,6 +360,23 @@ def api_admin_edit_droplet():
 	droplet.display_name = data['display_name']
 	droplet.droplet_type = data['droplet_type']
 
+	# Readiness probe, empty keeps the default for the droplet type
+	readiness_probe = data.get('readiness_probe')
+	if readiness_probe:
+		try:
+			readiness_probe = json.loads(readiness_probe)
+		except ValueError:
+			return jsonify({"success": False, "error": "Readiness probe must be valid JSON"}), 400
+		probe_error = validate_probe(readiness_probe)
+		if probe_error:
+			return jsonify({"success": False, "error": probe_error}), 400
+	droplet.set_readiness_probe(readiness_probe)
+
+	# Idle and pause timeouts in whole minutes, the schema refused anything else or below 0.
+	# None uses the global default and 0 disables them
+	droplet.idle_timeout = data.get('idle_timeout')
+	droplet.freeze_timeout = data.get('freeze_timeout')
+
 	# Container specific fields
 	if droplet.droplet_type == "container":
 		droplet.container_docker_registry = data.get('container_docker_registry')
@@ -226,6 +405,12 @@ def api_admin_edit_droplet():
 		if not droplet.container_persistent_profile_path:
 			droplet.container_persistent_profile_path = None
 
+		# Whole numbers from 0, the schema refused anything else, so they compare as numbers
+		droplet.warm_pool_min = data.get('warm_pool_min') or 0
+		droplet.warm_pool_max = data.get('warm_pool_max') or 0
+		if droplet.warm_pool_max < droplet.warm_pool_min:
+			return jsonify({"success": False, "error": "Warm pool maximum cannot be lower than its minimum"}), 400
+
 	# Non-container droplet types
 	elif droplet.droplet_type in ["vnc", "rdp", "ssh"]:
 		droplet.server_ip = data.get('server_ip')
@@ -269,27 +454,17 @@ def api_admin_delete_droplet():
 	if not droplet:
 		return jsonify({"success": False, "error": "Droplet not found"}), 404
  
+	warm_pool.drain(droplet_id)
+
+	# Delete any instances of this droplet, their containers are removed in parallel if Docker is available
+	instances = DropletInstance.query.filter_by(droplet_id=droplet_id).all()
+	provisioning_service.destroy_instances([instance.id for instance in instances])
+
+	# Rows referencing the droplet go first, databases enforcing foreign keys refuse the delete otherwise
+	delete_jobs(droplet_id=droplet_id)
 	db.session.delete(droplet)
 	db.session.commit()
  
-	# Delete any instances of this droplet
-	instances = DropletInstance.query.filter_by(droplet_id=droplet_id).all()
-	
-	if utils.docker.is_docker_available():
-		for instance in instances:
-			try:
-				container = utils.docker.docker_client.containers.get(f"flowcase_generated_{instance.id}")
-				container.remove(force=True)
-			except Exception as e:
-				pass  # Container might not exist
-			db.session.delete(instance)
-			db.session.commit()
-	else:
-		# Even if Docker is not available, we should still delete the DB records
-		for instance in instances:
-			db.session.delete(instance)
-		db.session.commit()
- 
 	return jsonify({"success": True})
 
 @admin_bp.route('/instance', methods=['DELETE'])
@@ -303,15 +478,7 @@ def api_admin_delete_instance():
 	if not instance:
 		return jsonify({"success": False, "error": "Instance not found"}), 404
  
-	if utils.docker.is_docker_available():
-		try:
-			container = utils.docker.docker_client.containers.get(f"flowcase_generated_{instance.id}")
-			container.remove(force=True)
-		except Exception as e:
-			pass  # Container might not exist
-	
-	db.session.delete(instance)
-	db.session.commit()
+	provisioning_service.destroy_instances([instance.id])
  
 	return jsonify({"success": True})
 
@@ -351,6 +518,7 @@ def api_admin_edit_user():
 		db.session.add(user)
  
 	db.session.commit()
+	Permissions.invalidate()
  
 	return jsonify({"success": True})
 
@@ -364,27 +532,19 @@ def api_admin_delete_user():
 	user = User.query.filter_by(id=user_id).first()
 	if not user:
 		return jsonify({"success": False, "error": "User not found"}), 404
+	if Workshop.query.filter_by(created_by=user_id).count() or WorkshopTemplate.query.filter_by(created_by=user_id).count():
+		return jsonify({"success": False, "error": "User still owns workshops or workshop templates, delete them first"}), 400
  
+	# Delete any instances of this user, on whichever node they run
+	instances = DropletInstance.query.filter_by(user_id=user_id).all()
+	provisioning_service.destroy_instances([instance.id for instance in instances])
+
+	# Rows referencing the user go first, databases enforcing foreign keys refuse the delete otherwise
+	delete_jobs(user_id=user_id)
+	UserWorkshop.query.filter_by(user_id=user_id).delete(synchronize_session=False)
 	db.session.delete(user)
 	db.session.commit()
- 
-	# Delete any instances of this user
-	instances = DropletInstance.query.filter_by(user_id=user_id).all()
-	
-	if utils.docker.is_docker_available():
-		for instance in instances:
-			try:
-				container = utils.docker.docker_client.containers.get(f"flowcase_generated_{instance.id}")
-				container.remove(force=True)
-			except Exception as e:
-				pass  # Container might not exist
-			db.session.delete(instance)
-			db.session.commit()
-	else:
-		# Even if Docker is not available, we should still delete the DB records
-		for instance in instances:
-			db.session.delete(instance)
-		db.session.commit()
+	Permissions.invalidate()
  
 	return jsonify({"success": True})
 
@@ -474,6 +634,7 @@ def api_admin_edit_group():
 		db.session.add(group)
  
 	db.session.commit()
+	Permissions.invalidate()
  
 	return jsonify({"success": True})
 
@@ -493,6 +654,7 @@ def api_admin_delete_group():
  
 	db.session.delete(group)
 	db.session.commit()
+	Permissions.invalidate()
  
 	return jsonify({"success": True})
 
@@ -572,20 +734,30 @@ def api_admin_edit_registry():
 @admin_bp.route('/logs', methods=['GET'])
 @login_required
 def api_admin_logs():
+	"""
+	Logs newest first, a page at a time after the cursor returned with the previous page
+
+	The total is only counted with include_total=true, and reused for a minute. Numbered pages
+	of older clients are still served, with their total.
+	"""
 	if not current_user.has_permission(Permissions.ADMIN_PANEL):
 		return jsonify({"success": False, "error": "You do not have permission to view logs"})
 	
-	page = request.args.get('page', 1, type=int)
-	per_page = request.args.get('per_page', 50, type=int)
-	log_type = request.args.get('type', None)
-	
-	query = Log.query
-	
-	if log_type and log_type.upper() in ['DEBUG', 'INFO', 'WARNING', 'ERROR']:
-		query = query.filter(Log.level == log_type.upper())
+	page = request.args.get('page', None, type=int)
+	per_page = max(request.args.get('per_page', 50, type=int), 1)
+	cursor = request.args.get('cursor')
+	include_total = request.args.get('include_total', 'false').lower() == 'true' or page is not None
+	level, filters, search = _log_filters()
 	
-	logs_pagination = query.order_by(Log.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
-	logs = logs_pagination.items
+	next_cursor = None
+	if page and page > 1 and not cursor:
+		logs = query_logs(search, offset=(page - 1) * per_page, limit=per_page, level=level, **filters)
+	else:
+		try:
+			logs, next_cursor = query_logs_page(search, cursor, per_page, level=level, **filters)
+		except ValueError as e:
+			return jsonify({"success": False, "error": str(e)}), 400
+	total = count_logs_cached(search, level=level, **filters) if include_total else None
 	
 	return jsonify({
 		"success": True,
@@ -594,17 +766,74 @@ def api_admin_logs():
 				"id": log.id,
 				"created_at": log.created_at.strftime('%Y-%m-%d %H:%M:%S'),
 				"level": log.level,
-				"message": log.message
+				"message": log.message,
+				"category": log.category,
+				"instance_id": log.instance_id,
+				"droplet_id": log.droplet_id,
+				"user_id": log.user_id
 			} for log in logs
 		],
 		"pagination": {
-			"page": page,
+			"page": max(page or 1, 1),
 			"per_page": per_page,
-			"total": logs_pagination.total,
-			"pages": logs_pagination.pages
+			"next_cursor": next_cursor,
+			"total": total,
+			"pages": math.ceil(total / per_page) if total is not None else None
 		}
 	}) 
 
+def _log_filters():
+	"""Level, indexed field filters and full text search of a logs request"""
+	log_type = request.args.get('type', None)
+	level = log_type.upper() if log_type and log_type.upper() in ['DEBUG', 'INFO', 'WARNING', 'ERROR'] else None
+	filters = {field: request.args.get(field) for field in ['category', 'instance_id', 'droplet_id', 'user_id']}
+	return level, filters, request.args.get('search')
+
+def _utc_datetime(value):
+	"""Naive UTC datetime of an ISO 8601 date, as log times are stored, None if empty"""
+	if not value:
+		return None
+	parsed = datetime.fromisoformat(value)
+	if parsed.tzinfo is not None:
+		parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+	return parsed
+
+@admin_bp.route('/logs/export', methods=['GET'])
+@login_required
+def api_admin_export_logs():
+	"""
+	Stream the logs oldest first as NDJSON, one entry per line, optionally between since and until (ISO 8601, UTC)
+
+	Rows are read in batches and written out as they come, the worker never holds the whole export.
+	"""
+	if not current_user.has_permission(Permissions.ADMIN_PANEL):
+		return jsonify({"success": False, "error": "Unauthorized"}), 403
+
+	level, filters, search = _log_filters()
+	try:
+		since, until = (_utc_datetime(request.args.get(bound)) for bound in ('since', 'until'))
+	except ValueError:
+		return jsonify({"success": False, "error": "since and until must be ISO 8601 dates"}), 400
+
+	def generate():
+		for partition, row in iter_logs(search, since, until, level=level, **filters):
+			yield json.dumps({**log_to_dict(row), "partition": partition}) + "\n"
+
+	return Response(
+		stream_with_context(generate()),
+		mimetype='application/x-ndjson',
+		headers={"Content-Disposition": "attachment; filename=flowcase-logs.ndjson"}
+	)
+
+@admin_bp.route('/logs/metrics', methods=['GET'])
+@login_required
+def api_admin_log_metrics():
+	"""Queue depth of this worker's log writer, with the messages it wrote, dropped and failed to write"""
+	if not current_user.has_permission(Permissions.ADMIN_PANEL):
+		return jsonify({"success": False, "error": "Unauthorized"}), 403
+
+	return jsonify({"success": True, "writer": get_log_writer_metrics()})
+
 @admin_bp.route('/logs/prune', methods=['POST'])
 @login_required
 def api_admin_prune_logs():
@@ -620,6 +849,224 @@ def api_admin_prune_logs():
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+@admin_bp.route('/warm-pools', methods=['GET'])
+@login_required
+def api_admin_warm_pools():
+	"""Get the size of every droplet warm pool"""
+	if not Permissions.check_permission(current_user.id, Permissions.VIEW_DROPLETS):
+		return jsonify({"success": False, "error": "Unauthorized"}), 403
+
+	return jsonify({
+		"success": True,
+		"pools": warm_pool.status()
+	})
+
+@admin_bp.route('/resources', methods=['GET'])
+@login_required
+def api_admin_resources():
+	"""Get the resource ledger: reserved cores and memory of the host and of each tenant"""
+	if not Permissions.check_permission(current_user.id, Permissions.VIEW_INSTANCES):
+		return jsonify({"success": False, "error": "Unauthorized"}), 403
+
+	max_cores, max_memory = get_resource_limits()
+	return jsonify({
+		"success": True,
+		"limits": {"cores": max_cores, "memory": max_memory},
+		"ledger": [ledger.to_dict() for ledger in ResourceLedger.query.all()]
+	})
+
+@admin_bp.route('/reaper', methods=['GET'])
+@login_required
+def api_admin_reaper():
+	"""Instances paused or removed by the idle reaper and the resources they gave back, over the last hours (24 by default)"""
+	if not Permissions.check_permission(current_user.id, Permissions.VIEW_INSTANCES):
+		return jsonify({"success": False, "error": "Unauthorized"}), 403
+
+	hours = request.args.get('hours', 24, type=int)
+	since = datetime.utcnow() - timedelta(hours=max(hours, 1))
+	totals = db.session.query(
+		InstanceReclaim.action,
+		func.count(InstanceReclaim.id),
+		func.sum(InstanceReclaim.cores),
+		func.sum(InstanceReclaim.memory)
+	).filter(InstanceReclaim.reclaimed_at >= since).group_by(InstanceReclaim.action).all()
+	reclaimed = {action: {"instances": 0, "cores": 0, "memory": 0} for action in ["paused", "removed"]}
+	for action, count, cores, memory in totals:
+		reclaimed[action] = {"instances": count, "cores": cores or 0, "memory": memory or 0}
+	recent = InstanceReclaim.query.order_by(InstanceReclaim.reclaimed_at.desc(), InstanceReclaim.id.desc()).limit(50).all()
+
+	return jsonify({
+		"success": True,
+		"hours": hours,
+		"reclaimed": reclaimed,
+		"paused": DropletInstance.query.filter_by(container_status='paused').count(),
+		"recent": [reclaim.to_dict() for reclaim in recent]
+	})
+
+@admin_bp.route('/launch-timings', methods=['GET'])
+@login_required
+def api_admin_launch_timings():
+	"""p50/p95/p99 of each launch phase in milliseconds over the last hours (24 by default), overall, per droplet and per node"""
+	if not Permissions.check_permission(current_user.id, Permissions.VIEW_INSTANCES):
+		return jsonify({"success": False, "error": "Unauthorized"}), 403
+
+	hours = request.args.get('hours', 24, type=int)
+	include_failed = request.args.get('include_failed', 'false').lower() == 'true'
+	since = datetime.utcnow() - timedelta(hours=max(hours, 1))
+
+	return jsonify({
+		"success": True,
+		"hours": hours,
+		**get_phase_percentiles(since, include_failed)
+	})
+
+@admin_bp.route('/docker/metrics', methods=['GET'])
+@login_required
+def api_admin_docker_metrics():
+	"""Connection reuse of the pooled Docker clients of this worker"""
+	if not Permissions.check_permission(current_user.id, Permissions.VIEW_INSTANCES):
+		return jsonify({"success": False, "error": "Unauthorized"}), 403
+
+	return jsonify({"success": True, "clients": utils.docker.get_client_metrics()})
+
+@admin_bp.route('/login/metrics', methods=['GET'])
+@login_required
+def api_admin_login_metrics():
+	"""Queue depth of the login password checks, on the host and in this worker"""
+	if not Permissions.check_permission(current_user.id, Permissions.VIEW_USERS):
+		return jsonify({"success": False, "error": "Unauthorized"}), 403
+
+	return jsonify({"success": True, **password_verifier.get_metrics()})
+
+@admin_bp.route('/nodes', methods=['GET'])
+@login_required
+def api_admin_nodes():
+	"""List the Docker nodes with their reserved resources and instance counts"""
+	if not Permissions.check_permission(current_user.id, Permissions.VIEW_INSTANCES):
+		return jsonify({"success": False, "error": "Unauthorized"}), 403
+
+	ensure_local_node()
+	counts = dict(db.session.query(DropletInstance.node_id, func.count(DropletInstance.id)).group_by(DropletInstance.node_id).all())
+	nodes = []
+	for node in DockerNode.query.order_by(DockerNode.created_at).all():
+		max_cores, max_memory = get_node_limits(node)
+		cores, memory = get_allocated_resources(node_scope(node.id))
+		nodes.append({
+			**node.to_dict(),
+			"reachable": get_client(node.id) is not None,
+			"limits": {"cores": max_cores, "memory": max_memory},
+			"allocated": {"cores": cores, "memory": memory},
+			"instances": counts.get(None if node.is_local() else node.id, 0)
+		})
+	return jsonify({"success": True, "strategy": scheduler.strategy, "nodes": nodes})
+
+@admin_bp.route('/node', methods=['POST'])
+@login_required
+def api_admin_edit_node():
+	"""Register or update a Docker node, its capacity is read from the daemon unless given"""
+	if not Permissions.check_permission(current_user.id, Permissions.EDIT_INSTANCES):
+		return jsonify({"success": False, "error": "Unauthorized"}), 403
+
+	node_id = request.json.get('id')
+	node = DockerNode.query.get(node_id) if node_id else DockerNode(base_url="")
+	if not node:
+		return jsonify({"success": False, "error": "Node not found"}), 404
+
+	node.name = request.json.get('name') or node.name
+	if not node.is_local():
+		node.base_url = request.json.get('base_url') or node.base_url
+	node.network = request.json.get('network') or node.network or 'flowcase_default_network'
+	if 'labels' in request.json:
+		if not isinstance(request.json['labels'], dict):
+			return jsonify({"success": False, "error": "Labels must be an object"}), 400
+		node.set_labels(request.json['labels'])
+	if not node.name or not node.base_url:
+		return jsonify({"success": False, "error": "Name and base_url are required"}), 400
+
+	try:
+		if request.json.get('max_cores') is not None:
+			node.max_cores = float(request.json['max_cores'])
+		if request.json.get('max_memory') is not None:
+			node.max_memory = int(request.json['max_memory'])
+	except (TypeError, ValueError):
+		return jsonify({"success": False, "error": "max_cores and max_memory must be numbers"}), 400
+
+	if not node.is_local():
+		if node.id:
+			forget_client(node.id)
+		try:
+			client = connect(node.base_url)
+			if not node.max_cores or not node.max_memory:
+				max_cores, max_memory = get_daemon_limits(client.info())
+				node.max_cores = node.max_cores or max_cores
+				node.max_memory = node.max_memory or int(max_memory)
+		except Exception as e:
+			return jsonify({"success": False, "error": f"Docker node is not reachable: {str(e)}"}), 400
+
+	if not node_id:
+		db.session.add(node)
+	db.session.commit()
+	log("INFO", f"Docker node {node.name} ({node.base_url}) saved by {current_user.username}")
+	return jsonify({"success": True, "node": node.to_dict()})
+
+@admin_bp.route('/node/<string:node_id>/drain', methods=['POST'])
+@login_required
+def api_admin_drain_node(node_id):
+	"""Stop or resume placing new containers on a node, running instances stay where they are"""
+	if not Permissions.check_permission(current_user.id, Permissions.EDIT_INSTANCES):
+		return jsonify({"success": False, "error": "Unauthorized"}), 403
+
+	ensure_local_node()
+	node = DockerNode.query.get(node_id)
+	if not node:
+		return jsonify({"success": False, "error": "Node not found"}), 404
+
+	drain = bool((request.json or {}).get('drain', True))
+	node.status = 'draining' if drain else 'active'
+	db.session.commit()
+
+	# Idle warm containers would keep the node busy, real instances are left alone
+	discarded = 0
+	if drain:
+		for warm in WarmContainer.query.filter_by(node_id=None if node.is_local() else node.id, status='ready').all():
+			warm_pool.discard(warm)
+			discarded += 1
+
+	log("INFO", f"Docker node {node.name} {'drained' if drain else 'resumed'} by {current_user.username}")
+	return jsonify({"success": True, "node": node.to_dict(), "discarded_warm_containers": discarded})
+
+@admin_bp.route('/node/<string:node_id>', methods=['DELETE'])
+@login_required
+def api_admin_delete_node(node_id):
+	"""Remove a drained node once nothing runs on it anymore"""
+	if not Permissions.check_permission(current_user.id, Permissions.EDIT_INSTANCES):
+		return jsonify({"success": False, "error": "Unauthorized"}), 403
+
+	node = DockerNode.query.get(node_id)
+	if not node:
+		return jsonify({"success": False, "error": "Node not found"}), 404
+	if node.is_local():
+		return jsonify({"success": False, "error": "The local node can only be drained"}), 400
+	if DropletInstance.query.filter_by(node_id=node.id).count() or WarmContainer.query.filter_by(node_id=node.id).count():
+		return jsonify({"success": False, "error": "Node still has instances, drain it and wait for them to stop"}), 400
+
+	forget_client(node.id)
+	db.session.delete(node)
+	db.session.commit()
+	return jsonify({"success": True})
+
+@admin_bp.route('/nginx/metrics', methods=['GET'])
+@login_required
+def api_admin_nginx_metrics():
+	"""Get reload counts and latency of this worker's nginx reload coalescer"""
+	if not Permissions.check_permission(current_user.id, Permissions.VIEW_DROPLETS):
+		return jsonify({"success": False, "error": "Unauthorized"}), 403
+
+	return jsonify({
+		"success": True,
+		"metrics": reload_coalescer.metrics()
+	})
+
 @admin_bp.route('/images/status', methods=['GET'])
 @login_required
 def api_admin_images_status():
@@ -742,9 +1189,7 @@ def api_admin_image_logs():
 
 	try:
 		# Get recent logs related to Docker image operations
-		recent_logs = Log.query.filter(
-			Log.message.like('%Docker image%')
-		).order_by(Log.created_at.desc()).limit(50).all()
+		recent_logs = query_logs(limit=50, category='image')
 		
 		logs = []
 		for log in recent_logs:
@@ -3,14 +3,16 @@ Admin API Routes
 Provides API endpoints for the admin panel
 """
 
+import math
 from flask import Blueprint, jsonify, request
 from flask_login import login_required, current_user
 from functools import wraps
+from sqlalchemy import text
 from models.user import User
 from models.droplet import Droplet, DropletInstance
 from models.tenant import Tenant
 from models.workshop import Workshop
-from models.log import Log
+from utils.log_store import query_logs, query_logs_page, count_logs_cached
 from services.droplet_manager import droplet_manager
 from __init__ import db
 from utils.logger import log
@@ -83,7 +85,7 @@ def list_users():
                 'email': user.email,
                 'is_active': user.is_active,
                 'created_at': user.created_at.isoformat() if user.created_at else None,
-                'last_login': user.last_login.isoformat() if user.last_login else None,
+                'last_login': None,  # logins are not recorded
                 'tenant_id': user.tenant_id
             })
         
@@ -92,7 +94,7 @@ def list_users():
             'users': users_data,
             'total': pagination.total,
             'pages': pagination.pages,
-            'current_page': page
+            'current_page': pagination.page
         })
         
     except Exception as e:
@@ -118,7 +120,7 @@ def get_user(user_id):
             'email': user.email,
             'is_active': user.is_active,
             'created_at': user.created_at.isoformat() if user.created_at else None,
-            'last_login': user.last_login.isoformat() if user.last_login else None,
+            'last_login': None,  # logins are not recorded
             'tenant_id': user.tenant_id,
             'instance_count': len(instances),
             'instances': [inst.to_dict() for inst in instances]
@@ -151,7 +153,7 @@ def list_droplets():
             'droplets': droplets_data,
             'total': pagination.total,
             'pages': pagination.pages,
-            'current_page': page
+            'current_page': pagination.page
         })
         
     except Exception as e:
@@ -366,36 +368,47 @@ def list_workshops():
 @login_required
 @admin_required
 def get_logs():
-    """Get system logs with pagination"""
+    """Get system logs newest first, a page at a time after the cursor of the previous page (numbered pages still work)"""
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 50, type=int)
+        page = request.args.get('page', None, type=int)
+        per_page = max(request.args.get('per_page', 50, type=int), 1)
+        cursor = request.args.get('cursor')
         level = request.args.get('level', None)
+        include_total = request.args.get('include_total', 'false').lower() == 'true' or page is not None
         
-        query = Log.query
-        
-        if level:
-            query = query.filter_by(level=level)
+        filters = {field: request.args.get(field) for field in ['category', 'instance_id', 'droplet_id', 'user_id']}
+        search = request.args.get('search')
         
-        pagination = query.order_by(Log.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        next_cursor = None
+        if page and page > 1 and not cursor:
+            logs = query_logs(search, offset=(page - 1) * per_page, limit=per_page, level=level, **filters)
+        else:
+            try:
+                logs, next_cursor = query_logs_page(search, cursor, per_page, level=level, **filters)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+        total = count_logs_cached(search, level=level, **filters) if include_total else None
         
         logs_data = []
-        for log in pagination.items:
+        for log in logs:
             logs_data.append({
                 'id': log.id,
                 'level': log.level,
                 'message': log.message,
+                'category': log.category,
+                'instance_id': log.instance_id,
+                'droplet_id': log.droplet_id,
+                'user_id': log.user_id,
                 'created_at': log.created_at.isoformat() if log.created_at else None
             })
         
         return jsonify({
             'success': True,
             'logs': logs_data,
-            'total': pagination.total,
-            'pages': pagination.pages,
-            'current_page': page
+            'next_cursor': next_cursor,
+            'total': total,
+            'pages': math.ceil(total / per_page) if total is not None else None,
+            'current_page': max(page or 1, 1)
         })
         
     except Exception as e:
@@ -411,7 +424,7 @@ def system_health():
         # Check database
         db_healthy = True
         try:
-            db.session.execute('SELECT 1')
+            db.session.execute(text('SELECT 1'))
         except:
             db_healthy = False
         
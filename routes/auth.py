@@ -1,15 +1,26 @@
+import re
 import random
 import string
-from flask import Blueprint, request, redirect, url_for, render_template, make_response, session
+from flask import Blueprint, request, redirect, url_for, render_template, make_response, session, current_app
 from flask_login import login_user, logout_user, login_required, current_user
 from __init__ import db, bcrypt, login_manager
 from models.user import User
 from utils.logger import log
+from services.idle_reaper import idle_reaper
+from utils.desktop_auth import DESKTOP_COOKIE, verify_desktop_cookie, verify_legacy_token, revoke_desktop_cookies
+from utils.user_cache import load_user_snapshot
+from services.password_verifier import password_verifier, PasswordVerifierBusy
 
 auth_bp = Blueprint('auth', __name__)
 
+# nginx passes the URI of the desktop request being authorized
+DESKTOP_URI = re.compile(r'^/desktop/([A-Za-z0-9-]+)/')
+
 @login_manager.user_loader
 def load_user(user_id):
+	# Optionally a cached read only snapshot, refreshed when users or groups change
+	if current_app.config.get('USER_LOADER_CACHE'):
+		return load_user_snapshot(user_id)
 	return User.query.get(user_id)
 
 @auth_bp.route('/')
@@ -83,8 +94,20 @@ def login():
 	password = request.form['password']
 	remember = request.form.get('remember', False)
 	user = User.query.filter_by(username=username).first()
+
+	valid = False
+	if user:
+		try:
+			valid, new_hash = password_verifier.verify(user.password, password)
+		except PasswordVerifierBusy:
+			session['error'] = "Too many sign-ins right now, please try again in a moment."
+			return redirect(url_for('auth.index'))
+		if new_hash:
+			# Stored hashes follow the configured bcrypt cost
+			user.password = new_hash
+			db.session.commit()
 	
-	if user and bcrypt.check_password_hash(user.password, password):
+	if valid:
 		login_user(user, remember=remember)
 
 		response = make_response(redirect(url_for('auth.dashboard')))
@@ -101,6 +124,8 @@ def login():
 @auth_bp.route('/logout')
 @login_required
 def logout():
+	# Desktop cookies copied from this browser stop working too
+	revoke_desktop_cookies(current_user.id)
 	logout_user()
  
 	# Delete cookies
@@ -112,18 +137,22 @@ def logout():
 
 @auth_bp.route('/droplet_connect', methods=['GET'])
 def droplet_connect():
-	userid = request.cookies.get("userid")
-	token = request.cookies.get("token")
- 
-	if not userid or not token:
-		return make_response("", 401)
+	"""nginx auth_request of every desktop request, kept free of database reads on the common path"""
+	match = DESKTOP_URI.match(request.headers.get("X-Original-URI", ""))
+	instance_id = match.group(1) if match else None
+
+	# The signed cookie of the desktop is checked with its HMAC alone
+	authorized = bool(instance_id) and verify_desktop_cookie(request.cookies.get(DESKTOP_COOKIE), instance_id) is not None
 
-	user = User.query.filter_by(id=userid).first()
-	if not user:
-		return make_response("", 401)
+	if not authorized:
+		userid = request.cookies.get("userid")
+		token = request.cookies.get("token")
+		if not userid or not token or not verify_legacy_token(userid, token):
+			return make_response("", 401)
 
-	if user.auth_token != token:
-		return make_response("", 401)
+	# Every proxied desktop request counts as an access of its instance
+	if instance_id:
+		idle_reaper.touch(instance_id)
 	
 	return make_response("", 200)
 
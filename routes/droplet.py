@@ -1,19 +1,24 @@
 import os
 import re
-import time
 import base64
 import json
-from typing import Tuple
-import docker
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad, unpad
-from flask import Blueprint, jsonify, request, render_template, redirect, make_response, send_from_directory
+from flask import Blueprint, jsonify, request, render_template, redirect, make_response, send_from_directory, current_app
 from flask_login import login_required, current_user
-import psutil
-from __init__ import db, __version__
-from models.droplet import Droplet, DropletInstance
+from __init__ import db
+from models.droplet import Droplet, DropletInstance, ProvisioningJob
 from models.user import User
 from utils.logger import log
+from utils.nginx import unroute_instance, reload_nginx
+from utils.resources import release_resources
+from utils.nodes import remove_container
+from utils.timing import PhaseTimer
+from utils.desktop_auth import set_desktop_cookie
+from services.provisioning import provisioning_service
+from services.warm_pool import warm_pool
+from services.scheduler import scheduler
+from services.idle_reaper import idle_reaper
 import utils.docker
 import threading
 
@@ -85,10 +90,13 @@ def get_instances():
  
 	for instance in instances:
 		droplet = Droplet.query.filter_by(id=instance.droplet_id).first()
+		idle_expires_at = idle_reaper.idle_expires_at(instance, droplet)
 		response["instances"].append({
 			"id": instance.id,
 			"created_at": instance.created_at,
 			"updated_at": instance.updated_at,
+			"idle_expires_at": idle_expires_at.isoformat() if idle_expires_at else None,
+			"paused": instance.container_status == 'paused',
 			"droplet": {
 				"id": droplet.id,
 				"display_name": droplet.display_name,
@@ -119,302 +127,74 @@ def request_new_instance():
 	if droplet.droplet_type in ["vnc", "rdp", "ssh"]:
 		isGuacDroplet = True
 
-	# Check if system has enough resources to request this droplet, guacamole droplets do not have resource checks
-	if not isGuacDroplet:
-		success, error = check_resources(droplet)
-		if not success:
-			return jsonify({"success": False, "error": error}), 400
- 
 	# Check if docker client is available
 	if not utils.docker.docker_client:
-		log("ERROR", "Docker client not available")
+		log("ERROR", "Docker client not available", category="docker", droplet_id=droplet.id, user_id=current_user.id)
 		return jsonify({"success": False, "error": "Docker service is not available"}), 500
 
-	# Check if docker image is downloaded
-	images = utils.docker.docker_client.images.list()
-	image_name = droplet.container_docker_image
-	if droplet.container_docker_registry and "docker.io" not in droplet.container_docker_registry:
-		image_name = droplet.container_docker_registry + "/" + image_name
-
-	image_exists = False
-	for image in images:
-		if isGuacDroplet and f"flowcaseweb/flowcase-guac:{__version__}" in image.tags:
-			image_exists = True
-			break
-
-		if image_name in image.tags:
-			image_exists = True
-			break
-		
-	if not image_exists:
-		log("WARNING", f"Docker image {droplet.container_docker_image} not found. Please wait a few minutes and try again.")
+	# Hand out a pre-started container if the droplet has a warm pool, its resources are already reserved
+	instance = warm_pool.claim(droplet, current_user)
+	if instance:
+		warm_pool.schedule_refill(current_app._get_current_object(), droplet.id)
+		return jsonify({"success": True, "instance_id": instance.id, "status": "ready"})
+
+	# Admission is timed here, the launch itself by the provisioning job
+	timer = PhaseTimer()
+	timer.start('image-check')
+
+	# Check if docker image is downloaded on a node the instance can be placed on
+	if not scheduler.has_image(droplet):
+		log("WARNING", f"Docker image {droplet.container_docker_image} not found. Please wait a few minutes and try again.",
+			category="image", droplet_id=droplet.id, user_id=current_user.id)
 		return jsonify({"success": False, "error": "Docker image not found. Image might still be downloading."}), 400
-	
-		"""
-		try:
-			# Use the existing pull_single_image function with timeout
-			def pull_with_timeout():
-				return utils.docker.pull_single_image(
-					droplet.container_docker_registry, 
-					droplet.container_docker_image
-				)
-			
-			success, message = timeout_wrapper(pull_with_timeout, timeout_seconds=300)
-			
-			if not success:
-				if "timed out" in message:
-					return jsonify({"success": False, "error": "Image download timed out. Please try again or download manually from the admin panel."}), 408
-				else:
-					log("ERROR", f"Failed to pull Docker image {image_name}: {message}")
-					return jsonify({"success": False, "error": f"Failed to download Docker image. Error: {message}"}), 400
-			
-			log("INFO", f"Successfully pulled Docker image {image_name}")
-		except Exception as e:
-			log("ERROR", f"Failed to pull Docker image {image_name}: {str(e)}")
-			return jsonify({"success": False, "error": f"Failed to download Docker image. Error: {str(e)}"}), 400
-		"""
 
-	# Create a new instance
-	instance = DropletInstance(droplet_id=droplet_id, user_id=current_user.id)
-	db.session.add(instance)
-	db.session.commit()
- 
-	# Create a docker container
-	log("INFO", f"Creating new instance for user {current_user.username} with droplet {droplet.display_name}")
- 
-	name = f"flowcase_generated_{instance.id}"
- 
-	request_resolution = request.json.get('resolution')
+	request_resolution = request.json.get('resolution') or ""
 	if len(request_resolution) < 10 and re.match(r"[0-9]+x[0-9]+", request_resolution):
 		resolution = request_resolution
 	else:
 		resolution = "1280x720"
-  
-	# Persistent Profile
-	mount = None
-	if droplet.container_persistent_profile_path and droplet.container_persistent_profile_path != "" and not isGuacDroplet:
-		
-		profilePath = droplet.container_persistent_profile_path
-  
-		# Replace variables
-		profilePath = profilePath.replace("{user_id}", str(current_user.id))
-		profilePath = profilePath.replace("{username}", current_user.username)
-		profilePath = profilePath.replace("{droplet_id}", str(droplet_id))
-  
-		# Ensure path ends with /
-		if profilePath[-1] != "/":
-			profilePath += "/"
 
-		mount = docker.types.Mount(target="/home/flowcase-user", source=profilePath, type="bind", consistency="[r]private")
-  
-		# Hack: the first time the mount is created, the container will crash, so we start the container twice
-		# this should be fixed in the core droplets
-		if not os.path.exists(profilePath + ".bashrc"):
-			try:
-				container = utils.docker.docker_client.containers.run(
-					image=image_name,
-					detach=True,
-					mem_limit="512000000",
-					cpu_shares=int(droplet.container_cores * 1024),
-					mounts=[mount],
-				)
-				time.sleep(1)
-				container.stop()
-				container.remove(force=True)
-			except Exception as e:
-				log("ERROR", f"Error creating profile directory structure: {str(e)}")
-				db.session.delete(instance)
-				db.session.commit()
-				return jsonify({"success": False, "error": "Failed to setup persistent profile"}), 500
-	
-	# Create the container
-	try:
-		if not isGuacDroplet:
-			container = utils.docker.docker_client.containers.run(
-				image=image_name,
-				name=name,
-				environment={"DISPLAY": ":1", "VNC_PW": current_user.auth_token, "VNC_RESOLUTION": resolution},
-				detach=True,
-				network="flowcase_default_network",
-				mem_limit=f"{droplet.container_memory}000000",
-				cpu_shares=int(droplet.container_cores * 1024),
-				mounts=[mount] if mount else None,
-			)
-		else: # Guacamole droplet
-			container = utils.docker.docker_client.containers.run(
-				image=f"flowcaseweb/flowcase-guac:{__version__}",
-				name=name,
-				environment={"GUAC_KEY": current_user.auth_token[:32]},
-				detach=True,
-				network="flowcase_default_network",
-			)
- 
-		log("INFO", f"Instance created for user {current_user.username} with droplet {droplet.display_name}")
- 
-		# Wait for container to start and verify it's running with timeout
-		max_wait_time = 30  # Maximum wait time in seconds
-		check_interval = 1  # Check every 1 second
-		waited_time = 0
-		
-		while waited_time < max_wait_time:
-			time.sleep(check_interval)
-			waited_time += check_interval
-			
-			try:
-				container.reload()
-				if container.status == 'running':
-					log("INFO", f"Container {name} is running after {waited_time} seconds")
-					break
-				elif container.status in ['exited', 'dead']:
-					log("ERROR", f"Container {name} failed to start, status: {container.status}")
-					# Get container logs for debugging
-					try:
-						logs = container.logs().decode('utf-8')[-1000:]  # Last 1000 chars
-						log("ERROR", f"Container logs: {logs}")
-					except:
-						pass
-					container.remove(force=True)
-					db.session.delete(instance)
-					db.session.commit()
-					return jsonify({"success": False, "error": f"Container failed to start (status: {container.status})"}), 500
-			except Exception as e:
-				log("ERROR", f"Error checking container status: {str(e)}")
-				container.remove(force=True)
-				db.session.delete(instance)
-				db.session.commit()
-				return jsonify({"success": False, "error": "Failed to verify container status"}), 500
-		
-		# Final check if we timed out
-		if waited_time >= max_wait_time:
-			log("ERROR", f"Container {name} startup timed out after {max_wait_time} seconds")
-			try:
-				logs = container.logs().decode('utf-8')[-1000:]  # Last 1000 chars
-				log("ERROR", f"Container logs: {logs}")
-			except:
-				pass
-			container.remove(force=True)
-			db.session.delete(instance)
-			db.session.commit()
-			return jsonify({"success": False, "error": "Container startup timed out"}), 500
- 
-		# Create nginx config - get fresh container info and handle network name variations
-		try:
-			container = utils.docker.docker_client.containers.get(f"flowcase_generated_{instance.id}")
-			networks = container.attrs['NetworkSettings']['Networks']
-			
-			# Try different network name variations
-			ip = None
-			for network_name in ['flowcase_default_network', 'default_network', 'bridge']:
-				if network_name in networks and networks[network_name]['IPAddress']:
-					ip = networks[network_name]['IPAddress']
-					log("INFO", f"Found container IP {ip} on network {network_name}")
-					break
-			
-			if not ip:
-				log("ERROR", f"Could not find IP address for container {name}")
-				container.remove(force=True)
-				db.session.delete(instance)
-				db.session.commit()
-				return jsonify({"success": False, "error": "Could not determine container IP address"}), 500
-				
-		except Exception as e:
-			log("ERROR", f"Error getting container network info: {str(e)}")
-			container.remove(force=True)
-			db.session.delete(instance)
-			db.session.commit()
-			return jsonify({"success": False, "error": "Failed to get container network information"}), 500
-
-		# Generate nginx configuration
-		nginx_config = generate_nginx_config(instance, droplet, ip, current_user)
- 
-		try:
-			write_nginx_config(instance, nginx_config)
-		except Exception as e:
-			log("ERROR", f"Error writing nginx config: {str(e)}")
-			container.remove(force=True)
-			db.session.delete(instance)
-			db.session.commit()
-			return jsonify({"success": False, "error": "Failed to write nginx configuration"}), 500
-		
-		reload_nginx()
- 
-	except Exception as e:
-		log("ERROR", f"Error creating container for user {current_user.username}: {str(e)}")
-		# Cleanup on failure
-		try:
-			if 'container' in locals():
-				container.remove(force=True)
-		except:
-			pass
+	# Create a new instance, the container is started by the provisioning pool
+	instance = DropletInstance(droplet_id=droplet_id, user_id=current_user.id, container_status='creating')
+	db.session.add(instance)
+	db.session.flush()
+
+	job = ProvisioningJob(instance_id=instance.id, droplet_id=droplet_id, user_id=current_user.id, resolution=resolution)
+	db.session.add(job)
+
+	# Place the instance on a node and reserve its resources atomically with the rows, guacamole droplets are recorded but not limited
+	timer.start('placement')
+	success, error = scheduler.place(droplet, [instance], current_user.tenant_id, f"user {current_user.username}", enforce=not isGuacDroplet,
+									 require_image=True)
+	if not success:
+		return jsonify({"success": False, "error": error}), 400
+
+	if not provisioning_service.submit(current_app._get_current_object(), job.id):
+		log("WARNING", f"Provisioning queue full, rejected instance request from user {current_user.username}",
+			category="instance", instance_id=instance.id, droplet_id=droplet.id, user_id=current_user.id)
+		db.session.delete(job)
 		db.session.delete(instance)
-		db.session.commit()
-		return jsonify({"success": False, "error": f"Failed to create container: {str(e)}"}), 500
-
-	return jsonify({"success": True, "instance_id": instance.id})
-
-def check_resources(droplet: Droplet) -> Tuple[bool, str]:
-	instances = DropletInstance.query.all()
-		
-	# Collect all droplet IDs and fetch droplets in a single query to avoid N+1 problem
-	droplet_ids = [instance.droplet_id for instance in instances]
-	droplets = Droplet.query.filter(Droplet.id.in_(droplet_ids)).all() if droplet_ids else []
-	droplet_dict = {droplet.id: droplet for droplet in droplets}
-	
-	total_allocated_memory = 0
-	total_allocated_cores = 0
-	for instance in instances:
-		instance_droplet = droplet_dict.get(instance.droplet_id)
-		if instance_droplet:
-			total_allocated_cores += instance_droplet.container_cores
-			total_allocated_memory += instance_droplet.container_memory
-	
-	# Get system resources
-	system_cores = os.cpu_count()
-	total_memory = psutil.virtual_memory().total / 1024 / 1024  # Convert to MB
-	
-	# Calculate what would be used after adding this droplet
-	projected_memory_usage = total_allocated_memory + droplet.container_memory
-	projected_core_usage = total_allocated_cores + droplet.container_cores
-	
-	# Apply reasonable safety margins and allow oversubscription for CPU
-	# CPU: Allow 2x oversubscription (containers share CPU efficiently via CPU shares)
-	# Memory: Use 85% of total memory to leave room for system operations
-	max_allowed_memory = total_memory * 0.85
-	max_allowed_cores = system_cores * 2.0
-	
-	if projected_memory_usage > max_allowed_memory:
-		log("ERROR", f"Insufficient memory for user {current_user.username} to request droplet {droplet.display_name} - would use {projected_memory_usage}MB of {max_allowed_memory}MB allowed")
-		return False, "Insufficient memory to start this droplet"
-	
-	if projected_core_usage > max_allowed_cores:
-		log("ERROR", f"Insufficient CPU cores for user {current_user.username} to request droplet {droplet.display_name} - would use {projected_core_usage} of {max_allowed_cores} cores allowed")
-		return False, "Insufficient CPU cores to start this droplet"
-	
-	return True, ""
+		release_resources([instance.id])
+		return jsonify({"success": False, "error": "Too many instances are being launched right now. Please try again in a moment."}), 503
 
-def generate_nginx_config(instance: DropletInstance, droplet: Droplet, ip: str, user: User) -> str:
-	authHeader = base64.b64encode(b'flowcase_user:' + user.auth_token.encode()).decode('utf-8')
-	 
-	if droplet.droplet_type == "container":
-		nginx_config = open(f"config/nginx/container_template.conf", "r").read()
-	else: # Guacamole droplet
-		nginx_config = open(f"config/nginx/guac_template.conf", "r").read()
+	log("INFO", f"Creating new instance for user {current_user.username} with droplet {droplet.display_name}",
+		category="instance", instance_id=instance.id, droplet_id=droplet.id, user_id=current_user.id)
+	timer.save(instance.id, droplet.id, instance.node_id, total=False)
 
-	nginx_config = nginx_config.replace("{ip}", ip)
-	nginx_config = nginx_config.replace("{authHeader}", authHeader)
-	nginx_config = nginx_config.replace("{instance_id}", instance.id)
+	# The pool was empty, start topping it up for the next users
+	if warm_pool.is_enabled(droplet):
+		warm_pool.schedule_refill(current_app._get_current_object(), droplet.id)
 
-	return nginx_config
+	return jsonify({"success": True, "job_id": job.id, "instance_id": instance.id, "status": job.status}), 202
 
-def write_nginx_config(instance: DropletInstance, nginx_config: str):
-	with open(f"/flowcase/nginx/containers.d/{instance.id}.conf", "w") as f:
-		f.write(nginx_config)
+@droplet_bp.route('/api/instance/job/<string:job_id>', methods=['GET'])
+@login_required
+def get_provisioning_job(job_id: str):
+	job = ProvisioningJob.query.filter_by(id=job_id).first()
+	if not job or job.user_id != current_user.id:
+		return jsonify({"success": False, "error": "Job not found"}), 404
 
-def reload_nginx():
-	nginx_container = utils.docker.docker_client.containers.get("flowcase-nginx")
-	result = nginx_container.exec_run("nginx -s reload")
-	if result.exit_code != 0:
-		log("WARNING", f"Failed to reload Nginx: {result.output.decode()}")
+	return jsonify({"success": True, "job": job.to_dict()})
 
 @droplet_bp.route('/api/droplet/<int:droplet_id>/pull-image', methods=['POST'])
 @login_required
@@ -429,7 +209,7 @@ def pull_droplet_image(droplet_id):
 
 	# Check if docker client is available
 	if not utils.docker.docker_client:
-		log("ERROR", "Docker client not available")
+		log("ERROR", "Docker client not available", category="docker", droplet_id=droplet.id, user_id=current_user.id)
 		return jsonify({"success": False, "error": "Docker service is not available"}), 500
 
 	try:
@@ -445,7 +225,7 @@ def pull_droplet_image(droplet_id):
 			return jsonify({"success": False, "error": message}), 500
 			
 	except Exception as e:
-		log("ERROR", f"Error pulling image for droplet {droplet_id}: {str(e)}")
+		log("ERROR", f"Error pulling image for droplet {droplet_id}: {str(e)}", category="image", droplet_id=droplet.id, user_id=current_user.id)
 		return jsonify({"success": False, "error": f"Failed to pull image: {str(e)}"}), 500
 
 def generate_guac_token(droplet: Droplet, user: User) -> str:
@@ -495,6 +275,10 @@ def droplet(instance_id: str):
 	if instance.user_id != current_user.id:
 		return redirect("/")
 
+	idle_reaper.touch(instance.id)
+	if instance.container_status == 'paused':
+		idle_reaper.thaw(instance.id)
+
 	using_guac = False
 	guac_token = None
 	droplet = Droplet.query.filter_by(id=instance.droplet_id).first()
@@ -502,7 +286,28 @@ def droplet(instance_id: str):
 		using_guac = True
 		guac_token = generate_guac_token(droplet, current_user)
 
-	return render_template('droplet.html', instance_id=instance_id, droplet=droplet, guacamole=using_guac, guac_token=guac_token)
+	# The desktop's requests are authorized by a signed cookie, checked by droplet_connect without the database
+	response = make_response(render_template('droplet.html', instance_id=instance_id, droplet=droplet, guacamole=using_guac, guac_token=guac_token))
+	return set_desktop_cookie(response, instance.id, current_user)
+
+@droplet_bp.route('/api/instance/<string:instance_id>/heartbeat', methods=['POST'])
+@login_required
+def instance_heartbeat(instance_id: str):
+	"""Sent by the open desktop page while it has focus, websocket traffic alone does not reach Flowcase"""
+	instance = DropletInstance.query.filter_by(id=instance_id).first()
+	if not instance:
+		return jsonify({"success": False, "error": "Instance not found"}), 404
+
+	if instance.user_id != current_user.id:
+		return jsonify({"success": False, "error": "Unauthorized"}), 403
+
+	idle_reaper.touch(instance.id)
+	db.session.refresh(instance)
+
+	idle_expires_at = idle_reaper.idle_expires_at(instance, Droplet.query.get(instance.droplet_id))
+	response = jsonify({"success": True, "idle_expires_at": idle_expires_at.isoformat() if idle_expires_at else None})
+	# Renewed while the desktop is open
+	return set_desktop_cookie(response, instance.id, current_user)
 
 @droplet_bp.route('/api/instance/<string:instance_id>/destroy', methods=['GET'])
 @login_required
@@ -514,19 +319,13 @@ def stop_instance(instance_id: str):
 	if instance.user_id != current_user.id:
 		return jsonify({"success": False, "error": "Unauthorized"}), 403
 
-	try:
-		if utils.docker.docker_client:
-			container = utils.docker.docker_client.containers.get(f"flowcase_generated_{instance.id}")
-			container.remove(force=True)
-	except Exception as e:
-		log("ERROR", f"Error removing container: {str(e)}")
-		pass
+	remove_container(f"flowcase_generated_{instance.id}", instance.node_id)
   
-	# Delete nginx config
-	if os.path.exists(f"/flowcase/nginx/containers.d/{instance.id}.conf"):
-		os.remove(f"/flowcase/nginx/containers.d/{instance.id}.conf")
-	
 	db.session.delete(instance)
-	db.session.commit()
+	release_resources([instance_id])
+
+	# Remove the route once the row is gone, the reload is coalesced with other changes and not waited for
+	if unroute_instance(instance_id):
+		reload_nginx(wait=False)
  
 	return jsonify({"success": True})
\ No newline at end of file
@@ -1,5 +1,6 @@
 from flask import Blueprint, jsonify
 from flask_login import login_required
+from sqlalchemy import text
 import utils.docker
 from utils.docker import is_docker_available, get_docker_version
 from __init__ import db
@@ -11,7 +12,7 @@ def health_check():
     """Simple health check endpoint returning status of core components."""
     # Check DB connectivity
     try:
-        db.session.execute('SELECT 1')
+        db.session.execute(text('SELECT 1'))
         db_status = True
     except Exception:
         db_status = False
@@ -1,6 +1,6 @@
 import uuid
 import json
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, current_app
 from flask_login import login_required, current_user
 from sqlalchemy.sql import func
 from __init__ import db
@@ -11,6 +11,8 @@ from models.tenant import Tenant
 from utils.permissions import Permissions
 from utils.schemas import WorkshopTemplateCreateSchema, WorkshopCreateSchema, UserWorkshopCreateSchema
 from marshmallow import ValidationError
+from services.provisioning import provisioning_service, delete_jobs
+from services.workshop_provisioning import workshop_provisioner
 
 workshop_bp = Blueprint('workshops', __name__)
 
@@ -189,6 +191,14 @@ def api_workshop_start(workshop_id):
     if existing_user_workshop and existing_user_workshop.status != 'stopped':
         return jsonify({"success": False, "error": "Workshop instance already running"}), 400
     
+    # Check the whole lab fits before creating anything
+    droplets, error = workshop_provisioner.resolve_droplets(workshop.template_id)
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    success, error = workshop_provisioner.admit(droplets)
+    if not success:
+        return jsonify({"success": False, "error": error}), 400
+    
     # Create user workshop instance
     user_workshop = UserWorkshop(
         user_id=current_user.id,
@@ -201,14 +211,18 @@ def api_workshop_start(workshop_id):
     db.session.add(user_workshop)
     db.session.commit()
     
-    # TODO: Implement actual workshop instance creation logic
-    # This would involve creating DropletInstance objects for each droplet in the template
-    user_workshop.status = 'ready'
-    db.session.commit()
+    # The droplets start in the background, clients poll the user workshop for progress
+    success, error = workshop_provisioner.start(current_app._get_current_object(), user_workshop, droplets,
+                                                current_app.config.get('BULK_LAUNCH_PARALLELISM', 8), f"user {current_user.username}")
+    if not success:
+        db.session.delete(user_workshop)
+        db.session.commit()
+        return jsonify({"success": False, "error": error}), 503
     
     return jsonify({
         "success": True,
-        "user_workshop_id": user_workshop.id
+        "user_workshop_id": user_workshop.id,
+        "status": user_workshop.status
     })
 
 @workshop_bp.route('/api/workshops/<workshop_id>/stop', methods=['POST'])
@@ -226,9 +240,7 @@ def api_workshop_stop(workshop_id):
     if not user_workshop:
         return jsonify({"success": False, "error": "Workshop instance not found"}), 404
     
-    # TODO: Implement actual cleanup logic for DropletInstances
-    user_workshop.status = 'stopped'
-    db.session.commit()
+    workshop_provisioner.stop(user_workshop)
     
     return jsonify({
         "success": True
@@ -248,7 +260,11 @@ def api_workshop_delete(workshop_id):
     if workshop.created_by != current_user.id:
         return jsonify({"success": False, "error": "Unauthorized"}), 403
     
-    # Delete associated user workshops
+    # Tear down and delete associated user workshops
+    user_workshops = UserWorkshop.query.filter_by(workshop_id=workshop_id).all()
+    instance_ids = [instance_id for user_workshop in user_workshops for instance_id in user_workshop.get_instance_ids()]
+    provisioning_service.destroy_instances(instance_ids)
+    delete_jobs(instance_ids=instance_ids)
     UserWorkshop.query.filter_by(workshop_id=workshop_id).delete()
     db.session.delete(workshop)
     db.session.commit()
@@ -374,14 +390,21 @@ def api_user_workshop_start(user_workshop_id):
     if user_workshop.status != 'stopped':
         return jsonify({"success": False, "error": "Workshop instance is already running"}), 400
     
-    # TODO: Implement actual workshop instance creation logic
-    # This would involve creating DropletInstance objects based on the template
-    user_workshop.status = 'ready'
-    user_workshop.start_time = func.now()
-    db.session.commit()
+    droplets, error = workshop_provisioner.resolve_droplets(user_workshop.template_id)
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    success, error = workshop_provisioner.admit(droplets)
+    if not success:
+        return jsonify({"success": False, "error": error}), 400
+    
+    success, error = workshop_provisioner.start(current_app._get_current_object(), user_workshop, droplets,
+                                                current_app.config.get('BULK_LAUNCH_PARALLELISM', 8), f"user {current_user.username}")
+    if not success:
+        return jsonify({"success": False, "error": error}), 503
     
     return jsonify({
-        "success": True
+        "success": True,
+        "status": user_workshop.status
     })
 
 @workshop_bp.route('/api/user-workshops/<user_workshop_id>/stop', methods=['POST'])
@@ -399,10 +422,7 @@ def api_user_workshop_stop(user_workshop_id):
     if not user_workshop:
         return jsonify({"success": False, "error": "User workshop not found"}), 404
     
-    # TODO: Implement actual cleanup logic for associated DropletInstances
-    user_workshop.status = 'stopped'
-    user_workshop.end_time = func.now()
-    db.session.commit()
+    workshop_provisioner.stop(user_workshop)
     
     return jsonify({
         "success": True
@@ -423,7 +443,8 @@ def api_user_workshop_delete(user_workshop_id):
     if not user_workshop:
         return jsonify({"success": False, "error": "User workshop not found"}), 404
     
-    # TODO: Implement actual cleanup logic for associated DropletInstances
+    provisioning_service.destroy_instances(user_workshop.get_instance_ids())
+    delete_jobs(instance_ids=user_workshop.get_instance_ids())
     db.session.delete(user_workshop)
     db.session.commit()
     
@@ -11,16 +11,27 @@ from pathlib import Path
 from models.droplet import Droplet, DropletInstance
 from __init__ import db
 from utils.logger import log
+from utils.nodes import get_client, get_remote_clients
+from utils.timing import PhaseTimer
+import utils.docker
 
 class DropletManager:
     """Manages droplet instances with persistent storage"""
     
     def __init__(self):
-        """Initialize Docker client and volume path"""
-        self.docker_client = docker.from_env()
+        """Initialize volume path"""
         self.base_volume_path = os.getenv('DROPLET_VOLUME_PATH', '/flowcase/volumes')
         Path(self.base_volume_path).mkdir(parents=True, exist_ok=True)
     
+    @property
+    def docker_client(self):
+        """Pooled client of the local daemon, re-created in each worker after fork"""
+        return utils.docker.docker_client or utils.docker.get_client()
+
+    def client_for(self, instance):
+        """Docker client of the node an instance runs on"""
+        return get_client(instance.node_id) or self.docker_client
+
     def create_persistent_volume(self, droplet_id, user_id):
         """Create a Docker volume for persistent storage"""
         try:
@@ -29,7 +40,7 @@ class DropletManager:
             # Check if volume already exists
             try:
                 existing_volume = self.docker_client.volumes.get(volume_name)
-                log('INFO', f'Using existing volume: {volume_name}')
+                log('INFO', f'Using existing volume: {volume_name}', category='volume', droplet_id=droplet_id, user_id=user_id)
                 return existing_volume
             except docker.errors.NotFound:
                 pass
@@ -45,11 +56,11 @@ class DropletManager:
                 }
             )
             
-            log('INFO', f'Created persistent volume: {volume_name}')
+            log('INFO', f'Created persistent volume: {volume_name}', category='volume', droplet_id=droplet_id, user_id=user_id)
             return volume
             
         except Exception as e:
-            log('ERROR', f'Failed to create volume: {str(e)}')
+            log('ERROR', f'Failed to create volume: {str(e)}', category='volume', droplet_id=droplet_id, user_id=user_id)
             raise
     
     def create_instance(self, droplet, user, persist_data=True):
@@ -64,6 +75,7 @@ class DropletManager:
         Returns:
             DropletInstance object
         """
+        timer = PhaseTimer()
         try:
             # Create droplet instance record
             instance = DropletInstance(
@@ -118,6 +130,7 @@ class DropletManager:
             cpu_quota = droplet.container_cores * 100000 if droplet.container_cores else None
             
             # Create and start container
+            timer.start('container')
             container = self.docker_client.containers.run(
                 image=droplet.container_docker_image,
                 name=container_name,
@@ -143,6 +156,7 @@ class DropletManager:
             instance.set_volume_ids(volume_ids)
             
             # Get assigned port if any
+            timer.start('network')
             container.reload()
             if container.ports:
                 for port_info in container.ports.values():
@@ -152,14 +166,18 @@ class DropletManager:
                         break
             
             db.session.commit()
+            timer.save(instance.id, droplet.id)
             
-            log('INFO', f'Created droplet instance: {instance.id} for user {user.username}')
+            log('INFO', f'Created droplet instance: {instance.id} for user {user.username}',
+                category='instance', instance_id=instance.id, droplet_id=droplet.id, user_id=user.id)
             return instance
             
         except Exception as e:
             instance.container_status = 'error'
             db.session.commit()
-            log('ERROR', f'Failed to create droplet instance: {str(e)}')
+            timer.save(instance.id, droplet.id, success=False)
+            log('ERROR', f'Failed to create droplet instance: {str(e)}',
+                category='instance', instance_id=instance.id, droplet_id=droplet.id, user_id=user.id)
             raise
     
     def stop_instance(self, instance_id):
@@ -171,11 +189,11 @@ class DropletManager:
             
             if instance.container_id:
                 try:
-                    container = self.docker_client.containers.get(instance.container_id)
+                    container = self.client_for(instance).containers.get(instance.container_id)
                     container.stop(timeout=10)
-                    log('INFO', f'Stopped container: {instance.container_id}')
+                    log('INFO', f'Stopped container: {instance.container_id}', category='instance', instance_id=instance_id)
                 except docker.errors.NotFound:
-                    log('WARNING', f'Container {instance.container_id} not found')
+                    log('WARNING', f'Container {instance.container_id} not found', category='instance', instance_id=instance_id)
             
             instance.container_status = 'stopped'
             instance.stopped_at = datetime.utcnow()
@@ -184,7 +202,7 @@ class DropletManager:
             return True
             
         except Exception as e:
-            log('ERROR', f'Failed to stop instance: {str(e)}')
+            log('ERROR', f'Failed to stop instance: {str(e)}', category='instance', instance_id=instance_id)
             raise
     
     def delete_instance(self, instance_id, remove_volumes=False):
@@ -203,32 +221,32 @@ class DropletManager:
             # Stop and remove container
             if instance.container_id:
                 try:
-                    container = self.docker_client.containers.get(instance.container_id)
+                    container = self.client_for(instance).containers.get(instance.container_id)
                     container.stop(timeout=5)
                     container.remove()
-                    log('INFO', f'Removed container: {instance.container_id}')
+                    log('INFO', f'Removed container: {instance.container_id}', category='instance', instance_id=instance_id)
                 except docker.errors.NotFound:
-                    log('WARNING', f'Container {instance.container_id} not found')
+                    log('WARNING', f'Container {instance.container_id} not found', category='instance', instance_id=instance_id)
             
             # Remove volumes if requested
             if remove_volumes:
                 for volume_id in instance.get_volume_ids():
                     try:
-                        volume = self.docker_client.volumes.get(volume_id)
+                        volume = self.client_for(instance).volumes.get(volume_id)
                         volume.remove()
-                        log('INFO', f'Removed volume: {volume_id}')
+                        log('INFO', f'Removed volume: {volume_id}', category='volume', instance_id=instance_id)
                     except docker.errors.NotFound:
-                        log('WARNING', f'Volume {volume_id} not found')
+                        log('WARNING', f'Volume {volume_id} not found', category='volume', instance_id=instance_id)
             
             # Remove instance record
             db.session.delete(instance)
             db.session.commit()
             
-            log('INFO', f'Deleted droplet instance: {instance_id}')
+            log('INFO', f'Deleted droplet instance: {instance_id}', category='instance', instance_id=instance_id)
             return True
             
         except Exception as e:
-            log('ERROR', f'Failed to delete instance: {str(e)}')
+            log('ERROR', f'Failed to delete instance: {str(e)}', category='instance', instance_id=instance_id)
             raise
     
     def restart_instance(self, instance_id):
@@ -238,18 +256,18 @@ class DropletManager:
             if not instance or not instance.container_id:
                 raise ValueError(f'Invalid instance: {instance_id}')
             
-            container = self.docker_client.containers.get(instance.container_id)
+            container = self.client_for(instance).containers.get(instance.container_id)
             container.restart(timeout=10)
             
             instance.container_status = 'running'
             instance.updated_at = datetime.utcnow()
             db.session.commit()
             
-            log('INFO', f'Restarted instance: {instance_id}')
+            log('INFO', f'Restarted instance: {instance_id}', category='instance', instance_id=instance_id)
             return True
             
         except Exception as e:
-            log('ERROR', f'Failed to restart instance: {str(e)}')
+            log('ERROR', f'Failed to restart instance: {str(e)}', category='instance', instance_id=instance_id)
             raise
     
     def get_instance_stats(self, instance_id):
@@ -259,7 +277,7 @@ class DropletManager:
             if not instance or not instance.container_id:
                 return None
             
-            container = self.docker_client.containers.get(instance.container_id)
+            container = self.client_for(instance).containers.get(instance.container_id)
             stats = container.stats(stream=False)
             
             # Calculate CPU percentage
@@ -284,17 +302,19 @@ class DropletManager:
             }
             
         except Exception as e:
-            log('ERROR', f'Failed to get instance stats: {str(e)}')
+            log('ERROR', f'Failed to get instance stats: {str(e)}', category='instance', instance_id=instance_id)
             return None
     
     def cleanup_orphaned_containers(self):
-        """Remove containers that are no longer tracked in database"""
+        """Remove containers that are no longer tracked in database, on every node"""
         try:
             # Get all Nalabo-managed containers
-            containers = self.docker_client.containers.list(
-                all=True,
-                filters={'label': 'nalabo.managed=true'}
-            )
+            containers = []
+            for client in [self.docker_client] + [client for _, client in get_remote_clients()]:
+                containers.extend(client.containers.list(
+                    all=True,
+                    filters={'label': 'nalabo.managed=true'}
+                ))
             
             cleaned = 0
             for container in containers:
@@ -304,13 +324,13 @@ class DropletManager:
                     instance = DropletInstance.query.get(instance_id)
                     if not instance:
                         container.remove(force=True)
-                        log('INFO', f'Removed orphaned container: {container.id}')
+                        log('INFO', f'Removed orphaned container: {container.id}', category='instance', instance_id=instance_id)
                         cleaned += 1
             
             return cleaned
             
         except Exception as e:
-            log('ERROR', f'Failed to cleanup orphaned containers: {str(e)}')
+            log('ERROR', f'Failed to cleanup orphaned containers: {str(e)}', category='instance')
             return 0
     
     def list_volumes(self, droplet_id=None):
@@ -335,7 +355,7 @@ class DropletManager:
             return volume_info
             
         except Exception as e:
-            log('ERROR', f'Failed to list volumes: {str(e)}')
+            log('ERROR', f'Failed to list volumes: {str(e)}', category='volume', droplet_id=droplet_id)
             return []
     
     def _get_volume_size(self, volume):
@@ -0,0 +1,276 @@
+"""
+Idle Reaper Service
+Pauses instances nobody is using and removes the ones idle for longer than their droplet's timeout
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import or_
+from models.droplet import Droplet, DropletInstance, InstanceReclaim
+from models.workshop import UserWorkshop
+from __init__ import db
+from utils.logger import log
+from utils.nodes import get_client
+from utils.resources import pause_resources, resume_resources
+from services.provisioning import provisioning_service
+
+# Accesses of an instance within this window only update last_accessed once
+IDLE_TOUCH_INTERVAL = timedelta(seconds=60)
+
+# Shortest idle time before a pause, longer than two touch intervals so every worker's
+# throttle has expired by then and the user's next request goes through thaw()
+MIN_FREEZE_TIMEOUT = 2 * IDLE_TOUCH_INTERVAL
+
+# Workshop instances are stopped with their workshop, never one by one
+ACTIVE_WORKSHOP_STATUSES = ['creating', 'ready', 'running']
+
+class IdleReaper:
+    """Tracks instance accesses, freezes idle instances and reclaims the abandoned ones"""
+
+    def __init__(self, provisioner):
+        self.provisioner = provisioner
+        self._touched = {}
+        self._lock = threading.Lock()
+
+    def _minutes(self, value, default_key, default):
+        minutes = value
+        if minutes is None:
+            minutes = current_app.config.get(default_key, default)
+        return timedelta(minutes=minutes) if minutes else None
+
+    def timeout(self, droplet):
+        """Idle timeout of a droplet's instances, None if they are never reaped"""
+        return self._minutes(droplet.idle_timeout, 'INSTANCE_IDLE_TIMEOUT', 120)
+
+    def freeze_timeout(self, droplet):
+        """Idle time after which a droplet's containers are paused, None if they never are"""
+        timeout = self._minutes(droplet.freeze_timeout, 'INSTANCE_FREEZE_TIMEOUT', 15)
+        return max(timeout, MIN_FREEZE_TIMEOUT) if timeout else None
+
+    def idle_expires_at(self, instance, droplet):
+        """When an instance gets reaped if nobody accesses it, None if never"""
+        timeout = self.timeout(droplet)
+        last_access = instance.last_accessed or instance.created_at
+        if timeout is None or last_access is None:
+            return None
+        return last_access + timeout
+
+    def touch(self, instance_id):
+        """
+        Record an access to an instance, unpausing its container if it was frozen
+
+        Called for every proxied desktop request, so each process writes an instance at most
+        once per IDLE_TOUCH_INTERVAL and the UPDATE is skipped when another worker already did.
+        """
+        now = datetime.utcnow()
+        with self._lock:
+            last = self._touched.get(instance_id)
+            if last and now - last < IDLE_TOUCH_INTERVAL:
+                return
+            self._touched[instance_id] = now
+
+        DropletInstance.query.filter(
+            DropletInstance.id == instance_id,
+            or_(DropletInstance.last_accessed.is_(None), DropletInstance.last_accessed < now - IDLE_TOUCH_INTERVAL)
+        ).update({
+            DropletInstance.last_accessed: now,
+            DropletInstance.idle_warned_at: None
+        }, synchronize_session=False)
+        db.session.commit()
+
+        self.thaw(instance_id)
+
+    def thaw(self, instance_id):
+        """Unpause a frozen instance, a single API call to its daemon, returns whether it was frozen"""
+        updated = DropletInstance.query.filter_by(id=instance_id, container_status='paused').update({
+            DropletInstance.container_status: 'running',
+            DropletInstance.paused_at: None
+        }, synchronize_session=False)
+        db.session.commit()
+        if updated != 1:
+            return False
+
+        node_id = db.session.query(DropletInstance.node_id).filter_by(id=instance_id).scalar()
+        self._unpause(instance_id, node_id)
+        resume_resources(instance_id)
+        return True
+
+    def _unpause(self, instance_id, node_id):
+        try:
+            get_client(node_id).api.unpause(f"flowcase_generated_{instance_id}")
+        except Exception as e:
+            log("ERROR", f"Error unpausing instance {instance_id}: {str(e)}")
+
+    def freeze(self, candidates, parallelism=8):
+        """
+        Pause the containers of idle instances, their cores go back to the ledger
+
+        Args:
+            candidates: (instance, droplet, last access) tuples
+
+        Returns:
+            Number of instances paused
+        """
+        now = datetime.utcnow()
+        frozen = []
+        for instance, droplet, last_access in candidates:
+            # Marked first, so an access racing with the pause thaws it
+            if DropletInstance.query.filter(
+                DropletInstance.id == instance.id,
+                DropletInstance.container_status == 'running',
+                or_(DropletInstance.last_accessed.is_(None), DropletInstance.last_accessed <= last_access)
+            ).update({
+                DropletInstance.container_status: 'paused',
+                DropletInstance.paused_at: now
+            }, synchronize_session=False) == 1:
+                frozen.append((instance, droplet, last_access))
+        db.session.commit()
+        if not frozen:
+            return 0
+
+        # Clients are resolved before the pool, the threads only talk to the daemons
+        clients = {instance.node_id: get_client(instance.node_id) for instance, _, _ in frozen}
+
+        def pause(instance):
+            try:
+                clients[instance.node_id].api.pause(f"flowcase_generated_{instance.id}")
+                return True
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(frozen))), thread_name_prefix='flowcase-freeze') as executor:
+            results = list(executor.map(pause, [instance for instance, _, _ in frozen]))
+
+        paused = 0
+        for (instance, droplet, last_access), result in zip(frozen, results):
+            if result is not True:
+                log("ERROR", f"Error pausing instance {instance.id}: {str(result)}")
+                DropletInstance.query.filter_by(id=instance.id, container_status='paused').update({
+                    DropletInstance.container_status: 'running',
+                    DropletInstance.paused_at: None
+                }, synchronize_session=False)
+                db.session.commit()
+                continue
+
+            # Thawed while the pause was in flight, the unpause may have come first
+            if self._status(instance.id) != 'paused':
+                self._unpause(instance.id, instance.node_id)
+                continue
+
+            released = pause_resources(instance.id)
+            if self._status(instance.id) != 'paused':
+                resume_resources(instance.id)  # Thawed before its cores were given back
+                continue
+            if released:
+                db.session.add(InstanceReclaim(
+                    instance_id=instance.id,
+                    droplet_id=droplet.id,
+                    user_id=instance.user_id,
+                    node_id=instance.node_id,
+                    cores=droplet.container_cores or 0,
+                    memory=0,
+                    idle_seconds=int((now - last_access).total_seconds()),
+                    action='paused'
+                ))
+                db.session.commit()
+            paused += 1
+        return paused
+
+    def _status(self, instance_id):
+        return db.session.query(DropletInstance.container_status).filter_by(id=instance_id).scalar()
+
+    def _workshop_instance_ids(self):
+        instance_ids = set()
+        for user_workshop in UserWorkshop.query.filter(UserWorkshop.status.in_(ACTIVE_WORKSHOP_STATUSES)).all():
+            instance_ids.update(user_workshop.get_instance_ids())
+        return instance_ids
+
+    def run(self, parallelism=8):
+        """
+        Pause idle instances, warn about the ones entering their grace period and remove the ones past their timeout
+
+        Workshop instances can be paused, they are only removed with their workshop.
+
+        Returns:
+            (instances paused, instances removed)
+        """
+        now = datetime.utcnow()
+        warning = timedelta(minutes=current_app.config.get('INSTANCE_IDLE_WARNING', 10))
+        droplets = {droplet.id: droplet for droplet in Droplet.query.all()}
+        protected = self._workshop_instance_ids()
+
+        idle = {}
+        warned = []
+        freezable = []
+        for instance in DropletInstance.query.all():
+            droplet = droplets.get(instance.droplet_id)
+            last_access = instance.last_accessed or instance.created_at
+            if not droplet or last_access is None:
+                continue
+
+            expires_at = self.idle_expires_at(instance, droplet)
+            if expires_at is not None and instance.id not in protected:
+                if expires_at <= now:
+                    idle[instance.id] = (instance, droplet, last_access)
+                    continue
+                if expires_at - warning <= now and not instance.idle_warned_at:
+                    warned.append(instance.id)
+
+            freeze_timeout = self.freeze_timeout(droplet)
+            if instance.container_status == 'running' and freeze_timeout and last_access + freeze_timeout <= now:
+                freezable.append((instance, droplet, last_access))
+
+        if warned:
+            DropletInstance.query.filter(DropletInstance.id.in_(warned)).update({
+                DropletInstance.idle_warned_at: now
+            }, synchronize_session=False)
+            db.session.commit()
+
+        paused = self.freeze(freezable, parallelism) if freezable else 0
+        if paused:
+            log("INFO", f"Idle reaper paused {paused} instance(s)")
+
+        if not idle:
+            return paused, 0
+
+        # An instance accessed since the scan was started is kept
+        accessed = {row.id for row in DropletInstance.query.with_entities(DropletInstance.id).filter(
+            DropletInstance.id.in_(list(idle)),
+            DropletInstance.last_accessed > now - IDLE_TOUCH_INTERVAL
+        ).all()}
+        reclaimed = [instance_id for instance_id in idle if instance_id not in accessed]
+        if not reclaimed:
+            return paused, 0
+
+        cores = 0
+        memory = 0
+        for instance_id in reclaimed:
+            instance, droplet, last_access = idle[instance_id]
+            # The cores of a paused instance were reclaimed when it was paused
+            instance_cores = 0 if instance.container_status == 'paused' else droplet.container_cores or 0
+            db.session.add(InstanceReclaim(
+                instance_id=instance.id,
+                droplet_id=droplet.id,
+                user_id=instance.user_id,
+                node_id=instance.node_id,
+                cores=instance_cores,
+                memory=droplet.container_memory or 0,
+                idle_seconds=int((now - last_access).total_seconds())
+            ))
+            cores += instance_cores
+            memory += droplet.container_memory or 0
+        db.session.commit()
+
+        # Paused containers are removed as they are, forced removal kills them
+        self.provisioner.destroy_instances(reclaimed, parallelism)
+        with self._lock:
+            for instance_id in reclaimed:
+                self._touched.pop(instance_id, None)
+
+        log("INFO", f"Idle reaper removed {len(reclaimed)} instance(s), reclaiming {cores} cores and {memory}MB")
+        return paused, len(reclaimed)
+
+# Global instance
+idle_reaper = IdleReaper(provisioning_service)
@@ -0,0 +1,279 @@
+"""
+Password Verifier Service
+Checks login passwords on a process pool outside of the request worker, bounded across the whole host
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+from flask import current_app
+from utils.timing import PERCENTILES, percentile
+
+# Waits of the last verifications kept per worker for the metrics
+WAIT_SAMPLES = 1024
+# Seconds a single check may take on the pool before the login is asked to retry
+CHECK_TIMEOUT = 30
+
+class PasswordVerifierBusy(Exception):
+    """Too many logins are being verified, the user is asked to try again"""
+
+# Verification slots shared by every gunicorn worker, created in the master before the fork
+_shared_slots = None
+_shared_capacity = 0
+_shared_queued = None  # Logins waiting for or holding a slot, across workers
+_shared_holders = None  # pid of the worker holding each slot, 0 for a free one
+
+def share_capacity(slots: int):
+    """
+    Bound the password checks running at once on the whole host, called before the workers fork
+
+    Without it each process only bounds its own checks.
+    """
+    global _shared_slots, _shared_capacity, _shared_queued, _shared_holders
+    if slots <= 0:
+        return
+    _shared_slots = multiprocessing.BoundedSemaphore(slots)
+    _shared_capacity = slots
+    _shared_queued = multiprocessing.Value('i', 0)
+    _shared_holders = multiprocessing.Array('i', slots)
+
+def _set_holder(old: int, new: int):
+    with _shared_holders.get_lock():
+        for index, pid in enumerate(_shared_holders):
+            if pid == old:
+                _shared_holders[index] = new
+                return
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def reclaim_slots() -> int:
+    """
+    Free the shared slots still held by workers that are gone
+
+    gunicorn kills a worker past its timeout without letting it release its slot, each
+    kill would otherwise shrink the login capacity until the master restarts.
+    """
+    if _shared_holders is None:
+        return 0
+    reclaimed = 0
+    with _shared_holders.get_lock():
+        for index, pid in enumerate(_shared_holders):
+            if pid and not _is_alive(pid):
+                _shared_holders[index] = 0
+                _shared_slots.release()
+                reclaimed += 1
+    return reclaimed
+
+def _acquire_shared(timeout: float) -> bool:
+    """Take a shared slot under this worker's pid, the slots of dead workers are reclaimed when none frees up in time"""
+    acquired = _shared_slots.acquire(timeout=timeout)
+    if not acquired and reclaim_slots():
+        acquired = _shared_slots.acquire(timeout=0)
+    if acquired:
+        _set_holder(0, os.getpid())
+    return acquired
+
+def _release_shared():
+    _set_holder(os.getpid(), 0)
+    _shared_slots.release()
+
+def hash_rounds(password_hash: str):
+    """Cost of a bcrypt hash, None if it is not one"""
+    parts = (password_hash or "").split("$")
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+def check_password(password_hash: str, password: str, rounds: int):
+    """
+    Check a password against its hash, run in the pool processes
+
+    Returns:
+        (valid, new hash at the configured cost or None if the hash already has it)
+    """
+    try:
+        valid = bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+    except ValueError:
+        return False, None
+    if not valid or hash_rounds(password_hash) == rounds:
+        return valid, None
+    return True, bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+class PasswordVerifier:
+    """Runs password checks on a dedicated process pool, so logins do not starve the request workers"""
+
+    def __init__(self, max_workers=4, queue_limit=16, queue_timeout=10, rounds=12):
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self.rounds = rounds
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._local_slots = threading.BoundedSemaphore(max(max_workers, 1))
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._counts = {"verified": 0, "rejected": 0, "busy": 0, "rehashed": 0}
+
+    @property
+    def executor(self):
+        """
+        Process pool, created on first use so it is never inherited across a fork
+
+        Its processes come from a fork server rather than a fork of the worker, whose threads
+        may hold locks at that moment. A gunicorn worker serves one login at a time, so it keeps
+        a single process and the shared slots bound the host.
+        """
+        with self._lock:
+            if self._executor is None:
+                processes = 1 if _shared_slots is not None else self.max_workers
+                self._executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('forkserver'))
+            return self._executor
+
+    def _discard(self, executor):
+        """Drop a pool that is broken or stuck, the next check starts a new one"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _check(self, password_hash: str, password: str):
+        """
+        Run one check on the pool
+
+        A pool whose process died is replaced once, then the check runs in this worker.
+        """
+        for _ in range(2):
+            executor = self.executor
+            try:
+                future = executor.submit(check_password, password_hash, password, self.rounds)
+                return future.result(timeout=CHECK_TIMEOUT)
+            except BrokenProcessPool:
+                self._discard(executor)
+            except FutureTimeoutError:
+                self._discard(executor)
+                with self._lock:
+                    self._counts["busy"] += 1
+                raise PasswordVerifierBusy()
+        return check_password(password_hash, password, self.rounds)
+
+    @property
+    def pending(self):
+        """Number of checks queued and running in this worker"""
+        return self._pending
+
+    def verify(self, password_hash: str, password: str):
+        """
+        Check a login password
+
+        Returns:
+            (valid, new hash or None), the new hash has the configured cost and replaces the stored one
+
+        Raises:
+            PasswordVerifierBusy: the queue is full, no slot freed up within the queue timeout or the check
+                did not finish within CHECK_TIMEOUT
+        """
+        if not self.max_workers:
+            return self._count(check_password(password_hash, password, self.rounds))
+
+        with self._lock:
+            if self._pending >= self.queue_limit:
+                self._counts["busy"] += 1
+                raise PasswordVerifierBusy()
+            self._pending += 1
+
+        shared = _shared_slots is not None
+        queued = _shared_queued
+        if queued is not None:
+            with queued.get_lock():
+                queued.value += 1
+        started = time.monotonic()
+        try:
+            acquired = _acquire_shared(self.queue_timeout) if shared else self._local_slots.acquire(timeout=self.queue_timeout)
+            if not acquired:
+                with self._lock:
+                    self._counts["busy"] += 1
+                raise PasswordVerifierBusy()
+            try:
+                with self._lock:
+                    self._waits.append(time.monotonic() - started)
+                # A check takes one hash at most, the slot is held until it finished
+                return self._count(self._check(password_hash, password))
+            finally:
+                if shared:
+                    _release_shared()
+                else:
+                    self._local_slots.release()
+        finally:
+            if queued is not None:
+                with queued.get_lock():
+                    queued.value -= 1
+            with self._lock:
+                self._pending -= 1
+
+    def _count(self, result):
+        valid, new_hash = result
+        with self._lock:
+            self._counts["verified" if valid else "rejected"] += 1
+            if new_hash:
+                self._counts["rehashed"] += 1
+        return result
+
+    def get_metrics(self):
+        """Queue depth of the host and of this worker, with the time logins waited for a slot in milliseconds"""
+        with self._lock:
+            waits = sorted(round(wait * 1000) for wait in self._waits)
+            counts = dict(self._counts)
+            pending = self._pending
+
+        host = None
+        if _shared_slots is not None:
+            host = {
+                "capacity": _shared_capacity,
+                "queued": _shared_queued.value,
+                "running": _shared_capacity - _shared_slots.get_value()
+            }
+        return {
+            "rounds": self.rounds,
+            "workers": self.max_workers,
+            "queue_limit": self.queue_limit,
+            "host": host,
+            "worker": {
+                "pending": pending,
+                **counts,
+                "wait_ms": {name: percentile(waits, fraction) for name, fraction in PERCENTILES.items()} if waits else None
+            }
+        }
+
+# Global instance (lazy loaded, so each gunicorn worker builds its own pool after fork)
+_password_verifier_instance = None
+_password_verifier_lock = threading.Lock()
+
+class _PasswordVerifierProxy:
+    """Proxy to lazy load PasswordVerifier"""
+    def __getattr__(self, name):
+        global _password_verifier_instance
+        if _password_verifier_instance is None:
+            with _password_verifier_lock:
+                if _password_verifier_instance is None:
+                    _password_verifier_instance = PasswordVerifier(
+                        max_workers=current_app.config.get('PASSWORD_WORKERS', 4),
+                        queue_limit=current_app.config.get('PASSWORD_QUEUE_LIMIT', 16),
+                        queue_timeout=current_app.config.get('PASSWORD_QUEUE_TIMEOUT', 10),
+                        rounds=current_app.config.get('BCRYPT_LOG_ROUNDS', 12)
+                    )
+        return getattr(_password_verifier_instance, name)
+
+# Global proxy instance
+password_verifier = _PasswordVerifierProxy()
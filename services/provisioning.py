@@ -0,0 +1,505 @@
+"""
+Provisioning Service
+Runs droplet instance launches on a bounded worker pool and tracks them as jobs
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+import docker
+from flask import current_app
+from models.droplet import Droplet, DropletInstance, ProvisioningJob
+from models.user import User
+from __init__ import db
+from utils.logger import log
+from utils.nginx import route_instance, unroute_instance, reload_nginx
+from utils.docker_events import event_watcher, FLOWCASE_LABEL
+from utils.probes import wait_until_ready
+from utils.profiles import get_profile_skeleton, seed_profile
+from utils.resources import commit_resources, release_resources
+from utils.nodes import get_client, get_node_network, remove_container
+from utils.timing import PhaseTimer
+import utils.docker
+
+class ProvisioningError(Exception):
+    """A launch stage failed, the message is returned to the user"""
+
+class ProvisioningService:
+    """Runs instance launches outside of the request worker"""
+
+    def __init__(self, max_workers=4, queue_limit=64, startup_timeout=30, ready_timeout=60):
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self.startup_timeout = startup_timeout
+        self.ready_timeout = ready_timeout
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """Thread pool, created on first use so it is never inherited across a fork"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='flowcase-provision')
+            return self._executor
+
+    @property
+    def pending(self):
+        """Number of queued and running tasks in this worker"""
+        return self._pending
+
+    def submit(self, app, job_id):
+        """
+        Queue a provisioning job
+
+        Returns:
+            False if the queue is full and the job was not accepted
+        """
+        return self.submit_task(app, self.run_job, job_id)
+
+    def submit_task(self, app, func, *args):
+        """Run func(*args) on the provisioning pool within an app context, False if the queue is full"""
+        with self._lock:
+            if self._pending >= self.queue_limit:
+                return False
+            self._pending += 1
+
+        self.executor.submit(self._run, app, func, *args)
+        return True
+
+    def _run(self, app, func, *args):
+        try:
+            with app.app_context():
+                func(*args)
+        except Exception as e:
+            print(f"Error in provisioning task {func.__name__}: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def run_job(self, job_id, reload=True):
+        """
+        Run a provisioning job to completion, must be called within an app context
+
+        With reload=False a launched job is left running at the 'routing' stage,
+        the caller finishes it after reloading nginx for a whole batch.
+        """
+        job = ProvisioningJob.query.get(job_id)
+        if not job:
+            return
+
+        instance = DropletInstance.query.get(job.instance_id)
+        droplet = Droplet.query.get(job.droplet_id)
+        user = User.query.get(job.user_id)
+
+        job.status = 'running'
+        db.session.commit()
+
+        timer = PhaseTimer()
+        if job.created_at:
+            timer.record('queue', (datetime.utcnow() - job.created_at).total_seconds())
+
+        try:
+            if not instance:
+                raise ProvisioningError("Instance was destroyed before it started")
+            if not droplet or not user:
+                raise ProvisioningError("Droplet or user no longer exists")
+
+            self.launch_instance(instance, droplet, user, job.resolution, job=job, reload=reload, timer=timer)
+
+            if reload:
+                job.status = 'ready'
+                job.stage = None
+        except ProvisioningError as e:
+            job.status = 'failed'
+            job.error = str(e)[:255]
+        except Exception as e:
+            log("ERROR", f"Error creating container for instance {job.instance_id}: {str(e)}")
+            job.status = 'failed'
+            job.error = f"Failed to create container: {str(e)}"[:255]
+
+        if job.is_finished():
+            job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+    def run_batch(self, job_ids, parallelism, on_progress=None):
+        """
+        Run the jobs of a bulk launch in parallel, then route all of them with a single nginx reload
+
+        on_progress(finished, total) is called from this thread as each launch finishes.
+        """
+        app = current_app._get_current_object()
+
+        def run(job_id):
+            try:
+                with app.app_context():
+                    self.run_job(job_id, reload=False)
+            except Exception as e:
+                print(f"Error in bulk launch job {job_id}: {str(e)}")
+
+        with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(job_ids))), thread_name_prefix='flowcase-bulk') as executor:
+            futures = [executor.submit(run, job_id) for job_id in job_ids]
+            for finished, _ in enumerate(as_completed(futures), start=1):
+                if on_progress:
+                    on_progress(finished, len(job_ids))
+
+        db.session.expire_all()
+        launched = ProvisioningJob.query.filter(ProvisioningJob.id.in_(job_ids), ProvisioningJob.status == 'running').all()
+        if not launched:
+            return
+
+        routing_error = None
+        reload_started = time.monotonic()
+        try:
+            reload_nginx()
+        except Exception as e:
+            routing_error = str(e)
+            log("ERROR", f"Error reloading nginx for a bulk launch of {len(launched)} instances: {routing_error}")
+
+        # Every instance of the batch waited for the shared reload
+        reload_seconds = time.monotonic() - reload_started
+        nodes = dict(db.session.query(DropletInstance.id, DropletInstance.node_id).filter(
+            DropletInstance.id.in_([job.instance_id for job in launched])).all())
+        for job in launched:
+            timer = PhaseTimer()
+            timer.record('reload', reload_seconds)
+            timer.save(job.instance_id, job.droplet_id, nodes.get(job.instance_id), success=routing_error is None, total=False)
+
+        for job in launched:
+            if routing_error is None:
+                job.status = 'ready'
+                job.stage = None
+            else:
+                self.discard_instance(job.instance_id)
+                job.status = 'failed'
+                job.error = "Failed to route the instance through nginx"
+            job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+    def _set_stage(self, job, stage, timer=None):
+        if timer is not None:
+            timer.start(stage)
+        if job is None:
+            return
+        job.stage = stage
+        db.session.commit()
+
+    def launch_instance(self, instance, droplet, user, resolution, job=None, reload=True, timer=None):
+        """
+        Start the container of an instance, wait for it and route it through nginx
+
+        On failure the container and the instance row are removed and a
+        ProvisioningError is raised. With reload=False the route is written but
+        nginx is not reloaded. The duration of each stage is recorded as a LaunchPhase.
+        """
+        timer = timer or PhaseTimer()
+        instance_id, node_id = instance.id, instance.node_id
+        container = None
+        try:
+            if get_client(instance.node_id) is None:
+                raise ProvisioningError("The Docker node of the instance is not reachable")
+
+            self._set_stage(job, 'profile', timer)
+            mount = self.prepare_profile_mount(droplet, user, instance.node_id)
+
+            self._set_stage(job, 'container', timer)
+            container = self.run_container(f"flowcase_generated_{instance.id}", droplet, user.auth_token, resolution, mount, instance.node_id)
+            log("INFO", f"Instance created for user {user.username} with droplet {droplet.display_name}")
+
+            self._set_stage(job, 'starting', timer)
+            self.wait_for_container(container)
+
+            self._set_stage(job, 'network', timer)
+            ip = self.get_container_ip(container, get_node_network(instance.node_id))
+
+            self._set_stage(job, 'ready-check', timer)
+            self.wait_until_serving(container, droplet, ip)
+
+            # The user may have destroyed the instance while it was starting
+            if not db.session.query(DropletInstance.id).filter_by(id=instance.id).scalar():
+                raise ProvisioningError("Instance was destroyed while it was starting")
+
+            self._set_stage(job, 'routing', timer)
+            instance.ip = ip
+            db.session.commit()
+            try:
+                route_instance(instance, droplet, ip, user)
+            except Exception as e:
+                log("ERROR", f"Error writing nginx config: {str(e)}")
+                raise ProvisioningError("Failed to write nginx configuration")
+            if reload:
+                timer.start('reload')
+                reload_nginx()
+
+            instance.container_id = container.id
+            instance.container_name = container.name
+            instance.container_status = 'running'
+            db.session.commit()
+            commit_resources(instance.id)
+
+            timer.save(instance_id, droplet.id, node_id)
+            return instance
+        except Exception:
+            db.session.rollback()
+            self.discard_instance(instance_id, container)
+            timer.save(instance_id, droplet.id, node_id, success=False)
+            raise
+
+    def destroy_instances(self, instance_ids, parallelism=8):
+        """Remove the containers of instances in parallel, then their rows and routes with one nginx reload"""
+        if not instance_ids:
+            return
+
+        # Each container is removed on the node it was placed on, clients are resolved before the pool
+        nodes = dict(db.session.query(DropletInstance.id, DropletInstance.node_id).filter(DropletInstance.id.in_(instance_ids)).all())
+        clients = {node_id: get_client(node_id) for node_id in set(nodes.values())}
+
+        def remove(instance_id):
+            try:
+                client = clients.get(nodes.get(instance_id)) or utils.docker.docker_client
+                if client:
+                    client.containers.get(f"flowcase_generated_{instance_id}").remove(force=True)
+            except Exception:
+                pass  # Container might not exist
+
+        with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(instance_ids))), thread_name_prefix='flowcase-destroy') as executor:
+            list(executor.map(remove, instance_ids))
+
+        DropletInstance.query.filter(DropletInstance.id.in_(instance_ids)).delete(synchronize_session=False)
+        release_resources(instance_ids)
+
+        # Every route has to go, the reload is shared by all of them
+        unrouted = [unroute_instance(instance_id) for instance_id in instance_ids]
+        if any(unrouted):
+            reload_nginx(wait=False)
+
+    def discard_instance(self, instance_id, container=None):
+        """Remove the container, row and route of an instance that never became ready"""
+        stale = DropletInstance.query.get(instance_id)
+        try:
+            if container is not None:
+                container.remove(force=True)
+            else:
+                remove_container(f"flowcase_generated_{instance_id}", stale.node_id if stale else None)
+        except Exception:
+            pass  # Container might not exist
+
+        if stale:
+            db.session.delete(stale)
+        release_resources([instance_id])
+        if unroute_instance(instance_id):
+            reload_nginx(wait=False)
+
+    def prepare_profile_mount(self, droplet, user, node_id=None):
+        """
+        Build the bind mount of the persistent profile, populating it on first use
+
+        Profiles are seeded from this host, on other nodes the profile path must be shared storage.
+        """
+        if not droplet.container_persistent_profile_path or droplet.droplet_type in ["vnc", "rdp", "ssh"]:
+            return None
+
+        profilePath = droplet.container_persistent_profile_path
+
+        # Replace variables
+        profilePath = profilePath.replace("{user_id}", str(user.id))
+        profilePath = profilePath.replace("{username}", user.username)
+        profilePath = profilePath.replace("{droplet_id}", str(droplet.id))
+
+        # Ensure path ends with /
+        if profilePath[-1] != "/":
+            profilePath += "/"
+
+        mount = docker.types.Mount(target="/home/flowcase-user", source=profilePath, type="bind", consistency="[r]private")
+
+        # A bind mount hides the image's home directory, seed new profiles from a copy of it
+        if not os.path.exists(profilePath + ".bashrc"):
+            try:
+                skeleton = get_profile_skeleton(utils.docker.get_droplet_image(droplet), get_client(node_id))
+                seed_profile(skeleton, profilePath)
+            except Exception as e:
+                log("ERROR", f"Error creating profile directory structure: {str(e)}")
+                raise ProvisioningError("Failed to setup persistent profile")
+
+        return mount
+
+    def run_container(self, name, droplet, auth_token, resolution, mount=None, node_id=None):
+        """Create and start a droplet container protected by auth_token on a node, None meaning the local node"""
+        client = get_client(node_id)
+        if client is None:
+            raise ProvisioningError("The Docker node of the instance is not reachable")
+        network = get_node_network(node_id)
+
+        # Expect the container before creating it so its start event cannot be missed, only the local daemon is watched
+        if client is utils.docker.docker_client:
+            event_watcher.expect(name)
+        try:
+            if droplet.droplet_type not in ["vnc", "rdp", "ssh"]:
+                return client.containers.run(
+                    image=utils.docker.get_droplet_image(droplet),
+                    name=name,
+                    environment={"DISPLAY": ":1", "VNC_PW": auth_token, "VNC_RESOLUTION": resolution},
+                    detach=True,
+                    network=network,
+                    mem_limit=f"{droplet.container_memory}000000",
+                    cpu_shares=int(droplet.container_cores * 1024),
+                    mounts=[mount] if mount else None,
+                    labels={FLOWCASE_LABEL: "true"},
+                )
+
+            # Guacamole droplet
+            return client.containers.run(
+                image=utils.docker.get_droplet_image(droplet),
+                name=name,
+                environment={"GUAC_KEY": auth_token[:32]},
+                detach=True,
+                network=network,
+                labels={FLOWCASE_LABEL: "true"},
+            )
+        except Exception:
+            event_watcher.cancel(name)
+            raise
+
+    def wait_for_container(self, container):
+        """
+        Wait until the container is running, raising if it exits or times out
+
+        The start/die event from the Docker event stream wakes the launch, the
+        attributes returned by containers.run() are reused so a healthy launch
+        needs no further inspect. Without an event stream the container is
+        polled with a short backoff instead.
+
+        Returns:
+            Seconds between the container creation and it running
+        """
+        timeout = self.startup_timeout if event_watcher.is_connected() else 0
+        status, latency = event_watcher.wait(container.name, timeout)
+
+        if status == 'start' and container.status == 'running':
+            log("INFO", f"Container {container.name} is running after {latency:.3f} seconds")
+            return latency
+
+        # No event or the container died: inspect it to find out what happened
+        started = time.monotonic() - latency
+        deadline = started + self.startup_timeout
+        interval = 0.1
+        while True:
+            try:
+                container.reload()
+            except Exception as e:
+                log("ERROR", f"Error checking container status: {str(e)}")
+                raise ProvisioningError("Failed to verify container status")
+
+            if container.status == 'running':
+                latency = time.monotonic() - started
+                log("INFO", f"Container {container.name} is running after {latency:.3f} seconds")
+                return latency
+
+            if container.status in ['exited', 'dead']:
+                log("ERROR", f"Container {container.name} failed to start, status: {container.status}")
+                self._log_container_output(container)
+                raise ProvisioningError(f"Container failed to start (status: {container.status})")
+
+            if time.monotonic() >= deadline:
+                break
+
+            time.sleep(interval)
+            interval = min(interval * 2, 1)
+
+        log("ERROR", f"Container {container.name} startup timed out after {self.startup_timeout} seconds")
+        self._log_container_output(container)
+        raise ProvisioningError("Container startup timed out")
+
+    def wait_until_serving(self, container, droplet, ip):
+        """Run the droplet readiness probe until the desktop accepts connections"""
+        probe = droplet.get_readiness_probe()
+        timeout = probe.get("timeout", self.ready_timeout)
+
+        ready, waited, attempts = wait_until_ready(probe, container, ip, timeout)
+        if not ready:
+            log("ERROR", f"Container {container.name} did not pass its {probe['type']} readiness probe after {waited:.3f} seconds ({attempts} attempts)")
+            self._log_container_output(container)
+            raise ProvisioningError("Droplet did not become ready in time")
+
+        log("INFO", f"Container {container.name} passed its {probe['type']} readiness probe after {waited:.3f} seconds ({attempts} attempts)")
+        return waited
+
+    def get_container_ip(self, container, network=None):
+        """Read the IP of a container on the flowcase network (or the network of its node) from its last inspect"""
+        try:
+            networks = container.attrs['NetworkSettings']['Networks']
+        except Exception as e:
+            log("ERROR", f"Error getting container network info: {str(e)}")
+            raise ProvisioningError("Failed to get container network information")
+
+        # Try different network name variations
+        for network_name in ([network] if network else []) + ['flowcase_default_network', 'default_network', 'bridge']:
+            if network_name in networks and networks[network_name]['IPAddress']:
+                ip = networks[network_name]['IPAddress']
+                log("INFO", f"Found container IP {ip} on network {network_name}")
+                return ip
+
+        log("ERROR", f"Could not find IP address for container {container.name}")
+        raise ProvisioningError("Could not determine container IP address")
+
+    def _log_container_output(self, container):
+        try:
+            logs = container.logs().decode('utf-8')[-1000:]  # Last 1000 chars
+            log("ERROR", f"Container logs: {logs}")
+        except Exception:
+            pass
+
+def fail_stale_jobs():
+    """Mark jobs left unfinished by a previous run as failed, must be called within an app context"""
+    stale = ProvisioningJob.query.filter(ProvisioningJob.status.in_(['queued', 'running'])).all()
+    for job in stale:
+        job.status = 'failed'
+        job.error = "Flowcase restarted before the launch finished"
+        job.finished_at = datetime.utcnow()
+    if stale:
+        db.session.commit()
+    return len(stale)
+
+def delete_jobs(user_id=None, droplet_id=None, instance_ids=None):
+    """Delete the jobs of a user, a droplet or instances before they are deleted, the caller commits"""
+    query = ProvisioningJob.query
+    if user_id is not None:
+        query = query.filter(ProvisioningJob.user_id == user_id)
+    if droplet_id is not None:
+        query = query.filter(ProvisioningJob.droplet_id == droplet_id)
+    if instance_ids is not None:
+        query = query.filter(ProvisioningJob.instance_id.in_(list(instance_ids)))
+    return query.delete(synchronize_session=False)
+
+def prune_jobs(older_than_days: int = 7) -> int:
+    """Delete the jobs finished more than older_than_days ago, clients only poll a job while it runs"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    deleted = ProvisioningJob.query.filter(ProvisioningJob.status.in_(['ready', 'failed']), ProvisioningJob.finished_at < cutoff) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+# Global instance (lazy loaded, so each gunicorn worker builds its own pool after fork)
+_provisioning_service_instance = None
+_provisioning_service_lock = threading.Lock()
+
+class _ProvisioningServiceProxy:
+    """Proxy to lazy load ProvisioningService"""
+    def __getattr__(self, name):
+        global _provisioning_service_instance
+        if _provisioning_service_instance is None:
+            with _provisioning_service_lock:
+                if _provisioning_service_instance is None:
+                    _provisioning_service_instance = ProvisioningService(
+                        max_workers=current_app.config.get('PROVISION_WORKERS', 4),
+                        queue_limit=current_app.config.get('PROVISION_QUEUE_LIMIT', 64),
+                        startup_timeout=current_app.config.get('PROVISION_STARTUP_TIMEOUT', 30),
+                        ready_timeout=current_app.config.get('PROVISION_READY_TIMEOUT', 60)
+                    )
+        return getattr(_provisioning_service_instance, name)
+
+# Global proxy instance
+provisioning_service = _ProvisioningServiceProxy()
@@ -0,0 +1,142 @@
+"""
+Scheduler Service
+Places droplet containers on the registered Docker nodes
+"""
+
+from flask import current_app
+from models.node import DockerNode
+from __init__ import db
+from utils.logger import log
+from utils.nodes import ensure_local_node, get_client, node_has_image
+from utils.resources import reserve_resources, get_node_limits, get_allocated_resources, node_scope
+import utils.docker
+
+SCHEDULER_STRATEGIES = ["binpack", "spread"]
+
+# Score bonus of a node that already has the droplet image, a load fraction between 0 and 1 is worth less
+IMAGE_AFFINITY_WEIGHT = 0.5
+
+IMAGE_MISSING_ERROR = "Docker image not found. Image might still be downloading."
+
+class Scheduler:
+    """Ranks nodes for a droplet and reserves its resources on the best one that fits"""
+
+    def __init__(self, strategy=None):
+        self._strategy = strategy
+
+    @property
+    def strategy(self):
+        strategy = self._strategy or current_app.config.get('SCHEDULER_STRATEGY', 'binpack')
+        return strategy if strategy in SCHEDULER_STRATEGIES else "binpack"
+
+    def nodes(self):
+        """Nodes accepting new containers, draining nodes only keep what already runs on them"""
+        ensure_local_node()
+        return DockerNode.query.filter_by(status='active').order_by(DockerNode.created_at).all()
+
+    def rank(self, droplet, count=1):
+        """
+        Order the reachable active nodes from best to worst for count containers of a droplet
+
+        binpack fills the most loaded node that still fits, spread the least loaded one.
+        Nodes that have the image already are preferred, and nodes that do not fit are
+        kept last so the reservation reports why.
+        """
+        return self._order(droplet, self._candidates(droplet), count)
+
+    def _candidates(self, droplet, require_image=False):
+        """(node, whether it has the droplet image) of the reachable active nodes, only those with the image if required"""
+        image = utils.docker.get_droplet_image(droplet)
+        candidates = [(node, node_has_image(node.id, image)) for node in self.nodes() if get_client(node.id) is not None]
+        return [(node, has_image) for node, has_image in candidates if has_image or not require_image]
+
+    def has_image(self, droplet):
+        """Whether a reachable active node has the droplet image, launches can only be placed on those"""
+        return bool(self._candidates(droplet, require_image=True))
+
+    def _order(self, droplet, candidates, count=1):
+        cores = droplet.container_cores * count
+        memory = droplet.container_memory * count
+
+        ranked = []
+        for node, has_image in candidates:
+            max_cores, max_memory = get_node_limits(node)
+            allocated_cores, allocated_memory = get_allocated_resources(node_scope(node.id))
+            load = max(
+                (allocated_cores + cores) / max_cores if max_cores else 0,
+                (allocated_memory + memory) / max_memory if max_memory else 0
+            )
+
+            score = load if self.strategy == "binpack" else 1 - load
+            if has_image:
+                score += IMAGE_AFFINITY_WEIGHT
+            ranked.append((load <= 1, score, node))
+
+        ranked.sort(key=lambda entry: (entry[0], entry[1]), reverse=True)
+        return [node for _, _, node in ranked]
+
+    def place(self, droplet, rows, tenant_id, requested_by, enforce=True, require_image=False):
+        """
+        Reserve the resources of rows (instances or warm containers) on one node and assign it to them
+
+        The reservation is tried on each ranked node in turn, the ledger decides atomically
+        if it fits. With require_image only the nodes that have the droplet image are tried,
+        containers are never pulled at launch. On success the caller's pending changes are
+        committed with it, otherwise they are rolled back.
+
+        Returns:
+            (success, error message)
+        """
+        error = IMAGE_MISSING_ERROR if require_image else "No Docker node is available to run this droplet"
+        shortages = []
+        for node in self._order(droplet, self._candidates(droplet, require_image), len(rows)):
+            success, error = reserve_resources(droplet, [row.id for row in rows], tenant_id, requested_by, enforce,
+                                               node=node, shortages=shortages)
+            if success:
+                for row in rows:
+                    row.node_id = None if node.is_local() else node.id
+                db.session.commit()
+                return True, ""
+
+        # Logging leaves the session alone, the caller's rows are dropped explicitly
+        db.session.rollback()
+        for message in shortages or [f"No Docker node{' with its image' if require_image else ''} is available for {requested_by} to run droplet {droplet.display_name}"]:
+            log("ERROR", message)
+        return False, error
+
+    def place_batch(self, droplet, rows, tenant_ids, requested_by, enforce=True, require_image=False):
+        """
+        Reserve the resources of a batch of rows in one transaction, all or nothing
+
+        Each row goes to the best ranked node that still fits, re-ranked from the ledger as
+        the batch fills it, so a batch can span nodes. tenant_ids gives each row's tenant,
+        require_image limits the nodes as in place().
+        Nothing is committed unless every row fits, and the ledger rows stay locked until
+        then, so concurrent batches are admitted one after the other instead of interleaving.
+
+        Returns:
+            (success, error message)
+        """
+        candidates = self._candidates(droplet, require_image)
+        for row, tenant_id in zip(rows, tenant_ids):
+            error = IMAGE_MISSING_ERROR if require_image else "No Docker node is available to run this droplet"
+            shortages = []
+            success = False
+            for node in self._order(droplet, candidates):
+                success, error = reserve_resources(droplet, [row.id], tenant_id, requested_by, enforce,
+                                                   node=node, shortages=shortages)
+                if success:
+                    row.node_id = None if node.is_local() else node.id
+                    break
+
+            if not success:
+                db.session.rollback()
+                for message in shortages or [f"No Docker node{' with its image' if require_image else ''} is available for {requested_by} to run droplet {droplet.display_name}"]:
+                    log("ERROR", message)
+                return False, error
+
+        db.session.commit()
+        return True, ""
+
+# Global instance
+scheduler = Scheduler()
@@ -0,0 +1,287 @@
+"""
+Warm Pool Service
+Keeps pre-started containers of popular droplets ready to be claimed by users
+"""
+
+import threading
+from datetime import datetime, timedelta
+from models.droplet import Droplet, DropletInstance, WarmContainer
+from __init__ import db
+from utils.logger import log
+from utils.nginx import route_instance, unroute_instance, reload_nginx
+from utils.resources import commit_resources, release_resources, assign_resources_tenant
+from utils.nodes import get_node_network, remove_container
+from utils.timing import PhaseTimer
+from services.provisioning import provisioning_service
+from services.scheduler import scheduler
+import utils.docker
+
+# Warm containers start before anyone asked for them, KasmVNC resizes to the client on connect
+WARM_POOL_RESOLUTION = "1280x720"
+
+# Containers stuck in 'starting' or 'claimed' for longer than this are discarded by maintain()
+WARM_POOL_STARTING_TIMEOUT = timedelta(minutes=5)
+
+# Claims in this window grow the pool above its minimum, up to its maximum
+WARM_POOL_DEMAND_WINDOW = timedelta(minutes=10)
+
+class WarmPoolService:
+    """Pre-starts droplet containers and binds them to users on request"""
+
+    def __init__(self, provisioner):
+        self.provisioner = provisioner
+        self._refilling = set()
+        self._lock = threading.Lock()
+
+    def is_enabled(self, droplet):
+        """Warm pools need a container droplet without a per-user profile mount"""
+        return (
+            droplet.droplet_type == "container"
+            and (droplet.warm_pool_max or 0) > 0
+            and not droplet.container_persistent_profile_path
+        )
+
+    def target_size(self, droplet):
+        """Pool size to refill to: the minimum, plus recent claims up to the maximum"""
+        pool_min = droplet.warm_pool_min or 0
+        pool_max = max(droplet.warm_pool_max or 0, pool_min)
+
+        since = datetime.utcnow() - WARM_POOL_DEMAND_WINDOW
+        recent_claims = DropletInstance.query.filter(
+            DropletInstance.droplet_id == droplet.id,
+            DropletInstance.vnc_password.isnot(None),
+            DropletInstance.created_at >= since
+        ).count()
+
+        return min(pool_min + recent_claims, pool_max)
+
+    def claim(self, droplet, user):
+        """
+        Take a ready container from the droplet's pool and bind it to the user
+
+        Returns:
+            The new DropletInstance, or None if the pool had nothing to hand out
+        """
+        if not self.is_enabled(droplet):
+            return None
+
+        candidates = WarmContainer.query.filter_by(droplet_id=droplet.id, status='ready') \
+            .order_by(WarmContainer.created_at).limit(5).all()
+
+        for warm in candidates:
+            # Conditional update so two workers can never claim the same container
+            claimed = WarmContainer.query.filter_by(id=warm.id, status='ready').update(
+                {'status': 'claimed', 'claimed_at': datetime.utcnow()},
+                synchronize_session=False
+            )
+            db.session.commit()
+            if claimed != 1:
+                continue
+
+            # The reservation is keyed by the same id, it now counts towards the user's tenant if the tenant has room
+            success, _ = assign_resources_tenant(droplet, warm.id, user.tenant_id, f"user {user.username}")
+            if not success:
+                # Back in the pool, the cold launch refuses the request with the tenant's shortage
+                WarmContainer.query.filter_by(id=warm.id, status='claimed').update(
+                    {'status': 'ready', 'claimed_at': None},
+                    synchronize_session=False
+                )
+                db.session.commit()
+                return None
+
+            instance = self.bind(warm, droplet, user)
+            if instance:
+                return instance
+
+        return None
+
+    def bind(self, warm, droplet, user):
+        """Turn a claimed warm container into the user's instance by routing it through nginx"""
+        timer = PhaseTimer()
+        instance = DropletInstance(
+            id=warm.id,
+            droplet_id=droplet.id,
+            user_id=user.id,
+            container_id=warm.container_id,
+            container_name=f"flowcase_generated_{warm.id}",
+            container_status='running',
+            vnc_password=warm.vnc_password,
+            ip=warm.ip,
+            node_id=warm.node_id
+        )
+        db.session.add(instance)
+        db.session.commit()
+
+        try:
+            timer.start('routing')
+            route_instance(instance, droplet, warm.ip, user)
+            timer.start('reload')
+            reload_nginx()
+        except Exception as e:
+            log("ERROR", f"Error routing warm container {warm.id}: {str(e)}")
+            DropletInstance.query.filter_by(id=instance.id).delete(synchronize_session=False)
+            db.session.commit()
+            timer.save(warm.id, droplet.id, warm.node_id, success=False)
+            self.discard(warm)
+            return None
+
+        WarmContainer.query.filter_by(id=warm.id).delete(synchronize_session=False)
+        db.session.commit()
+        commit_resources(instance.id)
+        timer.save(instance.id, droplet.id, instance.node_id)
+
+        log("INFO", f"Assigned warm container {instance.id} to user {user.username} with droplet {droplet.display_name}")
+        return instance
+
+    def schedule_refill(self, app, droplet_id):
+        """Refill a droplet's pool on the provisioning pool, at most one refill per droplet at a time"""
+        with self._lock:
+            if droplet_id in self._refilling:
+                return False
+            self._refilling.add(droplet_id)
+
+        if not self.provisioner.submit_task(app, self._refill_task, droplet_id):
+            with self._lock:
+                self._refilling.discard(droplet_id)
+            return False
+        return True
+
+    def _refill_task(self, droplet_id):
+        try:
+            self.refill(droplet_id)
+        finally:
+            with self._lock:
+                self._refilling.discard(droplet_id)
+
+    def refill(self, droplet_id):
+        """Start containers until the pool reaches its target size, returns how many were started"""
+        droplet = Droplet.query.get(droplet_id)
+        if not droplet or not self.is_enabled(droplet) or not utils.docker.docker_client:
+            return 0
+
+        started = 0
+        target = self.target_size(droplet)
+        while WarmContainer.query.filter(WarmContainer.droplet_id == droplet.id, WarmContainer.status != 'claimed').count() < target:
+            # start_container reserves resources first, the pool stops growing once every node is full
+            if not self.start_container(droplet):
+                break
+            started += 1
+
+        if started:
+            log("INFO", f"Started {started} warm container(s) for droplet {droplet.display_name}")
+        return started
+
+    def start_container(self, droplet):
+        """Start one warm container and wait until it is running, returns False on failure"""
+        from routes.auth import generate_auth_token
+
+        warm = WarmContainer(droplet_id=droplet.id, vnc_password=generate_auth_token(), status='starting')
+        db.session.add(warm)
+        db.session.flush()
+
+        # The pool must never take capacity away from real instances
+        success, _ = scheduler.place(droplet, [warm], None, "warm pool", require_image=True)
+        if not success:
+            return False
+
+        warm_id, node_id = warm.id, warm.node_id
+        timer = PhaseTimer()
+        container = None
+        try:
+            timer.start('container')
+            container = self.provisioner.run_container(
+                f"flowcase_generated_{warm.id}", droplet, warm.vnc_password, WARM_POOL_RESOLUTION, node_id=warm.node_id
+            )
+            warm.container_id = container.id
+            db.session.commit()
+
+            timer.start('starting')
+            self.provisioner.wait_for_container(container)
+            timer.start('network')
+            warm.ip = self.provisioner.get_container_ip(container, get_node_network(warm.node_id))
+            timer.start('ready-check')
+            self.provisioner.wait_until_serving(container, droplet, warm.ip)
+            warm.status = 'ready'
+            db.session.commit()
+            timer.save(warm_id, droplet.id, node_id)
+            return True
+        except Exception as e:
+            log("ERROR", f"Error starting warm container for droplet {droplet.display_name}: {str(e)}")
+            db.session.rollback()
+            if container is not None:
+                try:
+                    container.remove(force=True)
+                except Exception:
+                    pass
+            WarmContainer.query.filter_by(id=warm_id).delete(synchronize_session=False)
+            release_resources([warm_id])
+            timer.save(warm_id, droplet.id, node_id, success=False)
+            return False
+
+    def discard(self, warm):
+        """Remove a warm container and its row"""
+        remove_container(f"flowcase_generated_{warm.id}", warm.node_id)
+        # Only claimed containers can have been routed
+        if warm.status == 'claimed' and unroute_instance(warm.id):
+            reload_nginx(wait=False)
+
+        WarmContainer.query.filter_by(id=warm.id).delete(synchronize_session=False)
+        release_resources([warm.id])
+
+    def drain(self, droplet_id):
+        """Discard every warm container of a droplet, returns how many were removed"""
+        warm_containers = WarmContainer.query.filter_by(droplet_id=droplet_id).all()
+        for warm in warm_containers:
+            self.discard(warm)
+        return len(warm_containers)
+
+    def maintain(self):
+        """Periodic pass: drop stuck or surplus containers and top up every pool"""
+        now = datetime.utcnow()
+        for warm in WarmContainer.query.filter(WarmContainer.status.in_(['starting', 'claimed'])).all():
+            started_at = warm.claimed_at or warm.created_at
+            if started_at and now - started_at > WARM_POOL_STARTING_TIMEOUT:
+                self.discard(warm)
+
+        for droplet in Droplet.query.all():
+            ready = WarmContainer.query.filter_by(droplet_id=droplet.id, status='ready') \
+                .order_by(WarmContainer.created_at.desc()).all()
+
+            if not self.is_enabled(droplet):
+                for warm in ready:
+                    self.discard(warm)
+                continue
+
+            surplus = len(ready) - max(droplet.warm_pool_max, droplet.warm_pool_min or 0)
+            for warm in ready[:max(surplus, 0)]:
+                self.discard(warm)
+
+            self.refill(droplet.id)
+
+    def status(self):
+        """Per droplet pool sizes, for the admin panel"""
+        pools = []
+        for droplet in Droplet.query.filter(Droplet.warm_pool_max > 0).all():
+            counts = {state: 0 for state in ['starting', 'ready', 'claimed']}
+            for warm in WarmContainer.query.filter_by(droplet_id=droplet.id).all():
+                counts[warm.status] = counts.get(warm.status, 0) + 1
+
+            pools.append({
+                "droplet_id": droplet.id,
+                "display_name": droplet.display_name,
+                "enabled": self.is_enabled(droplet),
+                "min": droplet.warm_pool_min,
+                "max": droplet.warm_pool_max,
+                "target": self.target_size(droplet),
+                "containers": counts
+            })
+        return pools
+
+def reset_warm_pools():
+    """Forget every warm container, used at startup after cleanup_containers removed them"""
+    deleted = WarmContainer.query.delete()
+    db.session.commit()
+    return deleted
+
+# Global instance
+warm_pool = WarmPoolService(provisioning_service)
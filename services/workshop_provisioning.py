@@ -0,0 +1,156 @@
+"""
+Workshop Provisioning Service
+Starts and tears down the droplet instances of user workshops
+"""
+
+from datetime import datetime
+from models.droplet import Droplet, DropletInstance, ProvisioningJob
+from models.workshop import WorkshopTemplate, UserWorkshop
+from models.user import User
+from __init__ import db
+from utils.logger import log
+from services.provisioning import provisioning_service
+from services.scheduler import scheduler
+import utils.docker
+
+# Workshop instances start before anyone connects, KasmVNC resizes to the client on connect
+WORKSHOP_RESOLUTION = "1280x720"
+
+class WorkshopProvisioner:
+    """Launches every droplet of a workshop template as one batch"""
+
+    def __init__(self, provisioner, scheduler):
+        self.provisioner = provisioner
+        self.scheduler = scheduler
+
+    def resolve_droplets(self, template_id):
+        """
+        Return the droplets a workshop template needs, one entry per instance to start
+
+        Template droplets are droplet ids, or objects with a droplet_id and an optional count.
+
+        Returns:
+            (droplets, error message)
+        """
+        template = WorkshopTemplate.query.get(template_id) if template_id else None
+        if not template:
+            return [], ""
+
+        droplets = []
+        for entry in template.get_template_droplets():
+            droplet_id = entry.get('droplet_id') if isinstance(entry, dict) else entry
+            count = int(entry.get('count', 1)) if isinstance(entry, dict) else 1
+
+            droplet = Droplet.query.get(str(droplet_id))
+            if not droplet:
+                return [], f"Droplet {droplet_id} of the workshop template no longer exists"
+            droplets.extend([droplet] * count)
+        return droplets, ""
+
+    def admit(self, droplets):
+        """Check that the image of every droplet is on a node it can be placed on, returns (success, error message)"""
+        if not droplets:
+            return True, ""
+        if not utils.docker.docker_client:
+            return False, "Docker service is not available"
+
+        for droplet in {droplet.id: droplet for droplet in droplets}.values():
+            if not self.scheduler.has_image(droplet):
+                return False, f"Docker image of {droplet.display_name} not found. Image might still be downloading."
+        return True, ""
+
+    def start(self, app, user_workshop, droplets, parallelism, requested_by):
+        """
+        Create the instances of a user workshop, reserve their resources and launch them on the provisioning pool
+
+        Returns:
+            (success, error message), nothing is started if the resources do not fit or the provisioning queue is full
+        """
+        user_workshop.progress = 0
+        user_workshop.start_time = datetime.utcnow()
+        user_workshop.end_time = None
+
+        if not droplets:
+            user_workshop.status = 'ready'
+            user_workshop.progress = 100
+            user_workshop.set_instance_ids([])
+            db.session.commit()
+            return True, ""
+
+        jobs = []
+        instances = []
+        for droplet in droplets:
+            instance = DropletInstance(droplet_id=droplet.id, user_id=user_workshop.user_id, container_status='creating')
+            db.session.add(instance)
+            db.session.flush()
+            job = ProvisioningJob(instance_id=instance.id, droplet_id=droplet.id, user_id=user_workshop.user_id,
+                                  resolution=WORKSHOP_RESOLUTION, batch_id=user_workshop.id)
+            db.session.add(job)
+            jobs.append(job)
+            instances.append(instance)
+
+        user_workshop.status = 'creating'
+        user_workshop.set_instance_ids([job.instance_id for job in jobs])
+        instance_ids = [job.instance_id for job in jobs]
+        job_ids = [job.id for job in jobs]
+
+        # Each instance is placed on its own node, the first placement also commits the rows created above
+        tenant_id = User.query.get(user_workshop.user_id).tenant_id
+        for droplet, instance in zip(droplets, instances):
+            # Guacamole droplets are recorded but not limited
+            success, error = self.scheduler.place(droplet, [instance], tenant_id, requested_by,
+                                                  enforce=droplet.droplet_type not in ["vnc", "rdp", "ssh"], require_image=True)
+            if not success:
+                self._abort(user_workshop, instance_ids, job_ids)
+                return False, error
+
+        if not self.provisioner.submit_task(app, self.run, user_workshop.id, job_ids, parallelism):
+            self._abort(user_workshop, instance_ids, job_ids)
+            return False, "Too many instances are being launched right now. Please try again in a moment."
+        return True, ""
+
+    def _abort(self, user_workshop, instance_ids, job_ids):
+        """Undo a start that did not make it to the provisioning pool"""
+        self.provisioner.destroy_instances(instance_ids)
+        ProvisioningJob.query.filter(ProvisioningJob.id.in_(job_ids)).delete(synchronize_session=False)
+        user_workshop.status = 'stopped'
+        user_workshop.set_instance_ids([])
+        db.session.commit()
+
+    def run(self, user_workshop_id, job_ids, parallelism):
+        """Launch the jobs of a user workshop, keeping its progress up to date"""
+        def on_progress(finished, total):
+            # Routing still has to happen once every container is up
+            UserWorkshop.query.filter_by(id=user_workshop_id).update(
+                {'progress': min(99, finished * 100 // total)}, synchronize_session=False
+            )
+            db.session.commit()
+
+        self.provisioner.run_batch(job_ids, parallelism, on_progress=on_progress)
+
+        db.session.expire_all()
+        user_workshop = UserWorkshop.query.get(user_workshop_id)
+        if not user_workshop or user_workshop.status != 'creating':
+            return  # stopped or deleted while it was starting
+
+        jobs = ProvisioningJob.query.filter(ProvisioningJob.id.in_(job_ids)).all()
+        failed = [job for job in jobs if job.status != 'ready']
+        user_workshop.status = 'error' if failed else 'ready'
+        user_workshop.progress = 100
+        db.session.commit()
+
+        if failed:
+            log("ERROR", f"{len(failed)} of {len(jobs)} instances of user workshop {user_workshop_id} failed to start: {failed[0].error}")
+        else:
+            log("INFO", f"Started {len(jobs)} instances for user workshop {user_workshop_id}")
+
+    def stop(self, user_workshop):
+        """Tear down every instance of a user workshop in parallel"""
+        self.provisioner.destroy_instances(user_workshop.get_instance_ids())
+        user_workshop.set_instance_ids([])
+        user_workshop.status = 'stopped'
+        user_workshop.end_time = datetime.utcnow()
+        db.session.commit()
+
+# Global instance
+workshop_provisioner = WorkshopProvisioner(provisioning_service, scheduler)
@@ -463,10 +463,22 @@ function FetchAdminSystemInfo(callback)
 	console.log("Retrieving system information...");
 }
 
+// Cursors of the log pages reached so far, adminLogCursors[n] opens page n + 1
+var adminLogCursors = [null];
+
 function FetchAdminLogs(page)
 {
 	var logTypeFilter = document.getElementById('log-type-filter').value;
-	var url = "/api/admin/logs?page=" + page;
+	var url = "/api/admin/logs?include_total=true";
+	
+	// Pages next to the ones already seen are read after their cursor, others by number
+	if (page === 1) {
+		adminLogCursors = [null];
+	} else if (adminLogCursors[page - 1]) {
+		url += "&cursor=" + encodeURIComponent(adminLogCursors[page - 1]);
+	} else {
+		url += "&page=" + page;
+	}
 	
 	if (logTypeFilter) {
 		url += "&type=" + logTypeFilter;
@@ -526,7 +538,10 @@ function FetchAdminLogs(page)
 				logsContent.innerHTML = logsHtml;
 				
 				// Update pagination
-				renderPagination('logs-pagination', json.pagination.page, json.pagination.pages, 'FetchAdminLogs');
+				if (json.pagination.next_cursor) {
+					adminLogCursors[page] = json.pagination.next_cursor;
+				}
+				renderPagination('logs-pagination', page, json.pagination.pages, 'FetchAdminLogs');
 			}
 			else
 			{
@@ -1098,6 +1113,21 @@ function ShowEditDroplet(instance_id = null)
 		</select>
 	</div>
 
+	<div class="admin-modal-card">
+		<p>Readiness Probe (JSON, leave empty for the default)</p>
+		<textarea style="resize: vertical; height: 60px;" id="admin-edit-droplet-readiness-probe" placeholder='{"type": "tcp", "port": 6901, "timeout": 60}'>${ droplet != null && droplet.readiness_probe ? droplet.readiness_probe : "" }</textarea>
+	</div>
+
+	<div class="admin-modal-card">
+		<p>Idle Timeout (minutes)</p>
+		<input type="number" min="0" id="admin-edit-droplet-idle-timeout" placeholder="Default" value="${ droplet != null && droplet.idle_timeout != null ? droplet.idle_timeout : "" }">
+	</div>
+
+	<div class="admin-modal-card">
+		<p>Pause After Idle (minutes)</p>
+		<input type="number" min="0" id="admin-edit-droplet-freeze-timeout" placeholder="Default" value="${ droplet != null && droplet.freeze_timeout != null ? droplet.freeze_timeout : "" }">
+	</div>
+
 	<div id="admin-droplet-edit-container-only">
 		<div class="admin-modal-card">
 			<p>Docker Registry <span class="required">*</span></p>
@@ -1123,6 +1153,16 @@ function ShowEditDroplet(instance_id = null)
 			<p>Persistant Profile Path</p>
 			<input type="text" id="admin-edit-droplet-persistent-profile" value="${ droplet != null ? droplet.container_persistent_profile_path ? droplet.container_persistent_profile_path : "" : "" }">
 		</div>
+
+		<div class="admin-modal-card">
+			<p>Warm Pool Minimum</p>
+			<input type="number" min="0" id="admin-edit-droplet-warm-pool-min" value="${ droplet != null && droplet.warm_pool_min ? droplet.warm_pool_min : 0 }">
+		</div>
+
+		<div class="admin-modal-card">
+			<p>Warm Pool Maximum</p>
+			<input type="number" min="0" id="admin-edit-droplet-warm-pool-max" value="${ droplet != null && droplet.warm_pool_max ? droplet.warm_pool_max : 0 }">
+		</div>
 	</div>
 
 	<div id="admin-droplet-edit-server-only">
@@ -1235,11 +1275,16 @@ function SaveDroplet(droplet_id = null)
 		"description": document.getElementById('admin-edit-droplet-description').value,
 		"image_path": document.getElementById('admin-edit-droplet-image-path').value,
 		"droplet_type": document.getElementById('admin-edit-droplet-type').value,
+		"readiness_probe": document.getElementById('admin-edit-droplet-readiness-probe').value,
+		"idle_timeout": document.getElementById('admin-edit-droplet-idle-timeout').value === "" ? null : parseInt(document.getElementById('admin-edit-droplet-idle-timeout').value),
+		"freeze_timeout": document.getElementById('admin-edit-droplet-freeze-timeout').value === "" ? null : parseInt(document.getElementById('admin-edit-droplet-freeze-timeout').value),
 		"container_docker_registry": document.getElementById('admin-edit-droplet-docker-registry').value,
 		"container_docker_image": document.getElementById('admin-edit-droplet-docker-image').value,
 		"container_cores": document.getElementById('admin-edit-droplet-cores').value,
 		"container_memory": document.getElementById('admin-edit-droplet-memory').value,
 		"container_persistent_profile_path": document.getElementById('admin-edit-droplet-persistent-profile').value,
+		"warm_pool_min": parseInt(document.getElementById('admin-edit-droplet-warm-pool-min').value) || 0,
+		"warm_pool_max": parseInt(document.getElementById('admin-edit-droplet-warm-pool-max').value) || 0,
 		"server_ip": document.getElementById('admin-edit-droplet-ip-address').value,
 		"server_port": document.getElementById('admin-edit-droplet-port').value,
 		"server_username": document.getElementById('admin-edit-droplet-username').value,
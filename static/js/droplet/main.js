@@ -6,6 +6,18 @@ window.onload = function() {
 	InitializeEventListeners();
 	SideBarHandleInit();
 	ReloadIFrame();
+	setInterval(SendHeartbeat, 60000);
+}
+
+// The desktop websocket never reaches Flowcase, tell it the instance is in use so it is not reaped as idle
+function SendHeartbeat() {
+	if (document.visibilityState !== 'visible' || !document.hasFocus()) {
+		return;
+	}
+
+	var xhr = new XMLHttpRequest();
+	xhr.open("POST", `/api/instance/${instanceInfo.id}/heartbeat`, true);
+	xhr.send();
 }
 
 function ReloadIFrame() {
@@ -5,6 +5,7 @@ Basic tests for Nalabo application
 import unittest
 import sys
 import os
+from unittest.mock import patch
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from __init__ import create_app, db
@@ -53,5 +54,652 @@ class BasicTestCase(unittest.TestCase):
         response = self.client.get('/nonexistent')
         self.assertEqual(response.status_code, 404)
 
+class DatabaseTestCase(unittest.TestCase):
+    """Database URIs, pool options and SQLite pragmas"""
+
+    def setUp(self):
+        import tempfile
+        self.data_dir = tempfile.mkdtemp()
+        self.app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(self.data_dir, 'flowcase.db'),
+            'LOG_DATABASE_URI': 'sqlite:///' + os.path.join(self.data_dir, 'logs.db'),
+            'WTF_CSRF_ENABLED': False
+        })
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        import shutil
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+        self.ctx.pop()
+        shutil.rmtree(self.data_dir)
+
+    def test_sqlite_pragmas_are_set_on_connect(self):
+        for engine in db.engines.values():
+            with engine.connect() as connection:
+                self.assertEqual(connection.exec_driver_sql("PRAGMA journal_mode").scalar(), "wal")
+                self.assertEqual(connection.exec_driver_sql("PRAGMA synchronous").scalar(), 1)  # NORMAL
+                self.assertEqual(connection.exec_driver_sql("PRAGMA busy_timeout").scalar(), 5000)
+                self.assertEqual(connection.exec_driver_sql("PRAGMA cache_size").scalar(), -64000)
+            self.assertEqual(engine.pool.size(), 5)
+            self.assertTrue(engine.pool._pre_ping)
+
+    def test_schema_upgrade_adds_new_columns(self):
+        from sqlalchemy import text
+        from models.user import User
+        from utils.database import upgrade_schema
+
+        # The user table as versions without desktop cookies created it
+        db.session.execute(text('CREATE TABLE "user" (id VARCHAR(36) PRIMARY KEY, username VARCHAR(80) NOT NULL UNIQUE, '
+                                'password VARCHAR(80) NOT NULL, groups VARCHAR(255), auth_token VARCHAR(80), '
+                                'tenant_id VARCHAR(36), created_at DATETIME)'))
+        db.session.execute(text("INSERT INTO \"user\" (id, username, password, groups) VALUES ('u1', 'student', 'x', '')"))
+        db.session.commit()
+        db.create_all()
+
+        self.assertIn("user.session_epoch", upgrade_schema())
+        self.assertEqual(User.query.get('u1').session_epoch, 0)
+        self.assertEqual(upgrade_schema(), [])
+
+    def test_health_checks_the_database(self):
+        response = self.app.test_client().get('/api/health')
+        self.assertTrue(response.get_json()['components']['database'])
+
+    def test_postgres_uri(self):
+        from flask import Flask
+        from config.config import configure_app
+        app = Flask(__name__)
+        with patch.dict(os.environ, {'DATABASE_URL': 'postgres://flowcase:secret@db/flowcase', 'FLOWCASE_DATABASE_POOL_SIZE': '20'}):
+            configure_app(app)
+        self.assertEqual(app.config['SQLALCHEMY_DATABASE_URI'], 'postgresql://flowcase:secret@db/flowcase')
+        self.assertEqual(app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size'], 20)
+        # Log partitions live in the shared database too
+        self.assertEqual(app.config['SQLALCHEMY_BINDS']['logs']['url'], 'postgresql://flowcase:secret@db/flowcase')
+
+    def test_postgres_engine_options_and_schema(self):
+        from unittest import mock
+        from flask import Flask
+        from sqlalchemy.dialects import postgresql
+        from config.config import configure_app
+        from models.droplet import Droplet
+        from utils.database import is_sqlite, is_memory, _column_ddl
+        from utils.log_store import has_full_text
+        app = Flask(__name__)
+        with patch.dict(os.environ, {'DATABASE_URL': 'postgres://flowcase:secret@db/flowcase'}):
+            configure_app(app)
+        uri = app.config['SQLALCHEMY_DATABASE_URI']
+        self.assertFalse(is_sqlite(uri))
+        self.assertFalse(is_memory(uri))
+        options = {'pool_size': 5, 'max_overflow': 10, 'pool_recycle': 1800, 'pool_pre_ping': True}
+        self.assertEqual(app.config['SQLALCHEMY_ENGINE_OPTIONS'], options)
+        self.assertEqual(app.config['SQLALCHEMY_BINDS']['logs'], {'url': uri, **options})
+
+        # Columns added to existing tables, and no FTS5 outside SQLite
+        dialect = postgresql.dialect()
+        self.assertEqual(_column_ddl(Droplet.__table__.c.is_active, dialect), "is_active BOOLEAN DEFAULT true")
+        self.assertFalse(has_full_text(mock.Mock(dialect=dialect)))
+
 if __name__ == '__main__':
     unittest.main()
+
+class DesktopAuthTestCase(unittest.TestCase):
+    """nginx auth_request of desktop requests"""
+
+    def setUp(self):
+        self.app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        })
+        self.client = self.app.test_client()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        from models.user import User
+        self.user = User(username="student", password="x", auth_token="t" * 80, groups="")
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def connect(self, cookies, instance_id="instance-1"):
+        client = self.app.test_client()
+        for name, value in cookies.items():
+            client.set_cookie(name, value)
+        return client.get('/droplet_connect', headers={"X-Original-URI": f"/desktop/{instance_id}/vnc/websockify"}).status_code
+
+    def test_signed_cookie_is_scoped_to_its_instance_and_revoked_on_logout(self):
+        from unittest import mock
+        from utils.desktop_auth import DESKTOP_COOKIE, create_desktop_cookie, revoke_desktop_cookies
+
+        cookie = {DESKTOP_COOKIE: create_desktop_cookie("instance-1", self.user, 60)}
+        with mock.patch('routes.auth.idle_reaper'):
+            self.assertEqual(self.connect(cookie), 200)
+            self.assertEqual(self.connect(cookie, "instance-2"), 401)
+            tampered = cookie[DESKTOP_COOKIE][:-1] + ("1" if cookie[DESKTOP_COOKIE][-1] == "0" else "0")
+            self.assertEqual(self.connect({DESKTOP_COOKIE: tampered}), 401)
+            self.assertEqual(self.connect({DESKTOP_COOKIE: create_desktop_cookie("instance-1", self.user, -1)}), 401)
+
+            revoke_desktop_cookies(self.user.id)
+            self.assertEqual(self.connect(cookie), 401)
+
+    def test_legacy_cookies(self):
+        from unittest import mock
+
+        with mock.patch('routes.auth.idle_reaper'):
+            self.assertEqual(self.connect({"userid": self.user.id, "token": "t" * 80}), 200)
+            self.assertEqual(self.connect({"userid": self.user.id, "token": "x" * 80}), 401)
+            self.assertEqual(self.connect({}), 401)
+
+class PermissionsTestCase(unittest.TestCase):
+    """Compiled permission bitmasks"""
+
+    def setUp(self):
+        self.app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        })
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        from models.user import User, Group
+        self.group = Group(display_name="Viewers", protected=False, perm_admin_panel=False, perm_view_instances=True,
+                           perm_edit_instances=False, perm_view_users=False, perm_edit_users=False,
+                           perm_view_droplets=True, perm_edit_droplets=False, perm_view_registry=False,
+                           perm_edit_registry=False, perm_view_groups=False, perm_edit_groups=False)
+        db.session.add(self.group)
+        db.session.flush()
+        self.user = User(username="viewer", password="x", auth_token="t" * 80, groups=f"{self.group.id},deleted-group")
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_checks_use_the_cached_mask_until_invalidated(self):
+        from unittest import mock
+        from utils.permissions import Permissions
+
+        self.assertTrue(Permissions.check_permission(self.user.id, Permissions.VIEW_INSTANCES))
+        self.assertFalse(Permissions.check_permission(self.user.id, Permissions.EDIT_INSTANCES))
+
+        with mock.patch.object(Permissions, 'compile') as compile:
+            self.assertTrue(Permissions.check_permission(self.user.id, Permissions.VIEW_DROPLETS))
+            compile.assert_not_called()
+
+        self.group.perm_edit_instances = True
+        db.session.commit()
+        Permissions.invalidate()
+        self.assertTrue(Permissions.check_permission(self.user.id, Permissions.EDIT_INSTANCES))
+        self.assertFalse(Permissions.check_permission("missing-user", Permissions.VIEW_INSTANCES))
+
+class AdminApiTestCase(unittest.TestCase):
+    """Admin endpoints of the admin and admin_api blueprints"""
+
+    def setUp(self):
+        self.app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        })
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        from models.user import User, Group
+        from utils.permissions import Permissions
+        Permissions._version = None
+        group = Group(display_name="Admins", protected=False, perm_admin_panel=True, perm_view_instances=True,
+                      perm_edit_instances=True, perm_view_users=True, perm_edit_users=True,
+                      perm_view_droplets=True, perm_edit_droplets=True, perm_view_registry=True,
+                      perm_edit_registry=True, perm_view_groups=True, perm_edit_groups=True)
+        db.session.add(group)
+        db.session.flush()
+        self.admin = User(username="admin", password="x", auth_token="t" * 80, groups=group.id)
+        db.session.add_all([self.admin, User(username="student", password="x", auth_token="s" * 80, groups="")])
+        db.session.commit()
+
+    def tearDown(self):
+        from flask import g
+        g.pop('_login_user', None)
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def call(self, endpoint, path):
+        # admin_bp registers the same paths first, so the views are called directly
+        from flask_login import login_user
+        with self.app.test_request_context(path):
+            login_user(self.admin)
+            response = self.app.make_response(self.app.view_functions[endpoint]())
+        return response.status_code, response.get_json()
+
+    def edit_droplet(self, **fields):
+        from flask import g
+        g.pop('_login_user', None)
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = self.admin.id
+            session['_fresh'] = True
+        response = client.post('/api/admin/droplet', json={
+            "id": None, "display_name": "Desktop", "droplet_type": "container", "container_docker_registry": "https://hub.docker.com",
+            "container_docker_image": "flowcase/desktop:latest", "container_cores": 1, "container_memory": 1024, **fields
+        })
+        return response.status_code, response.get_json()
+
+    def test_droplet_timeouts_are_whole_minutes(self):
+        from models.droplet import Droplet
+        for field in ("idle_timeout", "freeze_timeout"):
+            self.assertEqual(self.edit_droplet(**{field: "abc"})[0], 400)
+            self.assertEqual(self.edit_droplet(**{field: -1})[0], 400)
+            status, body = self.edit_droplet(**{field: "15"})
+            self.assertEqual(status, 200, body)
+            self.assertEqual(getattr(Droplet.query.get(body["droplet_id"]), field), 15)
+            status, body = self.edit_droplet(**{field: ""})
+            self.assertEqual(status, 200, body)
+            self.assertIsNone(getattr(Droplet.query.get(body["droplet_id"]), field))
+
+    def test_droplet_warm_pool_bounds_are_numbers(self):
+        from models.droplet import Droplet
+        self.assertEqual(self.edit_droplet(warm_pool_min="x")[0], 400)
+        self.assertEqual(self.edit_droplet(warm_pool_max=-1)[0], 400)
+        # Compared as text, "10" would be lower than "9"
+        self.assertEqual(self.edit_droplet(warm_pool_min="10", warm_pool_max="9")[0], 400)
+        status, body = self.edit_droplet(warm_pool_min="9", warm_pool_max="10")
+        self.assertEqual(status, 200, body)
+        droplet = Droplet.query.get(body["droplet_id"])
+        self.assertEqual((droplet.warm_pool_min, droplet.warm_pool_max), (9, 10))
+
+    def test_users_and_droplets_are_paginated(self):
+        from models.droplet import Droplet
+        db.session.add(Droplet(display_name="Desktop", droplet_type="container", container_docker_image="flowcase/desktop:latest"))
+        db.session.commit()
+
+        status, body = self.call('admin_api.list_users', '/api/admin/users?per_page=1&page=2')
+        self.assertEqual(status, 200, body)
+        self.assertEqual((len(body['users']), body['total'], body['pages'], body['current_page']), (1, 2, 2, 2))
+        self.assertNotIn('next_cursor', body)
+
+        status, body = self.call('admin_api.list_droplets', '/api/admin/droplets')
+        self.assertEqual(status, 200, body)
+        self.assertEqual((len(body['droplets']), body['total'], body['pages'], body['current_page']), (1, 1, 1, 1))
+
+class UserLoaderCacheTestCase(unittest.TestCase):
+    """Logged in users served from the per-worker snapshot cache"""
+
+    def setUp(self):
+        self.app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False,
+            'USER_LOADER_CACHE': True
+        })
+        self.client = self.app.test_client()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        # The version stamp read from the previous test's database is still cached
+        from utils.permissions import Permissions
+        Permissions._version = None
+
+        from models.user import User
+        self.user = User(username="student", password="x", auth_token="t" * 80, groups="")
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_snapshot_is_reused_until_users_change(self):
+        from utils.permissions import Permissions
+        from utils.user_cache import load_user_snapshot
+
+        snapshot = load_user_snapshot(self.user.id)
+        self.assertEqual(snapshot.username, "student")
+        self.assertIs(load_user_snapshot(self.user.id), snapshot)
+        self.assertIsNone(load_user_snapshot("missing-user"))
+
+        Permissions.invalidate()
+        self.assertIsNot(load_user_snapshot(self.user.id), snapshot)
+
+    def test_requests_are_served_from_the_snapshot(self):
+        from flask import g
+        g.pop('_login_user', None)
+        with self.client.session_transaction() as session:
+            session['_user_id'] = self.user.id
+            session['_fresh'] = True
+
+        response = self.client.get('/api/instances')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_json()["success"])
+
+class PasswordVerifierTestCase(unittest.TestCase):
+    """Login password checks on the process pool"""
+
+    def setUp(self):
+        self.app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        })
+        self.client = self.app.test_client()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        import services.password_verifier
+        services.password_verifier._password_verifier_instance = None
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_pool_checks_and_rehashes_to_configured_cost(self):
+        import bcrypt
+        from services.password_verifier import PasswordVerifier, hash_rounds
+        verifier = PasswordVerifier(max_workers=1, rounds=5)
+        password_hash = bcrypt.hashpw(b"secret-password", bcrypt.gensalt(rounds=4)).decode()
+
+        valid, new_hash = verifier.verify(password_hash, "secret-password")
+        self.assertTrue(valid)
+        self.assertEqual(hash_rounds(new_hash), 5)
+        self.assertEqual(verifier.verify(new_hash, "secret-password"), (True, None))
+        self.assertEqual(verifier.verify(password_hash, "wrong"), (False, None))
+
+        metrics = verifier.get_metrics()["worker"]
+        self.assertEqual((metrics["verified"], metrics["rejected"], metrics["rehashed"], metrics["pending"]), (2, 1, 1, 0))
+        verifier.executor.shutdown()
+
+    def test_full_queue_is_rejected(self):
+        from services.password_verifier import PasswordVerifier, PasswordVerifierBusy
+        verifier = PasswordVerifier(max_workers=1, queue_limit=0)
+        with self.assertRaises(PasswordVerifierBusy):
+            verifier.verify("$2b$04$invalid", "secret-password")
+        self.assertEqual(verifier.get_metrics()["worker"]["busy"], 1)
+
+    def test_broken_pool_is_replaced(self):
+        import bcrypt
+        import signal
+        from services.password_verifier import PasswordVerifier
+        verifier = PasswordVerifier(max_workers=1, rounds=4)
+        password_hash = bcrypt.hashpw(b"secret-password", bcrypt.gensalt(rounds=4)).decode()
+        self.assertEqual(verifier.verify(password_hash, "secret-password"), (True, None))
+
+        broken = verifier.executor
+        for process in list(broken._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+        self.assertEqual(verifier.verify(password_hash, "secret-password"), (True, None))
+        self.assertIsNot(verifier.executor, broken)
+        verifier.executor.shutdown()
+
+    def test_slot_of_a_killed_worker_is_reclaimed(self):
+        import bcrypt
+        import multiprocessing
+        import services.password_verifier as password_verifier
+        from services.password_verifier import PasswordVerifier
+
+        with patch.multiple(password_verifier, _shared_slots=None, _shared_capacity=0, _shared_queued=None, _shared_holders=None):
+            password_verifier.share_capacity(1)
+            # A worker killed mid-check never released its slot
+            worker = multiprocessing.get_context('fork').Process(target=lambda: None)
+            worker.start()
+            worker.join()
+            password_verifier._shared_slots.acquire()
+            password_verifier._shared_holders[0] = worker.pid
+
+            verifier = PasswordVerifier(max_workers=1, queue_timeout=0.1, rounds=4)
+            password_hash = bcrypt.hashpw(b"secret-password", bcrypt.gensalt(rounds=4)).decode()
+            self.assertEqual(verifier.verify(password_hash, "secret-password"), (True, None))
+            self.assertEqual(list(password_verifier._shared_holders), [0])
+            self.assertEqual(verifier.get_metrics()["host"]["running"], 0)
+            verifier.executor.shutdown()
+
+    def test_login_upgrades_stored_hash(self):
+        import bcrypt
+        import services.password_verifier
+        from services.password_verifier import PasswordVerifier, hash_rounds
+        from models.user import User
+        services.password_verifier._password_verifier_instance = PasswordVerifier(max_workers=0, rounds=5)
+        user = User(username="student", password=bcrypt.hashpw(b"secret-password", bcrypt.gensalt(rounds=4)).decode(),
+                    auth_token="t" * 80, groups="")
+        db.session.add(user)
+        db.session.commit()
+
+        response = self.client.post('/login', data={"username": "student", "password": "secret-password"})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/dashboard', response.headers['Location'])
+        self.assertEqual(hash_rounds(db.session.get(User, user.id).password), 5)
+
+class LogWriterTestCase(unittest.TestCase):
+    """Batched log writes outside of the request session"""
+
+    def setUp(self):
+        self.app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        })
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_log_leaves_session_untouched(self):
+        from models.user import User
+        from utils.logger import log
+        from utils.log_store import query_logs
+        db.session.add(User(username="pending", password="x", auth_token="t" * 80, groups=""))
+        log("INFO", "hello")
+        db.session.rollback()
+
+        self.assertEqual(User.query.filter_by(username="pending").count(), 0)
+        self.assertEqual([entry.message for entry in query_logs()], ["hello"])
+
+    def test_writer_batches_and_counts_drops(self):
+        from datetime import datetime
+        from utils.logger import LogWriter
+        from utils.log_store import get_log_engine, partition_name, count_logs
+        writer = LogWriter(limit=3, batch_size=10, interval=0.05)
+        now = datetime.utcnow()
+        # Queued before the thread runs, so the queue is full for the last two
+        with patch.object(writer, '_start'):
+            for i in range(5):
+                writer.enqueue(get_log_engine(), partition_name(now), {"level": "INFO", "message": f"message {i}", "created_at": now})
+        writer._start()
+        self.assertTrue(writer.flush())
+
+        metrics = writer.get_metrics()
+        self.assertEqual((metrics["written"], metrics["dropped"], metrics["queued"]), (3, 2, 0))
+        self.assertEqual(count_logs(), 3)
+
+class LogStoreTestCase(unittest.TestCase):
+    """Day and week partitions of the logs database"""
+
+    def setUp(self):
+        import tempfile
+        self.archive_dir = tempfile.mkdtemp()
+        self.app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False,
+            'LOG_ARCHIVE_DIR': self.archive_dir
+        })
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.archive_dir)
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def write(self, days_ago, message, level="INFO", interval='day', **fields):
+        from datetime import datetime, timedelta
+        from utils.log_store import get_log_engine, insert_logs, partition_name
+        created_at = datetime.utcnow() - timedelta(days=days_ago)
+        row = {"created_at": created_at, "level": level, "message": message, "category": None, "instance_id": None, "droplet_id": None, "user_id": None}
+        insert_logs(get_log_engine(), {partition_name(created_at, interval): [{**row, **fields}]})
+
+    def test_partition_names(self):
+        from datetime import datetime
+        from utils.log_store import partition_name
+        self.assertEqual(partition_name(datetime(2026, 10, 18, 12)), "log_20261018")
+        self.assertEqual(partition_name(datetime(2026, 10, 18, 12), 'week'), "log_20261012")
+
+    def test_pages_span_partitions(self):
+        from utils.log_store import count_logs, query_logs, get_partitions
+        for days_ago, message in [(0, "today"), (1, "yesterday"), (2, "two days ago"), (2, "Docker image pulled")]:
+            self.write(days_ago, message, level="ERROR" if days_ago == 1 else "INFO")
+
+        self.assertEqual(len(get_partitions()), 3)
+        self.assertEqual(count_logs(), 4)
+        self.assertEqual(count_logs(level="ERROR"), 1)
+        self.assertEqual([row.message for row in query_logs(offset=1, limit=2)], ["yesterday", "Docker image pulled"])
+
+    def test_structured_fields_and_full_text_search(self):
+        from utils.log_store import count_logs, query_logs
+        self.write(0, "Successfully pulled Docker image ubuntu:22.04", category="image")
+        self.write(0, "Creating new instance for user alice", category="instance", instance_id="i-1", user_id="u-1")
+        self.write(1, "Creating new instance for user bob", category="instance", instance_id="i-2", user_id="u-2")
+
+        self.assertEqual([row.message for row in query_logs(category="image")], ["Successfully pulled Docker image ubuntu:22.04"])
+        self.assertEqual([row.instance_id for row in query_logs(category="instance")], ["i-1", "i-2"])
+        self.assertEqual(count_logs(user_id="u-2"), 1)
+        self.assertEqual([row.user_id for row in query_logs("new instance")], ["u-1", "u-2"])
+        self.assertEqual([row.user_id for row in query_logs("bob", category="instance")], ["u-2"])
+        self.assertEqual(count_logs('"ubuntu:22.04'), 1)  # Quotes and colons are taken literally
+        with self.assertRaises(ValueError):
+            query_logs(message="alice")
+
+    def test_keyset_pages_span_partitions(self):
+        from utils.log_store import query_logs_page
+        for days_ago, message in [(0, "a"), (0, "b"), (1, "c"), (3, "d"), (3, "e")]:
+            self.write(days_ago, message)
+
+        messages = []
+        cursor = None
+        while True:
+            rows, cursor = query_logs_page(cursor=cursor, limit=2)
+            messages.append([row.message for row in rows])
+            if cursor is None:
+                break
+        self.assertEqual(messages, [["b", "a"], ["c", "e"], ["d"]])
+        with self.assertRaises(ValueError):
+            query_logs_page(cursor="not-a-cursor")
+
+    def test_export_streams_ndjson(self):
+        import json
+        from datetime import datetime, timedelta
+        from models.user import User, Group
+        from utils.permissions import Permissions
+        Permissions._version = None
+        group = Group(display_name="Admins", protected=False, perm_admin_panel=True, perm_view_instances=True,
+                      perm_edit_instances=True, perm_view_users=True, perm_edit_users=True,
+                      perm_view_droplets=True, perm_edit_droplets=True, perm_view_registry=True,
+                      perm_edit_registry=True, perm_view_groups=True, perm_edit_groups=True)
+        db.session.add(group)
+        db.session.flush()
+        admin = User(username="admin", password="x", auth_token="t" * 80, groups=group.id)
+        db.session.add(admin)
+        db.session.commit()
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = admin.id
+            session['_fresh'] = True
+
+        self.write(2, "old", category="image")
+        self.write(1, "middle", category="instance")
+        self.write(0, "new", category="image")
+
+        since = (datetime.utcnow() - timedelta(days=1, hours=1)).isoformat() + "Z"
+        response = client.get('/api/admin/logs/export', query_string={"since": since})
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([line["message"] for line in lines], ["middle", "new"])
+
+        response = client.get('/api/admin/logs/export', query_string={"category": "image"})
+        self.assertEqual([json.loads(line)["message"] for line in response.get_data(as_text=True).splitlines()], ["old", "new"])
+
+        page = client.get('/api/admin/logs', query_string={"per_page": 2, "include_total": "true"}).get_json()
+        self.assertEqual((page["pagination"]["total"], page["pagination"]["pages"]), (3, 2))
+        page = client.get('/api/admin/logs', query_string={"per_page": 2, "cursor": page["pagination"]["next_cursor"]}).get_json()
+        self.assertEqual([entry["message"] for entry in page["logs"]], ["old"])
+        self.assertIsNone(page["pagination"]["next_cursor"])
+
+    def test_older_partitions_are_upgraded(self):
+        from datetime import datetime
+        from sqlalchemy import text
+        from utils.log_store import get_log_engine, upgrade_partitions, query_logs
+        with get_log_engine().begin() as connection:
+            connection.execute(text("CREATE TABLE log_20261001 (id INTEGER PRIMARY KEY, created_at DATETIME NOT NULL, level VARCHAR(8) NOT NULL, message VARCHAR(1024) NOT NULL)"))
+            connection.execute(text("INSERT INTO log_20261001 (created_at, level, message) VALUES (:at, 'INFO', 'Pulling required Docker image ubuntu')"), {"at": datetime(2026, 10, 1, 9)})
+
+        self.assertEqual(upgrade_partitions(), 1)
+        self.assertEqual(upgrade_partitions(), 0)
+        self.assertEqual([row.message for row in query_logs(category="image")], ["Pulling required Docker image ubuntu"])
+        self.assertEqual(len(query_logs("pulling ubuntu")), 1)
+
+    def test_prune_archives_and_drops_whole_partitions(self):
+        import gzip
+        import json
+        import os
+        from utils.logger import prune_logs
+        from utils.log_store import get_partitions, query_logs
+        self.write(100, "old")
+        self.write(100, "old too")
+        self.write(1, "recent")
+
+        self.assertEqual(prune_logs(90), 2)
+        self.assertEqual(len(get_partitions()), 2)  # Recent one and the prune message
+        self.assertEqual([row.message for row in query_logs()][-1], "recent")
+
+        archives = os.listdir(self.archive_dir)
+        self.assertEqual(len(archives), 1)
+        with gzip.open(os.path.join(self.archive_dir, archives[0]), 'rt') as archive:
+            self.assertEqual([json.loads(line)["message"] for line in archive], ["old", "old too"])
+
+    def test_legacy_log_table_is_moved(self):
+        from sqlalchemy import text, inspect
+        from utils.log_store import migrate_legacy_logs, query_logs
+        db.session.execute(text("CREATE TABLE log (id INTEGER PRIMARY KEY, created_at DATETIME, level VARCHAR(8), message VARCHAR(1024))"))
+        db.session.execute(text("INSERT INTO log (created_at, level, message) VALUES ('2026-10-01 10:00:00', 'INFO', 'before the move')"))
+        db.session.commit()
+
+        self.assertEqual(migrate_legacy_logs(), 1)
+        self.assertNotIn('log', inspect(db.engine).get_table_names())
+        self.assertEqual([row.message for row in query_logs()], ["before the move"])
+
+    def test_interrupted_legacy_move_is_resumed_without_duplicates(self):
+        from datetime import datetime
+        from sqlalchemy import text
+        from utils.log_store import migrate_legacy_logs, query_logs, insert_logs, get_log_engine
+        db.session.execute(text("CREATE TABLE log (id INTEGER PRIMARY KEY, created_at DATETIME, level VARCHAR(8), message VARCHAR(1024))"))
+        db.session.execute(text("INSERT INTO log (created_at, level, message) VALUES ('2026-10-01 10:00:00', 'INFO', 'copied'), "
+                                "('2026-10-01 10:00:00', 'INFO', 'copied'), ('2026-10-01 11:00:00', 'INFO', 'not copied')"))
+        db.session.commit()
+        # A run stopped after copying one of the two identical entries, before deleting the batch
+        insert_logs(get_log_engine(), {"log_20261001": [{"created_at": datetime(2026, 10, 1, 10), "level": "INFO", "message": "copied", "category": None}]})
+
+        self.assertEqual(migrate_legacy_logs(), 3)
+        self.assertEqual(sorted(row.message for row in query_logs()), ["copied", "copied", "not copied"])
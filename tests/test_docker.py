@@ -0,0 +1,218 @@
+"""
+Tests for the Docker helpers
+"""
+
+import unittest
+from unittest import mock
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import utils.docker
+from utils.docker_events import event_watcher
+
+class ImageIndexTestCase(unittest.TestCase):
+    """Local image lookups go through the cached image index"""
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.api.images.return_value = [
+            {"RepoTags": ["flowcaseweb/flowcase-guac:1.0", "ubuntu:latest"], "RepoDigests": ["ubuntu@sha256:abc"]},
+            {"RepoTags": None, "RepoDigests": ["<none>@<none>"]}
+        ]
+        self.patches = [
+            mock.patch.object(utils.docker, 'docker_client', self.client),
+            mock.patch.object(event_watcher, 'start'),
+            mock.patch.object(event_watcher, 'is_connected', return_value=True)
+        ]
+        for patch in self.patches:
+            patch.start()
+        utils.docker.invalidate_image_index()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        utils.docker.invalidate_image_index()
+
+    def test_lookups_share_one_images_call(self):
+        self.assertTrue(utils.docker.image_exists_locally("flowcaseweb/flowcase-guac:1.0"))
+        self.assertTrue(utils.docker.image_exists_locally("ubuntu"))
+        self.assertTrue(utils.docker.image_exists_locally("ubuntu@sha256:abc"))
+        self.assertTrue(utils.docker.check_image_exists("docker.io", "ubuntu:latest"))
+        self.assertEqual(self.client.api.images.call_count, 1)
+
+    def test_image_event_invalidates_index(self):
+        self.assertFalse(utils.docker.image_exists_locally("debian:12"))
+
+        self.client.api.images.return_value = [{"RepoTags": ["debian:12"], "RepoDigests": []}]
+        event_watcher._dispatch({"Type": "image", "Action": "pull", "Actor": {"Attributes": {"name": "debian:12"}}})
+        self.assertTrue(utils.docker.image_exists_locally("debian:12"))
+
+class ClientPoolTestCase(unittest.TestCase):
+    """Docker clients are shared within a process and never across a fork"""
+
+    def setUp(self):
+        # A known API version means creating a client makes no call to the daemon
+        self.patches = [
+            mock.patch.object(utils.docker, '_api_version', '1.41'),
+            mock.patch.object(utils.docker, '_clients', {})
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def test_clients_are_shared_per_timeout(self):
+        client = utils.docker.get_client()
+        self.assertIs(utils.docker.get_client(), client)
+        self.assertIsNot(utils.docker.get_client(timeout=utils.docker.DOCKER_PULL_TIMEOUT), client)
+        self.assertEqual(client.api.adapters['http+docker://'].max_pool_size, utils.docker.DOCKER_POOL_SIZE)
+
+        metrics = utils.docker.get_client_metrics()
+        self.assertEqual(len(metrics), 2)
+        self.assertEqual(metrics[0]["requests"], 0)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "needs fork")
+    def test_forked_process_gets_its_own_client(self):
+        parent = utils.docker.get_client()
+        with mock.patch.object(utils.docker, 'docker_client', parent):
+            read_end, write_end = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                fresh = utils.docker.docker_client is not parent and utils.docker.get_client() is utils.docker.docker_client
+                os.write(write_end, b"1" if fresh else b"0")
+                os._exit(0)
+            os.waitpid(pid, 0)
+            self.assertEqual(os.read(read_end, 1), b"1")
+            os.close(read_end)
+            os.close(write_end)
+            self.assertIs(utils.docker.docker_client, parent)
+
+class ReloadCoalescerTestCase(unittest.TestCase):
+    """Concurrent nginx reload requests share one reload"""
+
+    def test_burst_is_coalesced(self):
+        import threading
+        from utils.nginx import ReloadCoalescer, NginxReloadError
+
+        reloads = []
+        coalescer = ReloadCoalescer(lambda: reloads.append(1), 0.1)
+        errors = []
+
+        def launch():
+            try:
+                coalescer.request()
+            except NginxReloadError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=launch) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(errors, [])
+        self.assertLess(len(reloads), 20)
+        self.assertEqual(coalescer.metrics()["requests"], 20)
+        self.assertEqual(coalescer.metrics()["pending"], 0)
+
+    def test_failed_reload_reaches_waiters(self):
+        from utils.nginx import ReloadCoalescer, NginxReloadError
+
+        def fail():
+            raise RuntimeError("nginx container not found")
+
+        coalescer = ReloadCoalescer(fail, 0.01)
+        with self.assertRaises(NginxReloadError):
+            coalescer.request()
+        self.assertEqual(coalescer.metrics()["failures"], 1)
+
+    def test_rejected_config_fails_the_reload(self):
+        from unittest import mock
+        from utils.nginx import ReloadCoalescer, NginxReloadError, _exec_nginx_reload
+
+        nginx = mock.Mock()
+        nginx.exec_run.return_value = mock.Mock(exit_code=1, output=b"nginx: [emerg] unknown directive")
+        coalescer = ReloadCoalescer(_exec_nginx_reload, 0.01)
+        with mock.patch.object(utils.docker, 'docker_client', mock.Mock(**{'containers.get.return_value': nginx})):
+            with self.assertRaisesRegex(NginxReloadError, "unknown directive"):
+                coalescer.request()
+
+class ProfileSkeletonTestCase(unittest.TestCase):
+    """Persistent profiles are seeded from a per-image copy of the home directory"""
+
+    def setUp(self):
+        import io
+        import tarfile
+        import tempfile
+        import utils.profiles
+        from __init__ import create_app, db
+
+        self.app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:'})
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.tmp = tempfile.TemporaryDirectory()
+        skeleton_dir = os.path.join(self.tmp.name, 'skeletons')
+
+        # Archive as returned by get_archive('/home/flowcase-user')
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w') as tar:
+            for name, content in [('flowcase-user/.bashrc', b'export PS1=x'), ('flowcase-user/Desktop/readme.txt', b'hi')]:
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+
+        self.client = mock.Mock()
+        self.client.images.get.return_value = mock.Mock(id='sha256:abc123')
+        self.client.containers.create.return_value.get_archive.side_effect = lambda path: (iter([archive.getvalue()]), {})
+
+        self.patches = [
+            mock.patch.object(utils.docker, 'docker_client', self.client),
+            mock.patch.object(utils.profiles, 'PROFILE_SKELETON_DIR', skeleton_dir),
+            mock.patch.object(utils.profiles, 'PROFILE_SKELETON_MANIFEST', os.path.join(skeleton_dir, 'manifest.json'))
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        from __init__ import db
+        for patch in self.patches:
+            patch.stop()
+        self.tmp.cleanup()
+        db.session.remove()
+        self.ctx.pop()
+
+    def test_skeleton_is_extracted_once_and_seeded(self):
+        from utils.profiles import get_profile_skeleton, seed_profile
+
+        skeleton = get_profile_skeleton('droplet:latest')
+        self.assertEqual(get_profile_skeleton('droplet:latest'), skeleton)
+        self.assertEqual(self.client.containers.create.call_count, 1)
+        self.client.containers.create.return_value.start.assert_not_called()
+
+        profile = os.path.join(self.tmp.name, 'profile') + '/'
+        os.makedirs(profile)
+        with open(profile + 'notes.txt', 'w') as f:
+            f.write('mine')
+        seed_profile(skeleton, profile)
+
+        self.assertTrue(os.path.exists(profile + '.bashrc'))
+        self.assertTrue(os.path.exists(profile + 'Desktop/readme.txt'))
+        self.assertEqual(open(profile + 'notes.txt').read(), 'mine')
+
+    def test_new_image_id_replaces_skeleton(self):
+        from utils.profiles import get_profile_skeleton
+
+        old = get_profile_skeleton('droplet:latest')
+        self.client.images.get.return_value = mock.Mock(id='sha256:def456')
+        new = get_profile_skeleton('droplet:latest')
+
+        self.assertNotEqual(old, new)
+        self.assertFalse(os.path.exists(old))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,703 @@
+"""
+Tests for the instance provisioning jobs
+"""
+
+import unittest
+import threading
+from unittest.mock import patch as mock_patch
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import g
+from __init__ import create_app, db
+from models.droplet import Droplet, ProvisioningJob
+from models.user import User
+from services.provisioning import ProvisioningService
+
+class ProvisioningTestCase(unittest.TestCase):
+    """Provisioning service and job status API"""
+
+    def setUp(self):
+        """Set up test client"""
+        self.app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        })
+        self.client = self.app.test_client()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.user = User(username="student", password="x", auth_token="t" * 80, groups="")
+        self.droplet = Droplet(display_name="Desktop", droplet_type="container", container_docker_image="flowcase/desktop:latest")
+        db.session.add_all([self.user, self.droplet])
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up after tests"""
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def login(self, user):
+        # The app context is shared with requests, drop the user cached by Flask-Login
+        g.pop('_login_user', None)
+        with self.client.session_transaction() as session:
+            session['_user_id'] = user.id
+            session['_fresh'] = True
+
+    def test_submit_rejects_when_queue_full(self):
+        """Jobs beyond the queue limit are refused instead of queued"""
+        service = ProvisioningService(max_workers=1, queue_limit=1)
+        release = threading.Event()
+        service.run_job = lambda job_id: release.wait(5)
+
+        self.assertTrue(service.submit(self.app, "job-1"))
+        self.assertFalse(service.submit(self.app, "job-2"))
+
+        release.set()
+        service.executor.shutdown(wait=True)
+        self.assertEqual(service.pending, 0)
+
+    def test_job_fails_when_instance_is_gone(self):
+        """A job whose instance was destroyed before it ran is marked failed"""
+        job = ProvisioningJob(instance_id="missing", droplet_id=self.droplet.id, user_id=self.user.id)
+        db.session.add(job)
+        db.session.commit()
+
+        ProvisioningService(max_workers=1).run_job(job.id)
+
+        job = ProvisioningJob.query.get(job.id)
+        self.assertEqual(job.status, 'failed')
+        self.assertIsNotNone(job.finished_at)
+
+    def test_job_status_is_private(self):
+        """Users can only poll their own jobs"""
+        other = User(username="other", password="x", auth_token="o" * 80, groups="")
+        db.session.add(other)
+        job = ProvisioningJob(instance_id="i", droplet_id=self.droplet.id, user_id=self.user.id)
+        db.session.add(job)
+        db.session.commit()
+
+        self.login(self.user)
+        response = self.client.get(f'/api/instance/job/{job.id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['job']['status'], 'queued')
+
+        self.login(other)
+        response = self.client.get(f'/api/instance/job/{job.id}')
+        self.assertEqual(response.status_code, 404)
+
+    def test_finished_jobs_are_pruned_and_deleted_with_their_user(self):
+        """Finished jobs past the retention go, deleting a user's jobs leaves the others"""
+        from datetime import datetime, timedelta
+        from services.provisioning import prune_jobs, delete_jobs
+        other = User(username="other", password="x", auth_token="o" * 80, groups="")
+        db.session.add(other)
+        db.session.flush()
+        old = datetime.utcnow() - timedelta(days=10)
+        db.session.add_all([
+            ProvisioningJob(instance_id="old", droplet_id=self.droplet.id, user_id=self.user.id, status='ready', finished_at=old),
+            ProvisioningJob(instance_id="stuck", droplet_id=self.droplet.id, user_id=self.user.id, status='running'),
+            ProvisioningJob(instance_id="recent", droplet_id=self.droplet.id, user_id=other.id, status='failed', finished_at=datetime.utcnow())
+        ])
+        db.session.commit()
+
+        self.assertEqual(prune_jobs(7), 1)
+        self.assertEqual(delete_jobs(user_id=self.user.id), 1)
+        db.session.commit()
+        self.assertEqual([job.instance_id for job in ProvisioningJob.query.all()], ["recent"])
+
+    def test_admin_deletes_respect_foreign_keys(self):
+        """Deleting a user or a droplet goes through on a database enforcing foreign keys, as PostgreSQL does"""
+        from sqlalchemy import text
+        from models.droplet import DropletInstance, WarmContainer
+        from models.user import Group
+        from models.workshop import Workshop
+        from utils.permissions import Permissions
+
+        db.session.execute(text("PRAGMA foreign_keys=ON"))
+        Permissions._version = None
+        group = Group(display_name="Admins", protected=False, perm_admin_panel=True, perm_view_instances=True,
+                      perm_edit_instances=True, perm_view_users=True, perm_edit_users=True,
+                      perm_view_droplets=True, perm_edit_droplets=True, perm_view_registry=True,
+                      perm_edit_registry=True, perm_view_groups=True, perm_edit_groups=True)
+        db.session.add(group)
+        db.session.flush()
+        admin = User(username="admin", password="x", auth_token="a" * 80, groups=group.id)
+        db.session.add(admin)
+        db.session.flush()
+        instance = DropletInstance(droplet_id=self.droplet.id, user_id=self.user.id, container_status='running')
+        db.session.add(instance)
+        db.session.flush()
+        db.session.add_all([
+            ProvisioningJob(instance_id=instance.id, droplet_id=self.droplet.id, user_id=self.user.id, status='ready'),
+            ProvisioningJob(instance_id="other", droplet_id=self.droplet.id, user_id=admin.id, status='failed'),
+            WarmContainer(droplet_id=self.droplet.id, vnc_password="x", status='ready'),
+            Workshop(name="Course", created_by=admin.id)
+        ])
+        db.session.commit()
+        self.login(admin)
+
+        # Workshops are kept, their author cannot go before them
+        self.assertEqual(self.client.delete('/api/admin/user', json={"id": admin.id}).status_code, 400)
+        with mock_patch('services.provisioning.ProvisioningService.destroy_instances',
+                        side_effect=lambda ids: DropletInstance.query.filter(DropletInstance.id.in_(ids)).delete(synchronize_session=False)):
+            response = self.client.delete('/api/admin/user', json={"id": self.user.id})
+            self.assertEqual(response.get_json(), {"success": True})
+            response = self.client.delete('/api/admin/droplet', json={"id": self.droplet.id})
+            self.assertEqual(response.get_json(), {"success": True})
+        self.assertEqual(ProvisioningJob.query.count(), 0)
+        self.assertEqual(WarmContainer.query.count(), 0)
+
+    def test_batch_reloads_nginx_once_and_reports_failures(self):
+        """A bulk launch routes every launched instance with one reload, failed launches are kept apart"""
+        from unittest import mock
+        from models.droplet import DropletInstance
+        from services.provisioning import ProvisioningError
+        import services.provisioning
+
+        job_ids = []
+        for i in range(4):
+            user = User(username=f"student{i}", password="x", auth_token=str(i) * 80, groups="")
+            db.session.add(user)
+            db.session.flush()
+            instance = DropletInstance(droplet_id=self.droplet.id, user_id=user.id, container_status='creating')
+            db.session.add(instance)
+            db.session.flush()
+            job = ProvisioningJob(instance_id=instance.id, droplet_id=self.droplet.id, user_id=user.id, batch_id="batch")
+            db.session.add(job)
+            db.session.flush()
+            job_ids.append(job.id)
+        db.session.commit()
+
+        def launch(instance, droplet, user, resolution, job=None, reload=True, timer=None):
+            self.assertFalse(reload)
+            if user.username == "student3":
+                raise ProvisioningError("Droplet did not become ready in time")
+
+        service = ProvisioningService(max_workers=1)
+        with mock.patch.object(service, 'launch_instance', side_effect=launch), \
+                mock.patch.object(services.provisioning, 'reload_nginx') as reload_nginx:
+            service.run_batch(job_ids, parallelism=1)
+
+        reload_nginx.assert_called_once_with()
+        statuses = sorted(job.status for job in ProvisioningJob.query.filter_by(batch_id="batch").all())
+        self.assertEqual(statuses, ['failed', 'ready', 'ready', 'ready'])
+
+        # The shared reload counts for each launched instance
+        from models.droplet import LaunchPhase
+        self.assertEqual(LaunchPhase.query.filter_by(phase='reload').count(), 3)
+
+    def test_launch_phase_percentiles(self):
+        """Phases are summarized overall, per droplet and per node, failed launches are left out"""
+        from datetime import datetime, timedelta
+        from utils.timing import PhaseTimer, get_phase_percentiles
+
+        for i in range(1, 101):
+            timer = PhaseTimer()
+            timer.record('container', i / 1000)
+            timer.save(f"i{i}", self.droplet.id, "node-a" if i % 2 else None, total=False)
+        failed = PhaseTimer()
+        failed.record('container', 60)
+        failed.save("failed", self.droplet.id, success=False, total=False)
+
+        timings = get_phase_percentiles(datetime.utcnow() - timedelta(hours=1))
+        self.assertEqual(timings["phases"]["container"], {"count": 100, "p50": 50, "p95": 95, "p99": 99})
+        self.assertEqual(timings["droplets"][self.droplet.id]["container"]["count"], 100)
+        self.assertEqual(timings["nodes"]["local"]["container"]["p99"], 100)
+        self.assertEqual(timings["nodes"]["node-a"]["container"]["p50"], 49)
+
+    def test_workshop_starts_every_template_droplet(self):
+        """A user workshop launches all template droplets and tracks them until stopped"""
+        from unittest import mock
+        from models.workshop import WorkshopTemplate, Workshop, UserWorkshop
+        from models.droplet import DropletInstance
+        from services.workshop_provisioning import WorkshopProvisioner
+        from services.scheduler import Scheduler
+        import services.provisioning
+
+        victim = Droplet(display_name="Victim", droplet_type="container", container_docker_image="flowcase/victim:latest")
+        db.session.add(victim)
+        db.session.flush()
+        template = WorkshopTemplate(name="Lab", category="Security", created_by=self.user.id)
+        template.set_template_droplets([self.droplet.id, {"droplet_id": victim.id, "count": 2}])
+        db.session.add(template)
+        db.session.flush()
+        workshop = Workshop(name="Lab", template_id=template.id, created_by=self.user.id)
+        db.session.add(workshop)
+        db.session.flush()
+        user_workshop = UserWorkshop(user_id=self.user.id, workshop_id=workshop.id, template_id=template.id)
+        db.session.add(user_workshop)
+        db.session.commit()
+
+        service = ProvisioningService(max_workers=1)
+        provisioner = WorkshopProvisioner(service, Scheduler("binpack"))
+        droplets, error = provisioner.resolve_droplets(template.id)
+        self.assertEqual(error, "")
+        self.assertEqual(len(droplets), 3)
+
+        with mock.patch.object(service, 'launch_instance'), \
+                mock.patch.object(services.provisioning, 'reload_nginx'), \
+                mock.patch('utils.resources.get_resource_limits', return_value=(64, 65536)), \
+                mock.patch('services.scheduler.get_client', return_value=mock.Mock()), \
+                mock.patch('services.scheduler.node_has_image', return_value=True):
+            self.assertEqual(provisioner.start(self.app, user_workshop, droplets, 1, "test"), (True, ""))
+            service.executor.shutdown(wait=True)
+
+        db.session.expire_all()
+        user_workshop = UserWorkshop.query.get(user_workshop.id)
+        self.assertEqual(user_workshop.status, 'ready')
+        self.assertEqual(user_workshop.progress, 100)
+        self.assertEqual(len(user_workshop.get_instance_ids()), 3)
+
+        with mock.patch.object(services.provisioning, 'reload_nginx'):
+            provisioner.stop(user_workshop)
+        self.assertEqual(user_workshop.status, 'stopped')
+        self.assertEqual(DropletInstance.query.count(), 0)
+
+class ResourceLedgerTestCase(unittest.TestCase):
+    """Reservations are admitted atomically against the host and tenant limits"""
+
+    def setUp(self):
+        from unittest import mock
+        import utils.resources
+
+        self.app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False,
+            'TENANT_MAX_CORES': 2
+        })
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.patch = mock.patch.object(utils.resources, 'get_resource_limits', return_value=(4, 4096))
+        self.patch.start()
+        self.droplet = Droplet(display_name="Desktop", droplet_type="container", container_docker_image="img",
+                               container_cores=1, container_memory=1024)
+        db.session.add(self.droplet)
+        db.session.commit()
+
+    def tearDown(self):
+        self.patch.stop()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_reserve_is_all_or_nothing(self):
+        from utils.resources import reserve_resources, get_allocated_resources, HOST_SCOPE
+
+        success, _ = reserve_resources(self.droplet, ["a", "b", "c"], None, "test")
+        self.assertTrue(success)
+        success, error = reserve_resources(self.droplet, ["d", "e"], None, "test")
+        self.assertFalse(success)
+        self.assertIn("memory", error)
+        self.assertEqual(get_allocated_resources(HOST_SCOPE), (3, 3072))
+
+    def test_tenant_limit(self):
+        from utils.resources import reserve_resources, get_allocated_resources, tenant_scope
+
+        self.assertTrue(reserve_resources(self.droplet, ["a", "b"], "t1", "test")[0])
+        self.assertFalse(reserve_resources(self.droplet, ["c"], "t1", "test")[0])
+        self.assertTrue(reserve_resources(self.droplet, ["c"], "t2", "test")[0])
+        self.assertEqual(get_allocated_resources(tenant_scope("t1")), (2, 2048))
+
+    def test_warm_reservation_assigned_within_tenant_limit(self):
+        from utils.resources import reserve_resources, assign_resources_tenant, get_allocated_resources, tenant_scope
+
+        self.assertTrue(reserve_resources(self.droplet, ["a"], "t1", "test")[0])
+        self.assertTrue(reserve_resources(self.droplet, ["warm1", "warm2"], None, "warm pool")[0])
+
+        self.assertTrue(assign_resources_tenant(self.droplet, "warm1", "t1", "test")[0])
+        success, error = assign_resources_tenant(self.droplet, "warm2", "t1", "test")
+        self.assertFalse(success)
+        self.assertIn("CPU", error)
+        self.assertEqual(get_allocated_resources(tenant_scope("t1")), (2, 2048))
+
+    def test_release_is_idempotent_and_reconcile_frees_orphans(self):
+        from models.droplet import DropletInstance
+        from utils.resources import reserve_resources, release_resources, reconcile_resources, get_allocated_resources
+
+        db.session.add(DropletInstance(id="a", droplet_id=self.droplet.id, user_id="u"))
+        self.assertTrue(reserve_resources(self.droplet, ["a", "b", "c"], None, "test")[0])
+
+        self.assertEqual(release_resources(["c"]), 1)
+        self.assertEqual(release_resources(["c"]), 0)
+        self.assertEqual(get_allocated_resources(), (2, 2048))
+
+        # "b" has no instance or warm container anymore
+        self.assertEqual(reconcile_resources(rebuild=True), (1, 0))
+        self.assertEqual(get_allocated_resources(), (1, 1024))
+
+class FakeDockerClient:
+    """Stand-in for a Docker daemon: records the containers it runs and serves a fixed image list"""
+
+    def __init__(self, images=()):
+        from unittest import mock
+        self.containers = mock.Mock()
+        self.api = mock.Mock()
+        self.api.images.return_value = [{"RepoTags": list(images)}]
+
+    def ping(self):
+        return True
+
+    def info(self):
+        return {"NCPU": 4, "MemTotal": 8 * 1024 * 1024 * 1024}
+
+    def close(self):
+        pass
+
+class SchedulerTestCase(unittest.TestCase):
+    """Placement of containers on several Docker nodes"""
+
+    def setUp(self):
+        from unittest import mock
+        from models.node import DockerNode
+        import utils.nodes
+
+        self.app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False
+        })
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.daemons = {
+            "tcp://a:2375": FakeDockerClient(),
+            "tcp://b:2375": FakeDockerClient(images=["flowcase/desktop:latest"])
+        }
+        self.patches = [
+            mock.patch.object(utils.nodes, 'connect', side_effect=lambda base_url: self.daemons[base_url]),
+            mock.patch('utils.docker.docker_client', FakeDockerClient()),
+            mock.patch('utils.docker.image_exists_locally', return_value=False),
+            mock.patch('utils.resources.get_resource_limits', return_value=(4, 4096))
+        ]
+        for patch in self.patches:
+            patch.start()
+        utils.nodes._clients.clear()
+        utils.nodes._node_images.clear()
+        utils.nodes._unreachable.clear()
+
+        self.droplet = Droplet(display_name="Desktop", droplet_type="container", container_docker_image="flowcase/desktop:latest",
+                               container_cores=1, container_memory=1024)
+        self.node_a = DockerNode(name="a", base_url="tcp://a:2375", max_cores=8, max_memory=8192)
+        self.node_b = DockerNode(name="b", base_url="tcp://b:2375", max_cores=8, max_memory=8192)
+        db.session.add_all([self.droplet, self.node_a, self.node_b])
+        db.session.commit()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def place(self, scheduler, count):
+        from models.droplet import DropletInstance
+
+        placed = []
+        for _ in range(count):
+            instance = DropletInstance(droplet_id=self.droplet.id, user_id="u")
+            db.session.add(instance)
+            db.session.flush()
+            success, error = scheduler.place(self.droplet, [instance], None, "test")
+            self.assertTrue(success, error)
+            placed.append(instance.node_id)
+        return placed
+
+    def drain_local(self):
+        from utils.nodes import ensure_local_node, get_node
+
+        ensure_local_node()
+        get_node(None).status = 'draining'
+        db.session.commit()
+
+    def test_binpack_fills_a_node_before_the_next(self):
+        from services.scheduler import Scheduler
+
+        # The local node (4 cores) is the most loaded relative to its size, the image is only on b
+        placed = self.place(Scheduler("binpack"), 6)
+        self.assertEqual(placed[:4], [self.node_b.id] * 4)
+        self.assertEqual(set(placed), {self.node_b.id})
+
+    def test_spread_balances_and_skips_drained_nodes(self):
+        from services.scheduler import Scheduler
+
+        self.drain_local()
+        with mock_patch('services.scheduler.node_has_image', return_value=False):
+            placed = self.place(Scheduler("spread"), 4)
+        self.assertEqual(placed.count(self.node_a.id), 2)
+        self.assertEqual(placed.count(self.node_b.id), 2)
+
+    def test_full_nodes_are_refused(self):
+        from models.droplet import DropletInstance
+        from services.scheduler import Scheduler
+
+        self.drain_local()
+        self.place(Scheduler("binpack"), 16)
+        instance = DropletInstance(droplet_id=self.droplet.id, user_id="u")
+        db.session.add(instance)
+        db.session.flush()
+        success, error = Scheduler("binpack").place(self.droplet, [instance], None, "test")
+        self.assertFalse(success)
+        self.assertIn("Insufficient", error)
+        self.assertEqual(DropletInstance.query.count(), 16)
+
+    def test_batch_spans_nodes_and_is_all_or_nothing(self):
+        from models.droplet import DropletInstance
+        from services.scheduler import Scheduler
+        from utils.resources import get_allocated_resources, node_scope
+
+        self.drain_local()
+        instances = [DropletInstance(droplet_id=self.droplet.id, user_id="u") for _ in range(12)]
+        db.session.add_all(instances)
+        db.session.flush()
+        self.assertEqual(Scheduler("binpack").place_batch(self.droplet, instances, [None] * 12, "test"), (True, ""))
+        self.assertEqual(sorted(instance.node_id for instance in instances).count(self.node_b.id), 8)
+
+        # 4 cores are left on a, a batch of 5 is refused whole
+        instances = [DropletInstance(droplet_id=self.droplet.id, user_id="u") for _ in range(5)]
+        db.session.add_all(instances)
+        db.session.flush()
+        success, error = Scheduler("binpack").place_batch(self.droplet, instances, [None] * 5, "test")
+        self.assertFalse(success)
+        self.assertIn("Insufficient", error)
+        self.assertEqual(DropletInstance.query.count(), 12)
+        self.assertEqual(get_allocated_resources(node_scope(self.node_a.id)), (4, 4096))
+
+    def test_launches_only_go_to_nodes_with_the_image(self):
+        from models.droplet import DropletInstance
+        from services.scheduler import Scheduler
+
+        scheduler = Scheduler("spread")
+        self.assertTrue(scheduler.has_image(self.droplet))
+        for _ in range(3):
+            instance = DropletInstance(droplet_id=self.droplet.id, user_id="u")
+            db.session.add(instance)
+            db.session.flush()
+            self.assertEqual(scheduler.place(self.droplet, [instance], None, "test", require_image=True), (True, ""))
+            self.assertEqual(instance.node_id, self.node_b.id)
+
+        self.daemons["tcp://b:2375"].api.images.return_value = []
+        import utils.nodes
+        utils.nodes._node_images.clear()
+        self.assertFalse(scheduler.has_image(self.droplet))
+
+    def test_unreachable_node_is_retried_after_a_backoff(self):
+        from unittest import mock
+        import utils.nodes
+        from utils.nodes import get_client, forget_client
+
+        with mock.patch.object(utils.nodes, 'connect', side_effect=ConnectionError("timed out")) as connect:
+            self.assertIsNone(get_client(self.node_a.id))
+            self.assertIsNone(get_client(self.node_a.id))
+            self.assertEqual(connect.call_count, 1)
+
+            with mock.patch.object(utils.nodes.time, 'monotonic', return_value=utils.nodes._unreachable[self.node_a.id][0] + 1):
+                self.assertIsNone(get_client(self.node_a.id))
+            self.assertEqual(connect.call_count, 2)
+            self.assertEqual(utils.nodes._unreachable[self.node_a.id][1], 2 * utils.nodes.NODE_RETRY_MIN)
+
+        # Reconnecting a node from the admin panel does not wait for the backoff
+        forget_client(self.node_a.id)
+        self.assertIsNotNone(get_client(self.node_a.id))
+
+    def test_container_runs_on_the_chosen_node(self):
+        service = ProvisioningService(max_workers=1)
+        service.run_container("flowcase_generated_x", self.droplet, "t" * 80, "1280x720", node_id=self.node_a.id)
+
+        self.daemons["tcp://a:2375"].containers.run.assert_called_once()
+        self.daemons["tcp://b:2375"].containers.run.assert_not_called()
+
+class IdleReaperTestCase(unittest.TestCase):
+    """Instances nobody accessed are warned about, then removed and recorded"""
+
+    def setUp(self):
+        from unittest import mock
+        from datetime import datetime, timedelta
+        from models.droplet import DropletInstance
+        from services.idle_reaper import IdleReaper
+
+        self.app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False,
+            'INSTANCE_IDLE_TIMEOUT': 60,
+            'INSTANCE_IDLE_WARNING': 10
+        })
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.droplet = Droplet(display_name="Desktop", droplet_type="container", container_docker_image="img",
+                               container_cores=1, container_memory=1024)
+        self.pinned = Droplet(display_name="Pinned", droplet_type="container", container_docker_image="img", idle_timeout=0)
+        db.session.add_all([self.droplet, self.pinned])
+        db.session.commit()
+
+        now = datetime.utcnow()
+        db.session.add_all([
+            DropletInstance(id="idle", droplet_id=self.droplet.id, user_id="u", created_at=now - timedelta(hours=3)),
+            DropletInstance(id="warned", droplet_id=self.droplet.id, user_id="u", created_at=now - timedelta(hours=3),
+                            last_accessed=now - timedelta(minutes=55)),
+            DropletInstance(id="used", droplet_id=self.droplet.id, user_id="u", created_at=now - timedelta(hours=3),
+                            last_accessed=now - timedelta(minutes=5)),
+            DropletInstance(id="pinned", droplet_id=self.pinned.id, user_id="u", created_at=now - timedelta(days=3))
+        ])
+        db.session.commit()
+
+        self.provisioner = mock.Mock()
+        self.reaper = IdleReaper(self.provisioner)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_idle_instances_are_reaped_and_recorded(self):
+        from models.droplet import DropletInstance, InstanceReclaim
+
+        self.assertEqual(self.reaper.run(), (0, 1))
+        self.provisioner.destroy_instances.assert_called_once_with(["idle"], 8)
+
+        reclaim = InstanceReclaim.query.one()
+        self.assertEqual((reclaim.instance_id, reclaim.cores, reclaim.memory), ("idle", 1, 1024))
+        self.assertGreaterEqual(reclaim.idle_seconds, 3 * 3600)
+
+        self.assertIsNotNone(DropletInstance.query.get("warned").idle_warned_at)
+        self.assertIsNone(DropletInstance.query.get("used").idle_warned_at)
+
+    def test_touch_clears_the_warning(self):
+        from datetime import datetime, timedelta
+        from models.droplet import DropletInstance
+
+        self.reaper.run()
+        self.reaper.touch("warned")
+        instance = DropletInstance.query.get("warned")
+        self.assertIsNone(instance.idle_warned_at)
+        self.assertGreater(self.reaper.idle_expires_at(instance, self.droplet), datetime.utcnow() + timedelta(minutes=59))
+
+    def test_idle_containers_are_paused_and_thawed_on_access(self):
+        from datetime import datetime, timedelta
+        from unittest import mock
+        from models.droplet import DropletInstance
+        from utils.resources import reserve_resources, commit_resources, get_allocated_resources
+
+        db.session.add(DropletInstance(id="frozen", droplet_id=self.droplet.id, user_id="u", container_status="running",
+                                       created_at=datetime.utcnow() - timedelta(minutes=20)))
+        self.assertTrue(reserve_resources(self.droplet, ["frozen"], None, "test", enforce=False)[0])
+        db.session.commit()
+        commit_resources("frozen")
+
+        client = mock.Mock()
+        with mock_patch('services.idle_reaper.get_client', return_value=client):
+            self.assertEqual(self.reaper.run(), (1, 1))
+            client.api.pause.assert_called_once_with("flowcase_generated_frozen")
+            self.assertEqual(DropletInstance.query.get("frozen").container_status, "paused")
+            # The memory stays reserved, the cores can be handed out again
+            self.assertEqual(get_allocated_resources(), (0, 1024))
+
+            self.reaper.touch("frozen")
+            client.api.unpause.assert_called_once_with("flowcase_generated_frozen")
+            self.assertEqual(DropletInstance.query.get("frozen").container_status, "running")
+            self.assertEqual(get_allocated_resources(), (1, 1024))
+
+class ReadinessProbeTestCase(unittest.TestCase):
+    """Readiness probes gate when an instance is handed out"""
+
+    def test_tcp_probe_waits_for_listener(self):
+        import socket
+        from utils.probes import wait_until_ready
+
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        port = server.getsockname()[1]
+
+        # Start listening only after the first attempts have failed
+        timer = threading.Timer(0.3, server.listen)
+        timer.start()
+        try:
+            ready, waited, attempts = wait_until_ready({"type": "tcp", "port": port}, None, '127.0.0.1', 5)
+        finally:
+            timer.cancel()
+            server.close()
+
+        self.assertTrue(ready)
+        self.assertGreater(attempts, 1)
+        self.assertLess(waited, 5)
+
+    def test_probe_gives_up_at_deadline(self):
+        from unittest import mock
+        from utils.probes import wait_until_ready
+
+        container = mock.Mock()
+        container.exec_run.return_value = mock.Mock(exit_code=1)
+        ready, waited, _ = wait_until_ready({"type": "exec", "command": "false"}, container, None, 0.5)
+
+        self.assertFalse(ready)
+        self.assertLess(waited, 1.5)
+
+class RoutingMapTestCase(unittest.TestCase):
+    """Map routing mode keeps every route in one generated file"""
+
+    def setUp(self):
+        import tempfile
+        from unittest import mock
+        import utils.nginx
+
+        self.app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+            'WTF_CSRF_ENABLED': False,
+            'NGINX_ROUTING_MODE': 'map'
+        })
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.patches = [
+            mock.patch.object(utils.nginx, 'NGINX_ROUTES_MAP', os.path.join(self.tmp.name, 'routes.conf')),
+            mock.patch.object(utils.nginx, 'NGINX_ROUTES_LOCATIONS', os.path.join(self.tmp.name, 'locations.conf')),
+            mock.patch.object(utils.nginx, 'NGINX_ROUTES_LOCK', os.path.join(self.tmp.name, 'routes.lock'))
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.tmp.cleanup()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_route_and_unroute_instance(self):
+        import utils.nginx
+        from models.droplet import DropletInstance
+
+        user = User(username='routed', password='x', groups='', auth_token='t' * 80)
+        droplet = Droplet(display_name='Desktop', droplet_type='container', container_docker_image='img', container_cores=1, container_memory=512)
+        db.session.add_all([user, droplet])
+        db.session.commit()
+        instance = DropletInstance(droplet_id=droplet.id, user_id=user.id, ip='172.18.0.5')
+        db.session.add(instance)
+        db.session.commit()
+
+        utils.nginx.route_instance(instance, droplet, instance.ip, user)
+        routes = open(utils.nginx.NGINX_ROUTES_MAP).read()
+        self.assertIn(f'"{instance.id}" "https://172.18.0.5:6901";', routes)
+        self.assertIn(utils.nginx.get_upstream_auth(instance, user), routes)
+        self.assertTrue(os.path.exists(utils.nginx.NGINX_ROUTES_LOCATIONS))
+
+        self.assertTrue(utils.nginx.unroute_instance(instance.id))
+        self.assertNotIn(instance.id, open(utils.nginx.NGINX_ROUTES_MAP).read())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,13 +6,15 @@ def cli():
     """Utility commands for Flowcase."""
     pass
 
-@cli.command()
+@cli.command('prune-logs')
 @click.option('--days', default=90, help='Number of days to retain logs (default: 90).')
 def prune_logs_cmd(days):
     """Prune log entries older than the specified number of days."""
+    from __init__ import create_app
     try:
-        prune_logs(days)
-        click.echo(f"Successfully pruned logs older than {days} days.")
+        with create_app().app_context():
+            pruned = prune_logs(days)
+        click.echo(f"Successfully pruned {pruned} log entries older than {days} days.")
     except Exception as e:
         click.echo(f"Error pruning logs: {e}")
 
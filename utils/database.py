@@ -0,0 +1,112 @@
+import os
+from functools import partial
+from sqlalchemy import event, inspect, literal
+from sqlalchemy.engine import make_url
+
+def database_uri(uri: str) -> str:
+	"""
+	Normalize a configured database URI
+
+	postgres:// URIs of hosting providers get the SQLAlchemy scheme, relative SQLite paths are
+	taken from the working directory like the default one, not from Flask's instance folder.
+	"""
+	if uri.startswith('postgres://'):
+		uri = 'postgresql://' + uri[len('postgres://'):]
+	if uri.startswith('sqlite:///') and not uri.startswith('sqlite:////') and not uri.startswith('sqlite:///:memory:'):
+		uri = 'sqlite:///' + os.path.join(os.getcwd(), uri[len('sqlite:///'):])
+	return uri
+
+def is_sqlite(uri: str) -> bool:
+	return make_url(uri).get_backend_name() == 'sqlite'
+
+def is_memory(uri: str) -> bool:
+	url = make_url(uri)
+	return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+def engine_options(config, uri: str) -> dict:
+	"""Connection pool options of an engine, in-memory SQLite keeps the single connection Flask-SQLAlchemy gives it"""
+	if is_memory(uri):
+		return {}
+	return {
+		'pool_size': config['DATABASE_POOL_SIZE'],
+		'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+		'pool_recycle': config['DATABASE_POOL_RECYCLE'],
+		'pool_pre_ping': config['DATABASE_POOL_PRE_PING']
+	}
+
+def sqlite_pragmas(config, memory: bool = False) -> list:
+	"""(pragma, value) set on each new SQLite connection, in this order"""
+	pragmas = []
+	# The journal mode is stored in the file, in-memory databases have none to switch
+	if not memory and config.get('SQLITE_JOURNAL_MODE'):
+		pragmas.append(('journal_mode', config['SQLITE_JOURNAL_MODE']))
+	pragmas += [
+		('synchronous', config['SQLITE_SYNCHRONOUS']),
+		('busy_timeout', int(config['SQLITE_BUSY_TIMEOUT'])),
+		('mmap_size', int(config['SQLITE_MMAP_SIZE'])),
+		('cache_size', int(config['SQLITE_CACHE_SIZE']))
+	]
+	return pragmas
+
+def _set_pragmas(pragmas, dbapi_connection, connection_record):
+	cursor = dbapi_connection.cursor()
+	try:
+		for name, value in pragmas:
+			cursor.execute(f"PRAGMA {name}={value}")
+	finally:
+		cursor.close()
+
+def init_database(app):
+	"""Set the configured pragmas on the connections of the app's SQLite engines, called after db.init_app"""
+	from __init__ import db
+	with app.app_context():
+		engines = list(db.engines.values())
+	for engine in engines:
+		if engine.dialect.name != 'sqlite':
+			continue
+		listener = partial(_set_pragmas, sqlite_pragmas(app.config, is_memory(engine.url)))
+		event.listen(engine, 'connect', listener)
+
+def _column_ddl(column, dialect) -> str:
+	"""Definition of a column for ALTER TABLE ADD COLUMN, NOT NULL only when its default can fill the existing rows"""
+	preparer = dialect.identifier_preparer
+	ddl = f"{preparer.format_column(column)} {column.type.compile(dialect=dialect)}"
+	default = column.default.arg if column.default is not None and column.default.is_scalar else None
+	if default is not None:
+		ddl += " DEFAULT " + str(literal(default, column.type).compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+		if not column.nullable:
+			ddl += " NOT NULL"
+	return ddl
+
+def upgrade_schema() -> list:
+	"""
+	Add the columns and indexes of newer versions to the tables of an existing database
+
+	db.create_all() only creates the tables that are missing. Columns are added with their
+	default, or as nullable when they have none. Must be called within an app context.
+
+	Returns:
+		"table.column" of the columns added
+	"""
+	from __init__ import db
+	engine = db.engine
+	inspector = inspect(engine)
+	existing_tables = set(inspector.get_table_names())
+	added = []
+	for table in db.metadata.sorted_tables:
+		if table.name not in existing_tables:
+			continue
+		existing = {column["name"] for column in inspector.get_columns(table.name)}
+		missing = [column for column in table.columns if column.name not in existing]
+		if not missing:
+			continue
+
+		with engine.begin() as connection:
+			for column in missing:
+				connection.exec_driver_sql(
+					f"ALTER TABLE {engine.dialect.identifier_preparer.format_table(table)} ADD COLUMN {_column_ddl(column, engine.dialect)}"
+				)
+				added.append(f"{table.name}.{column.name}")
+			for index in table.indexes:
+				index.create(connection, checkfirst=True)
+	return added
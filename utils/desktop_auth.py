@@ -0,0 +1,118 @@
+import hmac
+import time
+import hashlib
+import threading
+from flask import current_app, request
+from __init__ import db
+from models.user import User
+from utils.permissions import Permissions
+
+# Signed cookie of one desktop, sent by the browser to /desktop/<instance_id>/ only
+DESKTOP_COOKIE = "flowcase_desktop"
+DESKTOP_COOKIE_VERSION = "v1"
+
+# How long a worker trusts what it read about a user's token before reading it again, in seconds.
+# Bounds how long a logout or token rotation in another worker takes to revoke access.
+DESKTOP_AUTH_CACHE_TTL = 30
+# Failed legacy checks are remembered for less time, a user who just logged in must not wait
+DESKTOP_AUTH_NEGATIVE_TTL = 5
+# Entries kept per cache, the cache is emptied when it grows past this
+DESKTOP_AUTH_CACHE_SIZE = 4096
+
+_fingerprints = {}  # user id -> (fingerprint, checked at)
+_legacy_tokens = {}  # (user id, token) -> (valid, checked at)
+_cache_lock = threading.Lock()
+
+def _sign(payload: str) -> str:
+	return hmac.new(current_app.secret_key.encode(), payload.encode(), hashlib.sha256).hexdigest()
+
+def get_fingerprint(user) -> str:
+	"""Changes when the user's token is rotated or they log out, revoking every desktop cookie issued before"""
+	return _sign(f"fingerprint:{user.id}:{user.auth_token}:{user.session_epoch or 0}")[:16]
+
+def create_desktop_cookie(instance_id: str, user, ttl: int) -> str:
+	"""Cookie value proving the user may open one instance's desktop until it expires"""
+	payload = f"{DESKTOP_COOKIE_VERSION}.{instance_id}.{user.id}.{int(time.time()) + ttl}.{get_fingerprint(user)}"
+	return f"{payload}.{_sign(payload)}"
+
+def set_desktop_cookie(response, instance_id: str, user):
+	"""Attach the desktop cookie of an instance to a response, scoped to the instance's desktop path"""
+	ttl = current_app.config.get('DESKTOP_COOKIE_TTL', 3600)
+	response.set_cookie(
+		DESKTOP_COOKIE,
+		create_desktop_cookie(instance_id, user, ttl),
+		max_age=ttl,
+		path=f"/desktop/{instance_id}/",
+		httponly=True,
+		samesite="Lax",
+		secure=request.is_secure
+	)
+	return response
+
+def _cached(cache: dict, key, ttl: float):
+	entry = cache.get(key)
+	if entry is None or time.monotonic() - entry[1] > ttl:
+		return None
+	return entry[0]
+
+def _store(cache: dict, key, value):
+	with _cache_lock:
+		if len(cache) >= DESKTOP_AUTH_CACHE_SIZE:
+			cache.clear()
+		cache[key] = (value, time.monotonic())
+
+def _current_fingerprint(user_id: str):
+	fingerprint = _cached(_fingerprints, user_id, DESKTOP_AUTH_CACHE_TTL)
+	if fingerprint is None:
+		user = User.query.with_entities(User.id, User.auth_token, User.session_epoch).filter_by(id=user_id).first()
+		fingerprint = get_fingerprint(user) if user else ""
+		_store(_fingerprints, user_id, fingerprint)
+	return fingerprint
+
+def verify_desktop_cookie(value: str, instance_id: str):
+	"""
+	Check a desktop cookie for an instance, returns the user id or None
+
+	Only the HMAC and the expiry are checked on each request. Whether the user's token
+	is still the one the cookie was issued for is read at most once per cache TTL.
+	"""
+	parts = (value or "").split(".")
+	if len(parts) != 6 or parts[0] != DESKTOP_COOKIE_VERSION:
+		return None
+
+	_, cookie_instance_id, user_id, expires, fingerprint, signature = parts
+	if not hmac.compare_digest(_sign(".".join(parts[:5])).encode(), signature.encode()):
+		return None
+	if cookie_instance_id != instance_id or not expires.isdigit() or int(expires) < time.time():
+		return None
+	if not hmac.compare_digest(_current_fingerprint(user_id).encode(), fingerprint.encode()):
+		return None
+	return user_id
+
+def verify_legacy_token(user_id: str, token: str) -> bool:
+	"""Check the userid/token cookies of clients without a desktop cookie, cached per worker"""
+	entry = _legacy_tokens.get((user_id, token))
+	if entry is not None:
+		valid, checked_at = entry
+		if time.monotonic() - checked_at <= (DESKTOP_AUTH_CACHE_TTL if valid else DESKTOP_AUTH_NEGATIVE_TTL):
+			return valid
+
+	user = User.query.with_entities(User.auth_token).filter_by(id=user_id).first()
+	valid = bool(user) and hmac.compare_digest(user.auth_token.encode(), token.encode())
+	_store(_legacy_tokens, (user_id, token), valid)
+	return valid
+
+def revoke_desktop_cookies(user_id: str):
+	"""Invalidate every desktop cookie of a user, at once in this worker and within the cache TTL in others"""
+	User.query.filter_by(id=user_id).update({User.session_epoch: User.session_epoch + 1}, synchronize_session=False)
+	db.session.commit()
+	forget_user(user_id)
+	# Cached user snapshots carry the epoch the cookies are signed with
+	Permissions.invalidate()
+
+def forget_user(user_id: str):
+	"""Drop what this worker cached about a user, after their token changed"""
+	with _cache_lock:
+		_fingerprints.pop(user_id, None)
+		for key in [key for key in _legacy_tokens if key[0] == user_id]:
+			_legacy_tokens.pop(key, None)
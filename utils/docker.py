@@ -1,19 +1,92 @@
+import os
 import re
+import time
+import threading
 import docker
 from utils.logger import log
 # __version__ is imported lazily within functions to avoid circular imports
 
+DOCKER_SOCKET = "unix:///var/run/docker.sock"
+
+# Read from the environment, clients are created before any Flask app exists
+# Connections kept open per client, enough for the provisioning, bulk launch and destroy threads of a worker
+DOCKER_POOL_SIZE = int(os.environ.get('FLOWCASE_DOCKER_POOL_SIZE', 16))
+# Seconds a single Docker API call may take
+DOCKER_TIMEOUT = int(os.environ.get('FLOWCASE_DOCKER_TIMEOUT', 60))
+# Image pulls and the event stream stay open for long, they get their own clients
+DOCKER_PULL_TIMEOUT = int(os.environ.get('FLOWCASE_DOCKER_PULL_TIMEOUT', 900))
+DOCKER_EVENTS_TIMEOUT = 300
+
+# Shared client of the local daemon, re-created in every forked process
 docker_client = None
 
+# Clients of this process by (base_url, timeout), each with its own keep-alive connection pool
+_clients = {}
+_clients_lock = threading.Lock()
+_api_version = None
+
+# Local image index, rebuilt after TTL or when an image event invalidates it
+IMAGE_INDEX_TTL = 300
+# Used instead while the event stream is down and invalidations might be missed
+IMAGE_INDEX_DISCONNECTED_TTL = 10
+# A miss on an index older than this is confirmed against the daemon before it is trusted
+IMAGE_INDEX_MISS_RECHECK = 2
+
+_image_index = None
+_image_index_built_at = 0
+_image_index_lock = threading.Lock()
+
+def create_client(base_url: str = DOCKER_SOCKET, timeout: int = None):
+	"""Open a new client with a sized connection pool, prefer get_client() which shares them"""
+	# Once the API version is known no call is made here, so clients can be re-created right after a fork
+	return docker.DockerClient(
+		base_url=base_url,
+		version=_api_version if base_url == DOCKER_SOCKET else None,
+		timeout=timeout or DOCKER_TIMEOUT,
+		max_pool_size=DOCKER_POOL_SIZE
+	)
+
+def get_client(base_url: str = DOCKER_SOCKET, timeout: int = None):
+	"""Return the client of this process for a daemon and timeout, thread safe and never shared across a fork"""
+	key = (base_url, timeout or DOCKER_TIMEOUT)
+	with _clients_lock:
+		client = _clients.get(key)
+		if client is None:
+			client = create_client(base_url, timeout)
+			_clients[key] = client
+		return client
+
+def discard_client(client):
+	"""Close a client and stop handing it out, used for daemons that went away"""
+	with _clients_lock:
+		for key in [key for key, value in _clients.items() if value is client]:
+			del _clients[key]
+	try:
+		client.close()
+	except Exception:
+		pass
+
+def _after_fork():
+	"""Forked processes must not use the parent's sockets, every client is re-created"""
+	global docker_client, _clients_lock
+	_clients_lock = threading.Lock()
+	_clients.clear()
+	if docker_client is not None:
+		docker_client = get_client()
+
+os.register_at_fork(after_in_child=_after_fork)
+
 def init_docker():
-	global docker_client
+	global docker_client, _api_version
 	
 	if docker_client is not None:
 		return docker_client
 		
 	try:
-		docker_client = docker.DockerClient(base_url="unix:///var/run/docker.sock")
-		docker_client.ping()
+		client = get_client()
+		client.ping()
+		_api_version = client.api.api_version
+		docker_client = client
   
 		return docker_client
 		
@@ -22,6 +95,42 @@ def init_docker():
 		docker_client = None
 		return None
 
+def _pools(client):
+	"""urllib3 connection pools of a client, for both unix socket and tcp adapters"""
+	pools = []
+	for adapter in client.api.adapters.values():
+		container = getattr(adapter, "pools", None)
+		if container is None and getattr(adapter, "poolmanager", None) is not None:
+			container = adapter.poolmanager.pools
+		if container is not None:
+			pools.extend(container[key] for key in container.keys())
+	return pools
+
+def get_client_metrics():
+	"""Connection reuse of every client of this process, requests served per connection opened"""
+	with _clients_lock:
+		clients = list(_clients.items())
+
+	metrics = []
+	for (base_url, timeout), client in clients:
+		requests = connections = idle = 0
+		for pool in _pools(client):
+			requests += pool.num_requests
+			connections += pool.num_connections
+			idle += pool.pool.qsize() if pool.pool is not None else 0
+		metrics.append({
+			"base_url": base_url,
+			"timeout": timeout,
+			"pool_size": DOCKER_POOL_SIZE,
+			"requests": requests,
+			"connections_opened": connections,
+			"reused": max(requests - connections, 0),
+			"reuse_ratio": round(1 - connections / requests, 3) if requests else 0,
+			"idle_connections": idle,
+			"pid": os.getpid()
+		})
+	return metrics
+
 def is_docker_available():
 	"""Return True if the Docker client is initialized and working"""
 	return docker_client is not None
@@ -36,14 +145,76 @@ def get_docker_version():
 	except Exception as e:
 		return f"Error: {str(e)}"
 
-def cleanup_containers():
-	"""Delete any existing flowcase containers"""
-	if not docker_client:
+def _build_image_index(client=None):
+	"""One images API call, indexing every repo:tag and repo@digest present on the daemon"""
+	index = set()
+	for image in (client or docker_client).api.images():
+		index.update(tag for tag in (image.get("RepoTags") or []) if tag != "<none>:<none>")
+		index.update(digest for digest in (image.get("RepoDigests") or []) if not digest.startswith("<none>"))
+	return index
+
+def invalidate_image_index(event=None):
+	"""Drop the local image index, the next lookup rebuilds it"""
+	global _image_index
+	with _image_index_lock:
+		_image_index = None
+
+def get_image_index(max_age=None):
+	"""Return the cached set of local image references, rebuilding it when stale"""
+	global _image_index, _image_index_built_at
+	from utils.docker_events import event_watcher
+
+	# Image events keep the index fresh, the watcher is started lazily in each process
+	event_watcher.add_listener("image", invalidate_image_index)
+	event_watcher.start()
+
+	if max_age is None:
+		max_age = IMAGE_INDEX_TTL if event_watcher.is_connected() else IMAGE_INDEX_DISCONNECTED_TTL
+
+	with _image_index_lock:
+		if _image_index is None or time.monotonic() - _image_index_built_at > max_age:
+			_image_index = _build_image_index()
+			_image_index_built_at = time.monotonic()
+		return _image_index
+
+def image_candidates(image_name):
+	"""Index keys an image reference can be found under, a reference without tag means :latest"""
+	candidates = {image_name}
+	if "@" not in image_name and ":" not in image_name.rsplit("/", 1)[-1]:
+		candidates.add(f"{image_name}:latest")
+	return candidates
+
+def image_exists_locally(image_name):
+	"""Check an image reference (repo, repo:tag or repo@digest) against the local image index"""
+	if not docker_client or not image_name:
+		return False
+
+	candidates = image_candidates(image_name)
+	if candidates & get_image_index():
+		return True
+	# Confirm a miss in case another process pulled the image before its event reached us
+	return bool(candidates & get_image_index(max_age=IMAGE_INDEX_MISS_RECHECK))
+
+def get_droplet_image(droplet):
+	"""Return the full image name used to run a droplet"""
+	if droplet.droplet_type in ["vnc", "rdp", "ssh"]:
+		from __init__ import __version__
+		return f"flowcaseweb/flowcase-guac:{__version__}"
+
+	if droplet.container_docker_registry and "docker.io" not in droplet.container_docker_registry:
+		registry = droplet.container_docker_registry.rstrip("/")
+		return f"{registry}/{droplet.container_docker_image}"
+	return droplet.container_docker_image
+
+def cleanup_containers(client=None):
+	"""Delete any existing flowcase containers, of the local daemon unless another client is given"""
+	client = client or docker_client
+	if not client:
 		print("No Docker client available, skipping container cleanup")
 		return
 		
 	try:
-		containers = docker_client.containers.list(all=True)
+		containers = client.containers.list(all=True)
 		for container in containers:
 			regex = re.compile(r"flowcase_generated_([a-z0-9]+(-[a-z0-9]+)+)", re.IGNORECASE)
 			if regex.match(container.name):
@@ -63,7 +234,7 @@ def force_pull_required_images():
 		return
 		
 	try:
-		log("INFO", "Starting required image pull for Flowcase...")
+		log("INFO", "Starting required image pull for Flowcase...", category="image")
 		
 		# Define all required images for Flowcase
 		required_images = [
@@ -98,7 +269,7 @@ def force_pull_required_images():
 			image_name = img_info["name"]
 			description = img_info["description"]
 			
-			log("INFO", f"Pulling required Docker image {image_name} ({description})")
+			log("INFO", f"Pulling required Docker image {image_name} ({description})", category="image")
 			try:
 				# Extract tag from image name - handle multiple colons properly
 				if ":" in image_name:
@@ -110,15 +281,16 @@ def force_pull_required_images():
 					base_image = image_name
 					tag = "latest"
 				
-				docker_client.images.pull(base_image, tag)
-				log("INFO", f"Successfully pulled required Docker image {image_name} ({description})")
+				get_client(timeout=DOCKER_PULL_TIMEOUT).images.pull(base_image, tag)
+				invalidate_image_index()
+				log("INFO", f"Successfully pulled required Docker image {image_name} ({description})", category="image")
 			except Exception as e:
-				log("ERROR", f"Error pulling required Docker image {image_name} ({description}): {e}")
+				log("ERROR", f"Error pulling required Docker image {image_name} ({description}): {e}", category="image")
 				
-		log("INFO", "Required image pull for Flowcase completed")
+		log("INFO", "Required image pull for Flowcase completed", category="image")
 				
 	except Exception as e:
-		log("ERROR", f"Error in force_pull_required_images: {str(e)}")
+		log("ERROR", f"Error in force_pull_required_images: {str(e)}", category="image")
 
 def pull_images():
 	"""Pull all required docker images for Flowcase"""
@@ -161,7 +333,7 @@ def pull_images():
 			image_name = img_info["name"]
 			description = img_info["description"]
 			
-			log("INFO", f"Pulling required Docker image {image_name} ({description})")
+			log("INFO", f"Pulling required Docker image {image_name} ({description})", category="image")
 			try:
 				# Extract tag from image name - handle multiple colons properly
 				if ":" in image_name:
@@ -173,15 +345,16 @@ def pull_images():
 					base_image = image_name
 					tag = "latest"
 				
-				docker_client.images.pull(base_image, tag)
-				log("INFO", f"Successfully pulled required Docker image {image_name} ({description})")
+				get_client(timeout=DOCKER_PULL_TIMEOUT).images.pull(base_image, tag)
+				invalidate_image_index()
+				log("INFO", f"Successfully pulled required Docker image {image_name} ({description})", category="image")
 			except Exception as e:
-				log("ERROR", f"Error pulling required Docker image {image_name} ({description}): {e}")
+				log("ERROR", f"Error pulling required Docker image {image_name} ({description}): {e}", category="image")
 				
-		log("INFO", "Required image pull for Flowcase completed")
+		log("INFO", "Required image pull for Flowcase completed", category="image")
 				
 	except Exception as e:
-		log("ERROR", f"Error in pull_images: {str(e)}")
+		log("ERROR", f"Error in pull_images: {str(e)}", category="image")
 
 def check_image_exists(registry, image_name):
 	"""Check if a Docker image exists locally"""
@@ -197,13 +370,9 @@ def check_image_exists(registry, image_name):
 			full_image = image_name
 			
 		# Check if image exists locally
-		images = docker_client.images.list()
-		for image in images:
-			if full_image in image.tags:
-				return True
-		return False
+		return image_exists_locally(full_image)
 	except Exception as e:
-		log("ERROR", f"Error checking if image exists: {str(e)}")
+		log("ERROR", f"Error checking if image exists: {str(e)}", category="image")
 		return False
 
 def pull_single_image(registry, image_name):
@@ -233,14 +402,15 @@ def pull_single_image(registry, image_name):
 			repository = full_image
 			tag = "latest"
 		
-		log("INFO", f"Manually pulling Docker image {full_image}")
-		docker_client.images.pull(repository, tag)
-		log("INFO", f"Successfully pulled Docker image {full_image}")
+		log("INFO", f"Manually pulling Docker image {full_image}", category="image")
+		get_client(timeout=DOCKER_PULL_TIMEOUT).images.pull(repository, tag)
+		invalidate_image_index()
+		log("INFO", f"Successfully pulled Docker image {full_image}", category="image")
 		return True, f"Successfully pulled {full_image}"
 		
 	except Exception as e:
 		error_msg = f"Error pulling Docker image {image_name}: {str(e)}"
-		log("ERROR", error_msg)
+		log("ERROR", error_msg, category="image")
 		return False, error_msg
 
 def get_images_status():
@@ -282,14 +452,11 @@ def get_images_status():
 			})
 		
 		status = {}
-		local_images = docker_client.images.list()
-		local_image_tags = []
-		for image in local_images:
-			local_image_tags.extend(image.tags)
+		local_images = get_image_index()
 		
 		for img_info in required_images:
 			# Check if image exists locally using exact match instead of substring
-			exists = any(img_info["image"] == tag for tag in local_image_tags)
+			exists = img_info["image"] in local_images
 			
 			status[img_info["id"]] = {
 				"droplet_name": img_info["name"],
@@ -301,5 +468,5 @@ def get_images_status():
 		return status
 		
 	except Exception as e:
-		log("ERROR", f"Error getting images status: {str(e)}")
+		log("ERROR", f"Error getting images status: {str(e)}", category="image")
 		return {}
\ No newline at end of file
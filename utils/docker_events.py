@@ -0,0 +1,138 @@
+import os
+import time
+import threading
+import utils.docker
+
+# Label set on every container started by Flowcase, used to filter the Docker event stream
+FLOWCASE_LABEL = "flowcase.managed"
+
+class ContainerWaiter:
+	"""A launch waiting for the first lifecycle event of its container"""
+	def __init__(self, name: str):
+		self.name = name
+		self.created_at = time.monotonic()
+		self.status = None
+		self.event = threading.Event()
+
+	def notify(self, status: str):
+		self.status = status
+		self.event.set()
+
+class DockerEventWatcher:
+	"""
+	Follows the Docker /events stream in a background thread and wakes launches
+	waiting on their container instead of having them poll the daemon. Other
+	modules can subscribe to event types, e.g. image events for the image index.
+	"""
+	def __init__(self):
+		self._waiters = {}
+		self._listeners = {}
+		self._lock = threading.Lock()
+		self._thread = None
+		self._pid = None
+		self._connected = threading.Event()
+		self._since = None
+
+	def is_connected(self) -> bool:
+		return self._connected.is_set() and self._pid == os.getpid()
+
+	def start(self):
+		"""Start the watcher thread of this process, a no-op if it is already running"""
+		with self._lock:
+			# Threads do not survive a fork, each gunicorn worker needs its own watcher
+			if self._thread is not None and self._pid == os.getpid():
+				return
+			self._pid = os.getpid()
+			self._connected.clear()
+			# Replay from slightly before now so containers expected while connecting are not missed
+			self._since = int(time.time()) - 1
+			self._thread = threading.Thread(target=self._run, name="flowcase-docker-events", daemon=True)
+			self._thread.start()
+
+	def add_listener(self, event_type: str, callback):
+		"""Call callback(event) for every event of a type, registering the same callback twice is a no-op"""
+		with self._lock:
+			listeners = self._listeners.setdefault(event_type, [])
+			if callback not in listeners:
+				listeners.append(callback)
+
+	def expect(self, name: str) -> ContainerWaiter:
+		"""Register interest in a container before creating it, so its start event cannot be missed"""
+		self.start()
+		waiter = ContainerWaiter(name)
+		with self._lock:
+			self._waiters[name] = waiter
+		return waiter
+
+	def cancel(self, name: str):
+		with self._lock:
+			self._waiters.pop(name, None)
+
+	def wait(self, name: str, timeout: float):
+		"""
+		Wait for the next start or die event of an expected container
+
+		Returns:
+			(status, seconds since expect()), status is None on timeout
+		"""
+		with self._lock:
+			waiter = self._waiters.get(name)
+		if waiter is None:
+			return None, 0.0
+
+		waiter.event.wait(timeout)
+		self.cancel(name)
+		return waiter.status, time.monotonic() - waiter.created_at
+
+	def _dispatch(self, event: dict):
+		with self._lock:
+			listeners = list(self._listeners.get(event.get("Type"), []))
+		for callback in listeners:
+			try:
+				callback(event)
+			except Exception as e:
+				print(f"Docker event listener failed: {str(e)}")
+
+		if event.get("Type") != "container":
+			return
+		# Daemon side filters cannot combine a label with image events, so labels are checked here
+		if event.get("Actor", {}).get("Attributes", {}).get(FLOWCASE_LABEL) != "true":
+			return
+		action = event.get("Action") or event.get("status")
+		name = event.get("Actor", {}).get("Attributes", {}).get("name")
+		with self._lock:
+			waiter = self._waiters.get(name)
+		if waiter is not None and action in ["start", "die"]:
+			waiter.notify(action)
+
+	def _run(self):
+		backoff = 1
+		while True:
+			if utils.docker.docker_client is None:
+				time.sleep(backoff)
+				continue
+			# The stream holds its connection for good, it gets a client of its own
+			client = utils.docker.get_client(timeout=utils.docker.DOCKER_EVENTS_TIMEOUT)
+
+			try:
+				# Resume from the last event seen so a reconnect does not drop events
+				stream = client.events(decode=True, since=self._since, filters={
+					"type": ["container", "image"],
+					"event": ["start", "die", "pull", "tag", "untag", "delete", "load", "import"]
+				})
+				self._connected.set()
+				# Anything may have changed while disconnected
+				self._dispatch({"Type": "image", "Action": "reconnect"})
+				backoff = 1
+				for event in stream:
+					self._since = event.get("time", self._since)
+					self._dispatch(event)
+			except Exception as e:
+				print(f"Docker event stream interrupted: {str(e)}")
+
+			self._connected.clear()
+			time.sleep(backoff)
+			backoff = min(backoff * 2, 30)
+
+# Global watcher, started lazily in each process
+event_watcher = DockerEventWatcher()
@@ -0,0 +1,400 @@
+import os
+import re
+import gzip
+import json
+import time
+import base64
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import MetaData, Table, Integer, inspect, select, func, text, column, or_, and_
+from __init__ import db
+from models.log import LOG_PARTITION_PREFIX, LOG_FIELDS, log_table, forget_log_table
+
+PARTITION_NAME = re.compile(rf'^{LOG_PARTITION_PREFIX}(\d{{8}})$')
+
+# Rows copied per transaction when moving the entries of the former Log table
+LEGACY_BATCH_SIZE = 10000
+# Rows read at a time while a partition is archived or exported
+ARCHIVE_BATCH_SIZE = 1000
+# Seconds a worker reuses the total number of entries matching a filter
+LOG_TOTAL_CACHE_TTL = 60
+LOG_TOTAL_CACHE_SIZE = 256
+
+_created = set()  # (engine, partition) known to exist by this process
+_created_lock = threading.Lock()
+_full_text = {}  # engine -> whether its database has FTS5
+_totals = {}  # (engine, search, filters) -> (total, counted at)
+_totals_lock = threading.Lock()
+
+def get_log_engine():
+	"""Engine of the logs database, the "logs" bind"""
+	return db.engines['logs']
+
+def partition_name(created_at: datetime, interval: str = 'day') -> str:
+	"""Partition of an entry, named after the first day of its day or week"""
+	day = created_at.date()
+	if interval == 'week':
+		day -= timedelta(days=day.weekday())
+	return f"{LOG_PARTITION_PREFIX}{day:%Y%m%d}"
+
+def get_partitions(engine=None, table_names=None) -> list:
+	"""Names of the log partitions, newest first"""
+	if table_names is None:
+		table_names = inspect(engine or get_log_engine()).get_table_names()
+	return sorted((name for name in table_names if PARTITION_NAME.match(name)), reverse=True)
+
+def has_full_text(engine) -> bool:
+	"""Whether messages are indexed for full text search, on SQLite builds with FTS5"""
+	if engine not in _full_text:
+		available = False
+		if engine.dialect.name == 'sqlite':
+			with engine.connect() as connection:
+				available = bool(connection.exec_driver_sql("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar())
+		_full_text[engine] = available
+	return _full_text[engine]
+
+def _create_search_index(connection, name: str, rebuild: bool = False):
+	"""FTS5 index of a partition's messages, filled by a trigger as entries are inserted"""
+	connection.exec_driver_sql(
+		f'CREATE VIRTUAL TABLE IF NOT EXISTS "{name}_fts" USING fts5(message, content=\'{name}\', content_rowid=\'id\')'
+	)
+	connection.exec_driver_sql(
+		f'CREATE TRIGGER IF NOT EXISTS "{name}_fts_insert" AFTER INSERT ON "{name}" BEGIN '
+		f'INSERT INTO "{name}_fts"(rowid, message) VALUES (new.id, new.message); END'
+	)
+	if rebuild:
+		connection.exec_driver_sql(f'INSERT INTO "{name}_fts"("{name}_fts") VALUES (\'rebuild\')')
+
+def _create_partition(engine, connection, table):
+	table.create(connection, checkfirst=True)
+	if has_full_text(engine):
+		_create_search_index(connection, table.name)
+
+def _forget(engine, name=None):
+	with _created_lock:
+		for key in [key for key in _created if key[0] is engine and name in (None, key[1])]:
+			_created.discard(key)
+
+def insert_logs(engine, partitions: dict):
+	"""Insert {partition: rows} in one transaction, creating the partitions that do not exist yet"""
+	def insert():
+		with engine.begin() as connection:
+			for name, rows in partitions.items():
+				table = log_table(name)
+				key = (engine, name)
+				if key not in _created:
+					_create_partition(engine, connection, table)
+					with _created_lock:
+						_created.add(key)
+				connection.execute(table.insert(), rows)
+
+	try:
+		insert()
+	except Exception:
+		# A partition this process created may have been dropped by the retention since
+		_forget(engine)
+		insert()
+
+def match_query(search: str) -> str:
+	"""FTS5 query matching every word of a search, each taken literally"""
+	return " ".join('"' + word.replace('"', '""') + '"' for word in search.split())
+
+def _filtered(table, table_names, search=None, filters=None):
+	query = select(table)
+	for field, value in (filters or {}).items():
+		if field not in LOG_FIELDS:
+			raise ValueError(f"Unknown log field {field}")
+		if value:
+			query = query.where(table.c[field] == value)
+	if search and search.strip():
+		if f"{table.name}_fts" in table_names:
+			matches = text(f'SELECT rowid FROM "{table.name}_fts" WHERE "{table.name}_fts" MATCH :search') \
+				.bindparams(search=match_query(search)).columns(column('rowid', Integer))
+			query = query.where(table.c.id.in_(matches))
+		else:
+			query = query.where(table.c.message.icontains(search, autoescape=True))
+	return query
+
+def count_logs(search=None, **filters) -> int:
+	"""Number of entries across the partitions, filtered on the LOG_FIELDS given and a full text search"""
+	engine = get_log_engine()
+	table_names = inspect(engine).get_table_names()
+	total = 0
+	with engine.connect() as connection:
+		for name in get_partitions(engine, table_names):
+			total += connection.scalar(select(func.count()).select_from(_filtered(log_table(name), table_names, search, filters).subquery()))
+	return total
+
+def query_logs(search=None, offset: int = 0, limit: int = 50, **filters) -> list:
+	"""
+	Entries newest first, read partition by partition until the page is full
+
+	Filtered on the LOG_FIELDS given, each indexed with created_at, and on the words of a
+	search matched by the partitions' FTS5 index. Partitions entirely before the offset are
+	only counted, never read.
+	"""
+	engine = get_log_engine()
+	table_names = inspect(engine).get_table_names()
+	rows = []
+	with engine.connect() as connection:
+		for name in get_partitions(engine, table_names):
+			table = log_table(name)
+			query = _filtered(table, table_names, search, filters)
+			if offset:
+				count = connection.scalar(select(func.count()).select_from(query.subquery()))
+				if count <= offset:
+					offset -= count
+					continue
+			rows.extend(connection.execute(
+				query.order_by(table.c.created_at.desc(), table.c.id.desc()).offset(offset).limit(limit - len(rows))
+			).all())
+			offset = 0
+			if len(rows) >= limit:
+				break
+	return rows
+
+def count_logs_cached(search=None, **filters) -> int:
+	"""count_logs() reused for LOG_TOTAL_CACHE_TTL seconds, page totals do not need to be exact"""
+	key = (get_log_engine(), search, tuple(sorted(filters.items())))
+	entry = _totals.get(key)
+	if entry is not None and time.monotonic() - entry[1] <= LOG_TOTAL_CACHE_TTL:
+		return entry[0]
+
+	total = count_logs(search, **filters)
+	with _totals_lock:
+		if len(_totals) >= LOG_TOTAL_CACHE_SIZE:
+			_totals.clear()
+		_totals[key] = (total, time.monotonic())
+	return total
+
+def encode_cursor(partition: str, row) -> str:
+	"""Opaque position after an entry, ids are only unique within their partition"""
+	position = json.dumps([partition, row.created_at.isoformat(), row.id])
+	return base64.urlsafe_b64encode(position.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+	"""(partition, created_at, id) of a cursor, raises ValueError if it is not one"""
+	try:
+		partition, created_at, entry_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+		if not PARTITION_NAME.match(partition) or not isinstance(entry_id, int):
+			raise ValueError()
+		return partition, datetime.fromisoformat(created_at), entry_id
+	except Exception:
+		raise ValueError("Invalid cursor")
+
+def query_logs_page(search=None, cursor: str = None, limit: int = 50, **filters):
+	"""
+	Entries newest first after a cursor, seeking on (created_at, id) instead of counting an offset
+
+	Every page costs the same whatever its depth, the partitions newer than the cursor are skipped
+	by name and the cursor's partition is entered through its created_at index.
+
+	Returns:
+		(rows, cursor of the next page or None on the last page)
+	"""
+	after = decode_cursor(cursor) if cursor else None
+	engine = get_log_engine()
+	table_names = inspect(engine).get_table_names()
+	entries = []  # (partition, row)
+	with engine.connect() as connection:
+		for name in get_partitions(engine, table_names):
+			if after and name > after[0]:
+				continue
+			table = log_table(name)
+			query = _filtered(table, table_names, search, filters)
+			if after and name == after[0]:
+				query = query.where(or_(
+					table.c.created_at < after[1],
+					and_(table.c.created_at == after[1], table.c.id < after[2])
+				))
+			# One more than the page, to know if there is a next one
+			rows = connection.execute(
+				query.order_by(table.c.created_at.desc(), table.c.id.desc()).limit(limit + 1 - len(entries))
+			).all()
+			entries.extend((name, row) for row in rows)
+			if len(entries) > limit:
+				break
+
+	next_cursor = encode_cursor(*entries[limit - 1]) if len(entries) > limit else None
+	return [row for _, row in entries[:limit]], next_cursor
+
+def iter_logs(search=None, since: datetime = None, until: datetime = None, **filters):
+	"""
+	Yield (partition, row) of the entries oldest first, streamed in batches so memory stays flat
+
+	Each partition is read on its own connection, released before the next one is read.
+	"""
+	engine = get_log_engine()
+	table_names = inspect(engine).get_table_names()
+	for name in reversed(get_partitions(engine, table_names)):
+		table = log_table(name)
+		query = _filtered(table, table_names, search, filters)
+		if since:
+			query = query.where(table.c.created_at >= since)
+		if until:
+			query = query.where(table.c.created_at < until)
+		with engine.connect() as connection:
+			result = connection.execution_options(yield_per=ARCHIVE_BATCH_SIZE).execute(
+				query.order_by(table.c.created_at, table.c.id)
+			)
+			for row in result:
+				yield name, row
+
+def log_to_dict(row) -> dict:
+	"""JSON fields of an entry, as exported and archived"""
+	return {
+		"id": row.id,
+		"created_at": row.created_at.isoformat(),
+		"message": row.message,
+		**{field: row._mapping[field] for field in LOG_FIELDS}
+	}
+
+def archive_partition(engine, table, archive_dir: str) -> int:
+	"""Write a partition's entries to <archive_dir>/<partition>.jsonl.gz, returns the number of entries"""
+	os.makedirs(archive_dir, exist_ok=True)
+	path = os.path.join(archive_dir, f"{table.name}.jsonl.gz")
+	suffix = 1
+	while os.path.exists(path):
+		# Entries written to the partition after it was first archived
+		path = os.path.join(archive_dir, f"{table.name}.{suffix}.jsonl.gz")
+		suffix += 1
+
+	archived = 0
+	temporary = f"{path}.tmp"
+	with engine.connect() as connection, gzip.open(temporary, 'wt', encoding='utf-8') as archive:
+		result = connection.execution_options(yield_per=ARCHIVE_BATCH_SIZE).execute(
+			select(table).order_by(table.c.created_at, table.c.id)
+		)
+		for row in result:
+			archive.write(json.dumps(log_to_dict(row)) + "\n")
+			archived += 1
+	os.replace(temporary, path)
+	return archived
+
+def drop_partitions(older_than_days: int, archive_dir: str = None):
+	"""
+	Drop the partitions whose newest entry is older than older_than_days, archived first if archive_dir is set
+
+	A partition is dropped as a whole, its entries are never deleted one by one.
+
+	Returns:
+		(partitions dropped, entries they held)
+	"""
+	cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+	engine = get_log_engine()
+	dropped = entries = 0
+	for name in get_partitions(engine):
+		# Named after their first day, the newer ones cannot be past the cutoff
+		if datetime.strptime(PARTITION_NAME.match(name).group(1), '%Y%m%d') >= cutoff:
+			continue
+
+		table = log_table(name)
+		with engine.connect() as connection:
+			newest = connection.scalar(select(func.max(table.c.created_at)))
+			if newest is not None and newest >= cutoff:
+				continue
+			count = connection.scalar(select(func.count()).select_from(table)) if not archive_dir else 0
+
+		if archive_dir:
+			count = archive_partition(engine, table, archive_dir)
+		with engine.begin() as connection:
+			if engine.dialect.name == 'sqlite':
+				connection.exec_driver_sql(f'DROP TABLE IF EXISTS "{name}_fts"')
+			table.drop(connection, checkfirst=True)
+		forget_log_table(name)
+		_forget(engine, name)
+		dropped += 1
+		entries += count
+	return dropped, entries
+
+def upgrade_partitions() -> int:
+	"""
+	Add the fields, indexes and search index of newer versions to the existing partitions
+
+	Entries written before categories existed get the image category from their message.
+
+	Returns:
+		Number of partitions upgraded
+	"""
+	engine = get_log_engine()
+	table_names = inspect(engine).get_table_names()
+	full_text = has_full_text(engine)
+	upgraded = 0
+	for name in get_partitions(engine, table_names):
+		table = log_table(name)
+		existing = {column["name"] for column in inspect(engine).get_columns(name)}
+		missing = [table_column for table_column in table.columns if table_column.name not in existing]
+		needs_search = full_text and f"{name}_fts" not in table_names
+		if not missing and not needs_search:
+			continue
+
+		with engine.begin() as connection:
+			for table_column in missing:
+				connection.exec_driver_sql(f'ALTER TABLE "{name}" ADD COLUMN {table_column.name} {table_column.type.compile(dialect=engine.dialect)}')
+			if "category" in {table_column.name for table_column in missing}:
+				connection.execute(table.update().where(table.c.message.like('%Docker image%')).values(category='image'))
+			for index in table.indexes:
+				index.create(connection, checkfirst=True)
+			if needs_search:
+				_create_search_index(connection, name, rebuild=True)
+		upgraded += 1
+	return upgraded
+
+def _not_copied(connection, name: str, entries: list) -> list:
+	"""Entries not in their partition yet, an earlier run may have stopped between copying a batch and deleting it"""
+	if not inspect(connection).has_table(name):
+		return entries
+	table = log_table(name)
+	present = Counter(tuple(row) for row in connection.execute(
+		select(table.c.created_at, table.c.level, table.c.message).where(
+			table.c.created_at.between(min(entry["created_at"] for entry in entries), max(entry["created_at"] for entry in entries))
+		)
+	))
+	missing = []
+	for entry in entries:
+		key = (entry["created_at"], entry["level"], entry["message"])
+		if present[key]:
+			present[key] -= 1
+		else:
+			missing.append(entry)
+	return missing
+
+def migrate_legacy_logs(interval: str = 'day') -> int:
+	"""
+	Move the entries of the former Log table of the main database into the partitions, then drop it
+
+	Each batch is deleted from the Log table once copied, a run that stopped halfway resumes
+	without copying an entry twice.
+	"""
+	main = db.engine
+	if 'log' not in inspect(main).get_table_names():
+		return 0
+
+	legacy = Table('log', MetaData(), autoload_with=main)
+	engine = get_log_engine()
+	moved = 0
+	while True:
+		with main.connect() as connection:
+			rows = connection.execute(select(legacy).order_by(legacy.c.id).limit(LEGACY_BATCH_SIZE)).all()
+		if not rows:
+			break
+
+		partitions = {}
+		for row in rows:
+			created_at = row.created_at or datetime.utcnow()
+			partitions.setdefault(partition_name(created_at, interval), []).append({
+				"created_at": created_at,
+				"level": row.level,
+				"message": row.message,
+				"category": "image" if "Docker image" in (row.message or "") else None
+			})
+		with engine.connect() as connection:
+			partitions = {name: _not_copied(connection, name, entries) for name, entries in partitions.items()}
+		insert_logs(engine, {name: entries for name, entries in partitions.items() if entries})
+		with main.begin() as connection:
+			connection.execute(legacy.delete().where(legacy.c.id <= rows[-1].id))
+		moved += len(rows)
+
+	legacy.drop(main)
+	return moved
@@ -1,44 +1,173 @@
+import os
 import time
+import queue
+import atexit
 import datetime
+import threading
+from functools import lru_cache
 # Import db lazily inside functions to avoid circular imports
 
-def log(level: str, message: str):
-	"""Log a message to the database and console"""
-	from models.log import Log
-	
-	log_entry = Log(level=level, message=message)
-	# Import db lazily to avoid circular import
-	from __init__ import db
-	db.session.add(log_entry)
-	db.session.commit()
-	
-	timestamp = log_entry.created_at.strftime('%Y-%m-%d %H:%M:%S')
-	
-	# Only print DEBUG logs if in debug mode
+# Messages waiting for the writer, the ones logged while it is full are dropped and counted
+LOG_QUEUE_LIMIT = 10000
+# The writer inserts the messages it got in one transaction, once it has this many or after this many seconds
+LOG_BATCH_SIZE = 200
+LOG_FLUSH_INTERVAL = 1.0
+
+class LogWriter:
+	"""Writes log messages in batches from a background thread, on its own database connections"""
+
+	def __init__(self, limit=LOG_QUEUE_LIMIT, batch_size=LOG_BATCH_SIZE, interval=LOG_FLUSH_INTERVAL):
+		self.queue = queue.Queue(maxsize=limit)
+		self.batch_size = batch_size
+		self.interval = interval
+		self._thread = None
+		self._lock = threading.Lock()
+		self._counts = {"written": 0, "dropped": 0, "failed": 0, "batches": 0}
+
+	def _start(self):
+		with self._lock:
+			if self._thread is None or not self._thread.is_alive():
+				self._thread = threading.Thread(target=self._run, name='flowcase-log-writer', daemon=True)
+				self._thread.start()
+
+	def enqueue(self, engine, partition: str, row: dict) -> bool:
+		"""Queue a log row for a partition of the engine's database without blocking, False if the queue was full and it was dropped"""
+		self._start()
+		try:
+			self.queue.put_nowait((engine, partition, row))
+			return True
+		except queue.Full:
+			with self._lock:
+				self._counts["dropped"] += 1
+			return False
+
+	def flush(self, timeout: float = 5) -> bool:
+		"""Wait until the messages queued so far are written, False if they were not within the timeout"""
+		if self._thread is None or not self._thread.is_alive():
+			return self.queue.empty()
+		flushed = threading.Event()
+		try:
+			self.queue.put((None, None, flushed), timeout=timeout)
+		except queue.Full:
+			return False
+		return flushed.wait(timeout)
+
+	def _run(self):
+		while True:
+			batch = [self.queue.get()]
+			deadline = time.monotonic() + self.interval
+			while len(batch) < self.batch_size and batch[-1][0] is not None:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					break
+				try:
+					batch.append(self.queue.get(timeout=remaining))
+				except queue.Empty:
+					break
+
+			self.write([entry for entry in batch if entry[0] is not None])
+			for engine, _, entry in batch:
+				if engine is None:
+					entry.set()
+
+	def write(self, entries: list):
+		"""Insert (engine, partition, row) entries, in one transaction per database"""
+		databases = {}
+		for engine, partition, row in entries:
+			databases.setdefault(engine, {}).setdefault(partition, []).append(row)
+
+		from utils.log_store import insert_logs
+		for engine, partitions in databases.items():
+			count = sum(len(rows) for rows in partitions.values())
+			try:
+				insert_logs(engine, partitions)
+				outcome = "written"
+			except Exception as e:
+				outcome = "failed"
+				print(f"[ERROR] | Failed to write {count} log entries: {str(e)}", flush=True)
+			with self._lock:
+				self._counts[outcome] += count
+				self._counts["batches"] += 1
+
+	def get_metrics(self) -> dict:
+		with self._lock:
+			return {"queued": self.queue.qsize(), "limit": self.queue.maxsize, **self._counts}
+
+_writer = LogWriter()
+
+def _after_fork():
+	global _writer
+	# The writer thread is not copied into the child, neither are the parent's queued messages
+	_writer = LogWriter()
+
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(lambda: _writer.flush(2))
+
+@lru_cache(maxsize=1)
+def _debug() -> bool:
 	from config.config import parse_args
-	args = parse_args()
-	
-	if level != "DEBUG" or args.debug:
-		print(f"[{level}] | {timestamp} | {message}", flush=True)
-		
-	return log_entry
+	return parse_args().debug
+
+def log(level: str, message: str, category: str = None, instance_id: str = None, droplet_id: str = None, user_id: str = None):
+	"""
+	Log a message to the database and console
+
+	The category ("image", "instance", "volume", "docker") and the ids of what the message is
+	about are indexed, filter on them rather than on the message text.
+
+	The row is written by the log writer on its own connection, the caller's session and
+	transaction are left untouched. Tests and FLOWCASE_LOG_ASYNC=false write it right away.
+	"""
+	created_at = datetime.datetime.utcnow()
+
+	# Only print DEBUG logs if in debug mode
+	if level != "DEBUG" or _debug():
+		print(f"[{level}] | {created_at.strftime('%Y-%m-%d %H:%M:%S')} | {message}", flush=True)
+
+	from flask import current_app, has_app_context
+	if not has_app_context():
+		return
+
+	from utils.log_store import get_log_engine, partition_name
+	engine = get_log_engine()
+	partition = partition_name(created_at, current_app.config.get('LOG_PARTITION_INTERVAL', 'day'))
+	row = {
+		"level": level,
+		"message": message[:1024],
+		"created_at": created_at,
+		"category": category,
+		"instance_id": instance_id,
+		"droplet_id": droplet_id,
+		"user_id": user_id
+	}
+	if current_app.testing or not current_app.config.get('LOG_ASYNC', True):
+		_writer.write([(engine, partition, row)])
+	else:
+		_writer.enqueue(engine, partition, row)
+
+def flush_logs(timeout: float = 5) -> bool:
+	"""Wait until the messages logged by this process so far are in the database"""
+	return _writer.flush(timeout)
+
+def get_log_writer_metrics() -> dict:
+	"""Queue depth of this process' log writer, with the messages written, dropped and failed"""
+	return _writer.get_metrics()
 
 # -------------------------------------------------------------------------
 # Log retention utility
 # -------------------------------------------------------------------------
 def prune_logs(older_than_days: int = 90):
 	"""
-	Delete log entries older than ``older_than_days``.
+	Drop the log partitions older than ``older_than_days``, archived as compressed JSONL first.
 	"""
-	# Import Log model locally to avoid circular imports
-	from models.log import Log
-	cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=older_than_days)
+	from flask import current_app
+	from utils.log_store import drop_partitions
+	archive_dir = current_app.config.get('LOG_ARCHIVE_DIR')
 	try:
-		# Import db lazily to avoid circular import
-		from __init__ import db
-		deleted = Log.query.filter(Log.created_at < cutoff).delete()
-		db.session.commit()
-		log("INFO", f"Pruned {deleted} log entries older than {older_than_days} days")
+		partitions, entries = drop_partitions(older_than_days, archive_dir)
 	except Exception as e:
-		db.session.rollback()
-		log("ERROR", f"Failed to prune logs: {str(e)}")
\ No newline at end of file
+		log("ERROR", f"Failed to prune logs: {str(e)}")
+		return 0
+	if partitions:
+		log("INFO", f"Pruned {entries} log entries older than {older_than_days} days in {partitions} partition(s)" + (f", archived to {archive_dir}" if archive_dir else ""))
+	return entries
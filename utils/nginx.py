@@ -0,0 +1,294 @@
+import os
+import time
+import fcntl
+import base64
+import threading
+from flask import current_app, has_app_context
+import utils.docker
+from utils.logger import log
+
+NGINX_CONTAINER_NAME = "flowcase-nginx"
+NGINX_CONFIG_DIR = "/flowcase/nginx/containers.d"
+
+# Map routing mode: the maps are included at http level (conf.d), the generic locations in the server block
+NGINX_ROUTES_MAP = "/flowcase/nginx/flowcase_routes.conf"
+NGINX_ROUTES_LOCATIONS = f"{NGINX_CONFIG_DIR}/_flowcase_routes.conf"
+NGINX_ROUTES_LOCK = "/flowcase/nginx/.flowcase_routes.lock"
+
+ROUTING_MODES = ["locations", "map"]
+
+# Config changes requested within this window share a single reload, in seconds
+NGINX_RELOAD_WINDOW = 0.05
+# How long reload_nginx() waits for the reload that includes the caller's change
+NGINX_RELOAD_TIMEOUT = 30
+
+class NginxReloadError(Exception):
+	"""The reload covering a config change failed or did not happen in time"""
+	pass
+
+def generate_nginx_config(instance, droplet, ip: str, user) -> str:
+	"""Render the nginx location block for an instance from its droplet template"""
+	authHeader = get_upstream_auth(instance, user)[len("Basic "):]
+
+	if droplet.droplet_type == "container":
+		nginx_config = open("config/nginx/container_template.conf", "r").read()
+	else: # Guacamole droplet
+		nginx_config = open("config/nginx/guac_template.conf", "r").read()
+
+	nginx_config = nginx_config.replace("{ip}", ip)
+	nginx_config = nginx_config.replace("{authHeader}", authHeader)
+	nginx_config = nginx_config.replace("{instance_id}", instance.id)
+
+	return nginx_config
+
+def get_routing_mode() -> str:
+	"""'locations' writes one config file per instance, 'map' keeps every route in one map file"""
+	mode = current_app.config.get('NGINX_ROUTING_MODE', 'locations')
+	return mode if mode in ROUTING_MODES else 'locations'
+
+def get_upstream_auth(instance, user) -> str:
+	"""Authorization header value nginx sends to a container droplet"""
+	password = instance.vnc_password or user.auth_token
+	return "Basic " + base64.b64encode(b'flowcase_user:' + password.encode()).decode('utf-8')
+
+def generate_routing_map(routes) -> str:
+	"""
+	Render the instance id -> upstream maps
+
+	Args:
+		routes: (instance_id, droplet_type, ip, auth) tuples, auth is None for guacamole droplets
+	"""
+	maps = {"vnc": [], "audio": [], "uploads": [], "auth": []}
+	for instance_id, droplet_type, ip, auth in routes:
+		if droplet_type == "container":
+			maps["vnc"].append(f'"{instance_id}" "https://{ip}:6901";')
+			maps["audio"].append(f'"{instance_id}" "https://{ip}:4901";')
+			maps["uploads"].append(f'"{instance_id}" "https://{ip}:4902";')
+			maps["auth"].append(f'"{instance_id}" "{auth}";')
+		else: # Guacamole droplet
+			maps["vnc"].append(f'"{instance_id}" "http://{ip}:8080";')
+
+	variables = {
+		"vnc": "$flowcase_vnc_upstream",
+		"audio": "$flowcase_audio_upstream",
+		"uploads": "$flowcase_uploads_upstream",
+		"auth": "$flowcase_upstream_auth"
+	}
+
+	nginx_config = "# Generated by Flowcase, do not edit\n"
+	for name, entries in maps.items():
+		nginx_config += f"\nmap $flowcase_instance_id {variables[name]} {{\n\tdefault \"\";\n"
+		nginx_config += "".join(f"\t{entry}\n" for entry in entries)
+		nginx_config += "}\n"
+	return nginx_config
+
+def _write_atomic(path: str, content: str):
+	"""Write through a temporary file so nginx never reads a half written config"""
+	tmp_path = f"{path}.{os.getpid()}.tmp"
+	with open(tmp_path, "w") as f:
+		f.write(content)
+	os.replace(tmp_path, path)
+
+def write_routing_map(exclude: str = None):
+	"""Regenerate the routing map from every routed instance, returns the number of routes"""
+	from models.droplet import Droplet, DropletInstance
+	from models.user import User
+
+	# Serialize writers across workers, each one reads the rows after the previous write
+	with open(NGINX_ROUTES_LOCK, "w") as lock:
+		fcntl.flock(lock, fcntl.LOCK_EX)
+
+		rows = DropletInstance.query \
+			.join(Droplet, Droplet.id == DropletInstance.droplet_id) \
+			.join(User, User.id == DropletInstance.user_id) \
+			.filter(DropletInstance.ip.isnot(None)) \
+			.with_entities(DropletInstance, Droplet.droplet_type, User) \
+			.all()
+
+		routes = []
+		for instance, droplet_type, user in rows:
+			if instance.id == exclude:
+				continue
+			auth = get_upstream_auth(instance, user) if droplet_type == "container" else None
+			routes.append((instance.id, droplet_type, instance.ip, auth))
+
+		_write_atomic(NGINX_ROUTES_MAP, generate_routing_map(routes))
+		if not os.path.exists(NGINX_ROUTES_LOCATIONS):
+			_write_atomic(NGINX_ROUTES_LOCATIONS, open("config/nginx/map_template.conf", "r").read())
+
+	return len(routes)
+
+def init_routing():
+	"""Prepare the routing files of the configured mode at startup, removing those of the other mode"""
+	if get_routing_mode() == "map":
+		if os.path.exists(NGINX_ROUTES_LOCATIONS):
+			os.remove(NGINX_ROUTES_LOCATIONS)  # pick up template changes
+		write_routing_map()
+		return
+
+	for path in [NGINX_ROUTES_MAP, NGINX_ROUTES_LOCATIONS]:
+		if os.path.exists(path):
+			os.remove(path)
+
+def route_instance(instance, droplet, ip: str, user):
+	"""Add an instance to nginx routing, a reload is still needed afterwards"""
+	if get_routing_mode() == "map":
+		# The map is rebuilt from the rows, the instance must be committed with its ip first
+		write_routing_map()
+	else:
+		write_nginx_config(instance, generate_nginx_config(instance, droplet, ip, user))
+
+def unroute_instance(instance_id: str) -> bool:
+	"""Remove an instance from nginx routing, returns True if a reload is needed"""
+	if get_routing_mode() == "map":
+		write_routing_map(exclude=instance_id)
+		return True
+	return remove_nginx_config(instance_id)
+
+def write_nginx_config(instance, nginx_config: str):
+	with open(f"{NGINX_CONFIG_DIR}/{instance.id}.conf", "w") as f:
+		f.write(nginx_config)
+
+def remove_nginx_config(instance_id: str):
+	"""Delete the nginx config of an instance, returns True if a file was removed"""
+	path = f"{NGINX_CONFIG_DIR}/{instance_id}.conf"
+	if os.path.exists(path):
+		os.remove(path)
+		return True
+	return False
+
+def _exec_nginx_reload():
+	nginx_container = utils.docker.docker_client.containers.get(NGINX_CONTAINER_NAME)
+	result = nginx_container.exec_run("nginx -s reload")
+	if result.exit_code != 0:
+		# Waiters of the batch get the error, a launch whose config nginx refused is torn down
+		raise NginxReloadError(f"nginx -s reload exited with {result.exit_code}: {result.output.decode(errors='replace').strip()}")
+
+class ReloadCoalescer:
+	"""
+	Batches nginx reload requests: changes written before a reload starts are all
+	covered by it, so a burst of launches costs one reload instead of one each.
+	"""
+	def __init__(self, reload_func, window: float):
+		self._reload_func = reload_func
+		self._window = window
+		self._cond = threading.Condition()
+		self._thread = None
+		self._pid = None
+		self._app = None  # reloads log to the database, so they run in the requesting app's context
+		self._requested = 0  # generation of the latest request
+		self._completed = 0  # generation covered by the latest finished reload
+		self._errors = {}  # generation of recent failed reloads -> error
+		self._metrics = {
+			"requests": 0,
+			"reloads": 0,
+			"failures": 0,
+			"last_batch_size": 0,
+			"last_latency_ms": 0.0,
+			"max_latency_ms": 0.0,
+			"total_latency_ms": 0.0
+		}
+
+	def _start(self):
+		# Threads do not survive a fork, each gunicorn worker needs its own flusher
+		if self._thread is not None and self._pid == os.getpid():
+			return
+		self._pid = os.getpid()
+		self._thread = threading.Thread(target=self._run, name="flowcase-nginx-reload", daemon=True)
+		self._thread.start()
+
+	def request(self, wait: bool = True, timeout: float = NGINX_RELOAD_TIMEOUT):
+		"""
+		Ask for a reload after writing or removing a config file
+
+		When waiting, blocks until a reload that started after this call has finished
+		and raises NginxReloadError if it failed.
+		"""
+		with self._cond:
+			if has_app_context():
+				self._app = current_app._get_current_object()
+			self._start()
+			self._requested += 1
+			self._metrics["requests"] += 1
+			generation = self._requested
+			self._cond.notify_all()
+
+			if not wait:
+				return
+			if not self._cond.wait_for(lambda: self._completed >= generation, timeout):
+				raise NginxReloadError("Timed out waiting for Nginx reload")
+
+			error = next((error for batch, error in sorted(self._errors.items()) if batch >= generation), None)
+			if error is not None:
+				raise NginxReloadError(error)
+
+	def _run(self):
+		while True:
+			with self._cond:
+				self._cond.wait_for(lambda: self._requested > self._completed)
+
+			# Let the rest of the burst write its config before reloading
+			time.sleep(self._window)
+
+			with self._cond:
+				batch = self._requested
+				batch_size = batch - self._completed
+				app = self._app
+
+			started = time.monotonic()
+			error = self._reload(app)
+			latency_ms = (time.monotonic() - started) * 1000
+
+			with self._cond:
+				self._completed = batch
+				if error is not None:
+					self._errors[batch] = error
+					self._metrics["failures"] += 1
+				# Only waiters from the last few batches can still look up their error
+				for old in sorted(self._errors)[:-16]:
+					del self._errors[old]
+
+				self._metrics["reloads"] += 1
+				self._metrics["last_batch_size"] = batch_size
+				self._metrics["last_latency_ms"] = latency_ms
+				self._metrics["max_latency_ms"] = max(self._metrics["max_latency_ms"], latency_ms)
+				self._metrics["total_latency_ms"] += latency_ms
+				self._cond.notify_all()
+
+	def _reload(self, app):
+		"""Run one reload, returns the error message or None"""
+		try:
+			if app is None:
+				self._reload_func()
+			else:
+				with app.app_context():
+					self._reload_func()
+			return None
+		except Exception as e:
+			error = str(e)
+
+		# Never let a logging failure kill the thread every waiter depends on
+		try:
+			with app.app_context():
+				log("ERROR", f"Error reloading Nginx: {error}")
+		except Exception:
+			print(f"Error reloading Nginx: {error}")
+		return error
+
+	def metrics(self) -> dict:
+		with self._cond:
+			metrics = dict(self._metrics)
+			metrics["pending"] = self._requested - self._completed
+		reloads = metrics.pop("total_latency_ms")
+		metrics["avg_latency_ms"] = reloads / metrics["reloads"] if metrics["reloads"] else 0.0
+		metrics["coalesced"] = metrics["requests"] - metrics["pending"] - metrics["reloads"]
+		metrics["window_ms"] = self._window * 1000
+		metrics["pid"] = os.getpid()
+		return metrics
+
+# Global coalescer, the flusher thread is started lazily in each process
+reload_coalescer = ReloadCoalescer(_exec_nginx_reload, NGINX_RELOAD_WINDOW)
+
+def reload_nginx(wait: bool = True):
+	"""Reload nginx to pick up config changes, coalesced with other changes in the same window"""
+	reload_coalescer.request(wait=wait)
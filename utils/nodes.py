@@ -0,0 +1,148 @@
+import os
+import time
+import threading
+from sqlalchemy.exc import IntegrityError
+from __init__ import db
+from models.node import DockerNode, LOCAL_NODE_ID
+from utils.logger import log
+import utils.docker
+
+# Remote daemons have no event stream, their image lists are cached for this long
+NODE_IMAGE_INDEX_TTL = 60
+
+DEFAULT_NETWORK = "flowcase_default_network"
+
+# A remote daemon that does not answer a ping within this many seconds is unreachable. It is not
+# tried again for a backoff doubling from the minimum to the maximum, so requests ranking it never
+# wait on it for longer than a ping, and at most once per backoff.
+NODE_CONNECT_TIMEOUT = 3
+NODE_RETRY_MIN = 5
+NODE_RETRY_MAX = 300
+
+# Clients of reachable nodes by node id, taken from the shared pool of utils.docker
+_clients = {}
+_clients_lock = threading.Lock()
+_node_images = {}
+_unreachable = {}  # node id -> (monotonic time of the next attempt, backoff in seconds)
+
+def _after_fork():
+	global _clients_lock
+	# The pooled clients are re-created in the child, forget the parent's
+	_clients_lock = threading.Lock()
+	_clients.clear()
+	_node_images.clear()
+	_unreachable.clear()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def connect(base_url: str):
+	"""Return the pooled client of a Docker daemon, raising if it does not answer within NODE_CONNECT_TIMEOUT"""
+	probe = utils.docker.get_client(base_url, timeout=NODE_CONNECT_TIMEOUT)
+	try:
+		probe.ping()
+	except Exception:
+		utils.docker.discard_client(probe)
+		raise
+	return utils.docker.get_client(base_url)
+
+def ensure_local_node():
+	"""Register the daemon Flowcase runs on as a node, so it can be drained like any other"""
+	if DockerNode.query.get(LOCAL_NODE_ID):
+		return
+	try:
+		db.session.add(DockerNode(id=LOCAL_NODE_ID, name="local", base_url=utils.docker.DOCKER_SOCKET))
+		db.session.commit()
+	except IntegrityError:
+		db.session.rollback()  # Registered by another worker
+
+def get_node(node_id):
+	"""Return the node row of a node id, None meaning the local node"""
+	return DockerNode.query.get(node_id or LOCAL_NODE_ID)
+
+def get_node_network(node_id) -> str:
+	node = get_node(node_id)
+	return node.network if node and node.network else DEFAULT_NETWORK
+
+def get_client(node_id=None):
+	"""Return the Docker client of a node, None meaning the local node, or None if it is unreachable"""
+	if not node_id or node_id == LOCAL_NODE_ID:
+		return utils.docker.docker_client
+
+	with _clients_lock:
+		client = _clients.get(node_id)
+		retry = _unreachable.get(node_id)
+	if client is not None:
+		return client
+	if retry is not None and time.monotonic() < retry[0]:
+		return None
+
+	node = DockerNode.query.get(node_id)
+	if not node:
+		return None
+	try:
+		client = connect(node.base_url)
+	except Exception as e:
+		backoff = min(retry[1] * 2, NODE_RETRY_MAX) if retry else NODE_RETRY_MIN
+		with _clients_lock:
+			_unreachable[node_id] = (time.monotonic() + backoff, backoff)
+		log("ERROR", f"Docker node {node.name} at {node.base_url} is not reachable, retrying in {backoff}s: {str(e)}")
+		return None
+
+	with _clients_lock:
+		_unreachable.pop(node_id, None)
+		_clients.setdefault(node_id, client)
+		return _clients[node_id]
+
+def forget_client(node_id):
+	"""Drop the cached client of a node, the next get_client() reconnects right away"""
+	with _clients_lock:
+		client = _clients.pop(node_id, None)
+		_node_images.pop(node_id, None)
+		_unreachable.pop(node_id, None)
+	if client is not None:
+		utils.docker.discard_client(client)
+
+def node_has_image(node_id, image_name) -> bool:
+	"""Check if an image is present on a node, without pulling it"""
+	if not node_id or node_id == LOCAL_NODE_ID:
+		return utils.docker.image_exists_locally(image_name)
+
+	client = get_client(node_id)
+	if client is None or not image_name:
+		return False
+
+	cached = _node_images.get(node_id)
+	if cached is None or time.monotonic() - cached[0] > NODE_IMAGE_INDEX_TTL:
+		try:
+			cached = (time.monotonic(), utils.docker._build_image_index(client))
+		except Exception as e:
+			log("ERROR", f"Error listing images of Docker node {node_id}: {str(e)}")
+			return False
+		_node_images[node_id] = cached
+	return bool(utils.docker.image_candidates(image_name) & cached[1])
+
+def remove_container(name: str, node_id=None) -> bool:
+	"""Force remove a container on the node it runs on, False if it does not exist"""
+	client = get_client(node_id)
+	if client is None:
+		return False
+	try:
+		client.containers.get(name).remove(force=True)
+		return True
+	except Exception:
+		return False  # Container might not exist
+
+def get_remote_clients():
+	"""(node, client) of every reachable node other than the local one"""
+	clients = []
+	for node in DockerNode.query.filter(DockerNode.id != LOCAL_NODE_ID).all():
+		client = get_client(node.id)
+		if client is not None:
+			clients.append((node, client))
+	return clients
+
+def cleanup_node_containers():
+	"""Delete the flowcase containers left on remote nodes, the local daemon is cleaned by cleanup_containers()"""
+	for node, client in get_remote_clients():
+		print(f"Cleaning up containers of Docker node {node.name}")
+		utils.docker.cleanup_containers(client)
@@ -1,5 +1,10 @@
+import time
+import threading
 from __init__ import db
 
+# How often a worker checks if another one changed users or groups, in seconds
+PERMISSION_VERSION_CHECK_INTERVAL = 1.0
+
 class Permissions:
 	ADMIN_PANEL = "perm_admin_panel"
 	VIEW_INSTANCES = "perm_view_instances"
@@ -20,20 +25,86 @@ class Permissions:
 	MANAGE_TEMPLATES = "perm_manage_templates"
 	VIEW_WORKSHOP_INSTANCES = "perm_view_workshop_instances"
 
+	# Compiled permission bitmasks by user id, valid for the version they were compiled at
+	_masks = {}
+	_version = None
+	_version_checked = 0.0
+	_lock = threading.Lock()
+
 	@staticmethod
-	def check_permission(userid, permission):
+	def bit(permission) -> int:
+		return PERMISSION_BITS[permission]
+
+	@staticmethod
+	def compile(userid) -> int:
+		"""Bitmask of the permissions a user has through any of their groups"""
 		from models.user import User, Group
-		
-		#go through all groups and check if the user has the permission
-		user = User.query.filter_by(id=userid).first()
-		groups = user.groups.split(",")
 
-		for group in groups:
-			group = Group.query.filter_by(id=group).first()
-	
-			if not group: #group not found, most likely deleted
-				continue
+		user = User.query.with_entities(User.groups).filter_by(id=userid).first()
+		if not user:
+			return 0
+
+		mask = 0
+		#groups that are not found were most likely deleted
+		for group in Group.query.filter(Group.id.in_(user.groups.split(","))).all():
+			for permission, bit in PERMISSION_BITS.items():
+				if getattr(group, permission):
+					mask |= bit
+		return mask
+
+	@staticmethod
+	def _current_version() -> int:
+		from models.user import PermissionVersion
+		row = PermissionVersion.query.get(1)
+		return row.version if row else 0
+
+	@staticmethod
+	def version() -> int:
+		"""Shared version stamp of users and groups, read from the database at most once per check interval"""
+		now = time.monotonic()
+		if Permissions._version is None or now - Permissions._version_checked > PERMISSION_VERSION_CHECK_INTERVAL:
+			version = Permissions._current_version()
+			with Permissions._lock:
+				if version != Permissions._version:
+					Permissions._masks = {}
+					Permissions._version = version
+				Permissions._version_checked = now
+		return Permissions._version
+
+	@staticmethod
+	def get_mask(userid) -> int:
+		"""Cached bitmask of a user, dropped when the shared version stamp changes"""
+		Permissions.version()
+		mask = Permissions._masks.get(userid)
+		if mask is None:
+			mask = Permissions.compile(userid)
+			Permissions._masks[userid] = mask
+		return mask
+
+	@staticmethod
+	def invalidate():
+		"""Bump the version stamp after users or groups changed, every worker recompiles their masks"""
+		from sqlalchemy.exc import IntegrityError
+		from models.user import PermissionVersion
+
+		if PermissionVersion.query.filter_by(id=1).update({'version': PermissionVersion.version + 1}, synchronize_session=False) != 1:
+			try:
+				with db.session.begin_nested():
+					db.session.add(PermissionVersion(id=1, version=1))
+			except IntegrityError:
+				# Created by another worker
+				PermissionVersion.query.filter_by(id=1).update({'version': PermissionVersion.version + 1}, synchronize_session=False)
+		db.session.commit()
+		with Permissions._lock:
+			Permissions._masks = {}
+			Permissions._version = None
+
+	@staticmethod
+	def check_permission(userid, permission):
+		return bool(Permissions.get_mask(userid) & Permissions.bit(permission)) 
 
-			if getattr(group, permission):
-				return True
-		return False 
\ No newline at end of file
+# One bit per permission column of Group
+PERMISSION_BITS = {
+	value: 1 << index
+	for index, value in enumerate(value for name, value in vars(Permissions).items() if name.isupper() and isinstance(value, str))
+}
@@ -0,0 +1,88 @@
+import ssl
+import time
+import socket
+import http.client
+
+# Used when a droplet has no readiness probe configured, ports match config/nginx/*_template.conf
+DEFAULT_PROBES = {
+	"container": {"type": "tcp", "port": 6901},
+	"guacamole": {"type": "tcp", "port": 8080},
+}
+
+PROBE_TYPES = ["tcp", "http", "exec"]
+
+# Adaptive backoff between attempts, in seconds
+PROBE_INITIAL_INTERVAL = 0.05
+PROBE_MAX_INTERVAL = 2.0
+PROBE_BACKOFF_FACTOR = 1.5
+
+def validate_probe(probe) -> str:
+	"""Return an error message if the probe definition is invalid, an empty string otherwise"""
+	if not isinstance(probe, dict):
+		return "Readiness probe must be an object"
+	if probe.get("type") not in PROBE_TYPES:
+		return f"Readiness probe type must be one of {', '.join(PROBE_TYPES)}"
+	if probe["type"] in ["tcp", "http"] and not isinstance(probe.get("port"), int):
+		return "Readiness probe port is required"
+	if probe["type"] == "exec" and not probe.get("command"):
+		return "Readiness probe command is required"
+	return ""
+
+def run_probe(probe: dict, container, ip: str) -> bool:
+	"""Run a single probe attempt, True if the droplet is serving"""
+	attempt_timeout = probe.get("attempt_timeout", 1)
+
+	try:
+		if probe["type"] == "tcp":
+			with socket.create_connection((ip, probe["port"]), timeout=attempt_timeout):
+				return True
+
+		if probe["type"] == "http":
+			if probe.get("scheme", "https") == "https":
+				# Droplets serve self-signed certificates
+				context = ssl.create_default_context()
+				context.check_hostname = False
+				context.verify_mode = ssl.CERT_NONE
+				connection = http.client.HTTPSConnection(ip, probe["port"], timeout=attempt_timeout, context=context)
+			else:
+				connection = http.client.HTTPConnection(ip, probe["port"], timeout=attempt_timeout)
+
+			try:
+				connection.request("GET", probe.get("path", "/"))
+				status = connection.getresponse().status
+			finally:
+				connection.close()
+
+			# A 401 from KasmVNC still means the server is up, only 5xx are not ready
+			return status in probe.get("expect_status", []) if probe.get("expect_status") else status < 500
+
+		if probe["type"] == "exec":
+			return container.exec_run(probe["command"]).exit_code == 0
+	except Exception:
+		return False
+
+	return False
+
+def wait_until_ready(probe: dict, container, ip: str, timeout: float):
+	"""
+	Run a probe with adaptive backoff until it succeeds or the deadline passes
+
+	Returns:
+		(ready, seconds waited, number of attempts)
+	"""
+	started = time.monotonic()
+	deadline = started + timeout
+	interval = PROBE_INITIAL_INTERVAL
+	attempts = 0
+
+	while True:
+		attempts += 1
+		if run_probe(probe, container, ip):
+			return True, time.monotonic() - started, attempts
+
+		remaining = deadline - time.monotonic()
+		if remaining <= 0:
+			return False, time.monotonic() - started, attempts
+
+		time.sleep(min(interval, remaining))
+		interval = min(interval * PROBE_BACKOFF_FACTOR, PROBE_MAX_INTERVAL)
@@ -0,0 +1,136 @@
+import os
+import json
+import shutil
+import tarfile
+import tempfile
+import threading
+import subprocess
+import utils.docker
+from utils.logger import log
+
+# Home directory of the droplet user, mounted from the persistent profile path
+PROFILE_HOME = "/home/flowcase-user"
+
+# Extracted home directories, one per image id, used to seed new profiles
+PROFILE_SKELETON_DIR = "data/profile_skeletons"
+PROFILE_SKELETON_MANIFEST = f"{PROFILE_SKELETON_DIR}/manifest.json"
+
+_skeleton_lock = threading.Lock()
+
+def _load_manifest() -> dict:
+	try:
+		with open(PROFILE_SKELETON_MANIFEST, "r") as f:
+			return json.load(f)
+	except Exception:
+		return {}
+
+def _save_manifest(manifest: dict):
+	tmp_path = f"{PROFILE_SKELETON_MANIFEST}.{os.getpid()}.tmp"
+	with open(tmp_path, "w") as f:
+		json.dump(manifest, f)
+	os.replace(tmp_path, PROFILE_SKELETON_MANIFEST)
+
+def _extract_home(client, image_name: str, destination: str):
+	"""Copy the home directory out of a created, never started, container of the image"""
+	container = client.containers.create(image=image_name)
+	try:
+		stream, _ = container.get_archive(PROFILE_HOME)
+		with tempfile.TemporaryFile() as archive:
+			for chunk in stream:
+				archive.write(chunk)
+			archive.seek(0)
+
+			# The archive root is the home directory itself, strip it from every member
+			prefix = os.path.basename(PROFILE_HOME)
+			with tarfile.open(fileobj=archive) as tar:
+				members = []
+				for member in tar.getmembers():
+					if member.name == prefix:
+						member.name = "."
+					elif member.name.startswith(prefix + "/"):
+						member.name = member.name[len(prefix) + 1:]
+					else:
+						continue
+					members.append(member)
+
+				if hasattr(tarfile, "tar_filter"):
+					tar.extractall(destination, members=members, numeric_owner=True, filter="tar")
+				else:
+					tar.extractall(destination, members=members, numeric_owner=True)
+	finally:
+		container.remove(force=True)
+
+def get_profile_skeleton(image_name: str, client=None) -> str:
+	"""
+	Return the skeleton directory of an image, extracting it on first use
+
+	Skeletons are keyed by image id, so pulling a new version of a tag builds a new
+	skeleton and the one of the previous version is removed. The image is read from
+	the given client, the local daemon by default.
+	"""
+	client = client or utils.docker.docker_client
+	image_id = client.images.get(image_name).id.split(":")[-1]
+	skeleton = os.path.join(PROFILE_SKELETON_DIR, image_id)
+	if os.path.isdir(skeleton):
+		return skeleton
+
+	with _skeleton_lock:
+		if os.path.isdir(skeleton):
+			return skeleton
+
+		os.makedirs(PROFILE_SKELETON_DIR, exist_ok=True)
+		tmp_dir = tempfile.mkdtemp(prefix=".building-", dir=PROFILE_SKELETON_DIR)
+		try:
+			_extract_home(client, image_name, tmp_dir)
+			os.rename(tmp_dir, skeleton)
+		except OSError:
+			# Another worker finished the same skeleton first
+			shutil.rmtree(tmp_dir, ignore_errors=True)
+			if not os.path.isdir(skeleton):
+				raise
+		except Exception:
+			shutil.rmtree(tmp_dir, ignore_errors=True)
+			raise
+
+		manifest = _load_manifest()
+		previous = manifest.get(image_name)
+		manifest[image_name] = image_id
+		_save_manifest(manifest)
+		if previous and previous != image_id and previous not in manifest.values():
+			shutil.rmtree(os.path.join(PROFILE_SKELETON_DIR, previous), ignore_errors=True)
+
+		log("INFO", f"Cached profile skeleton of image {image_name} ({image_id[:12]})")
+		return skeleton
+
+def seed_profile(skeleton: str, profile_path: str):
+	"""Copy a skeleton into a profile directory without overwriting existing files"""
+	os.makedirs(profile_path, exist_ok=True)
+
+	# Reflinks make the copy nearly free on filesystems that support them
+	try:
+		subprocess.run(
+			["cp", "-a", "-n", "--reflink=auto", os.path.join(skeleton, "."), profile_path],
+			check=True, capture_output=True
+		)
+		return
+	except (OSError, subprocess.CalledProcessError) as e:
+		log("WARNING", f"Falling back to a Python copy for profile {profile_path}: {str(e)}")
+
+	for root, dirs, files in os.walk(skeleton):
+		target_root = os.path.join(profile_path, os.path.relpath(root, skeleton))
+		os.makedirs(target_root, exist_ok=True)
+		shutil.copystat(root, target_root)
+		stat = os.stat(root)
+		os.lchown(target_root, stat.st_uid, stat.st_gid)
+
+		for name in files + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+			source = os.path.join(root, name)
+			target = os.path.join(target_root, name)
+			if os.path.lexists(target):
+				continue
+			if os.path.islink(source):
+				os.symlink(os.readlink(source), target)
+			else:
+				shutil.copy2(source, target)
+			stat = os.lstat(source)
+			os.lchown(target, stat.st_uid, stat.st_gid)
@@ -0,0 +1,301 @@
+import os
+from typing import Tuple
+import psutil
+from flask import current_app
+from sqlalchemy import exists
+from sqlalchemy.exc import IntegrityError
+from __init__ import db
+from models.resources import ResourceLedger, ResourceReservation
+from models.node import DockerNode, LOCAL_NODE_ID
+from utils.logger import log
+
+HOST_SCOPE = "host"
+
+def tenant_scope(tenant_id) -> str:
+	return f"tenant:{tenant_id}"
+
+def node_scope(node_id) -> str:
+	"""Ledger scope of a Docker node, the local node keeps the host scope"""
+	if not node_id or node_id == LOCAL_NODE_ID:
+		return HOST_SCOPE
+	return f"node:{node_id}"
+
+def _limits(cpu_count: float, total_memory: float) -> Tuple[float, float]:
+	# CPU: Allow 2x oversubscription (containers share CPU efficiently via CPU shares)
+	# Memory: Use 85% of total memory to leave room for system operations
+	return cpu_count * 2.0, total_memory * 0.85
+
+def get_resource_limits() -> Tuple[float, float]:
+	"""Return the (cores, memory in MB) the host can hand out"""
+	total_memory = psutil.virtual_memory().total / 1024 / 1024  # Convert to MB
+	return _limits(os.cpu_count(), total_memory)
+
+def get_daemon_limits(info: dict) -> Tuple[float, float]:
+	"""Return the (cores, memory in MB) a Docker node can hand out, from the daemon's info()"""
+	return _limits(info["NCPU"], info["MemTotal"] / 1024 / 1024)
+
+def get_node_limits(node) -> Tuple[float, float]:
+	"""Return the (cores, memory in MB) of a node, the local node defaults to the host limits"""
+	if node is None or (node.is_local() and not (node.max_cores and node.max_memory)):
+		return get_resource_limits()
+	return node.max_cores or 0, node.max_memory or 0
+
+def get_tenant_limits() -> Tuple[float, float]:
+	"""Return the (cores, memory in MB) each tenant can reserve, 0 means unlimited"""
+	return current_app.config.get('TENANT_MAX_CORES', 0), current_app.config.get('TENANT_MAX_MEMORY', 0)
+
+def get_allocated_resources(scope: str = HOST_SCOPE) -> Tuple[float, float]:
+	"""Return the (cores, memory in MB) reserved in a ledger scope"""
+	ledger = ResourceLedger.query.get(scope)
+	if not ledger:
+		return 0, 0
+	return ledger.cores, ledger.memory
+
+def _ensure_ledger(scope: str):
+	if ResourceLedger.query.get(scope):
+		return
+	# Savepoint, so the caller's pending changes are neither committed nor lost here
+	try:
+		with db.session.begin_nested():
+			db.session.add(ResourceLedger(scope=scope, cores=0, memory=0))
+	except IntegrityError:
+		pass  # Created by another worker
+
+def _shortage(droplet, requested_by: str, count: int, scope: str, max_cores: float, max_memory: float, shortages: list = None) -> str:
+	"""
+	Log and describe why a reservation did not fit in a scope
+
+	Callers that try several nodes pass a list the log lines are collected in instead,
+	so that only the shortages of a placement that failed everywhere are logged.
+	"""
+	allocated_cores, allocated_memory = get_allocated_resources(scope)
+	projected_memory_usage = allocated_memory + droplet.container_memory * count
+	projected_core_usage = allocated_cores + droplet.container_cores * count
+
+	if max_memory and projected_memory_usage > max_memory:
+		error = "Insufficient memory to start this droplet"
+		message = f"Insufficient memory in {scope} for {requested_by} to request {count}x droplet {droplet.display_name} - would use {projected_memory_usage}MB of {max_memory}MB allowed"
+	else:
+		error = "Insufficient CPU cores to start this droplet"
+		message = f"Insufficient CPU cores in {scope} for {requested_by} to request {count}x droplet {droplet.display_name} - would use {projected_core_usage} of {max_cores} cores allowed"
+
+	if shortages is None:
+		log("ERROR", message)
+	else:
+		shortages.append(message)
+	return error
+
+def _add_to_scope(scope: str, cores: float, memory: int, max_cores: float = 0, max_memory: float = 0) -> bool:
+	"""Atomically add to a ledger row, only if the result stays within the limits (0 means unlimited)"""
+	query = ResourceLedger.query.filter(ResourceLedger.scope == scope)
+	if max_cores:
+		query = query.filter(ResourceLedger.cores + cores <= max_cores)
+	if max_memory:
+		query = query.filter(ResourceLedger.memory + memory <= max_memory)
+
+	updated = query.update({
+		ResourceLedger.cores: ResourceLedger.cores + cores,
+		ResourceLedger.memory: ResourceLedger.memory + memory
+	}, synchronize_session=False)
+	return updated == 1
+
+def reserve_resources(droplet, keys: list, tenant_id, requested_by: str, enforce: bool = True, node=None, shortages: list = None) -> Tuple[bool, str]:
+	"""
+	Reserve the resources of one container of a droplet per key on a node, all or nothing
+
+	Keys are the ids of the instances or warm containers the resources are held for. The
+	ledger rows are only incremented if they stay within their limits, so concurrent
+	launches in other workers can never oversubscribe a node. With enforce=False the
+	reservation is only recorded, used for droplets that are not limited.
+
+	The reservation is made in a savepoint and undone alone when it does not fit, the
+	caller commits it along with its rows. Placement on a node goes through the scheduler.
+	Shortages are logged, or collected in the shortages list if one is given.
+	"""
+	count = len(keys)
+	cores = droplet.container_cores * count
+	memory = droplet.container_memory * count
+	node_id = None if node is None or node.is_local() else node.id
+	scope = node_scope(node_id)
+
+	_ensure_ledger(scope)
+	if tenant_id:
+		_ensure_ledger(tenant_scope(tenant_id))
+
+	savepoint = db.session.begin_nested()
+	max_cores, max_memory = get_node_limits(node) if enforce else (0, 0)
+	if not _add_to_scope(scope, cores, memory, max_cores, max_memory):
+		savepoint.rollback()
+		return False, _shortage(droplet, requested_by, count, scope, max_cores, max_memory, shortages)
+
+	if tenant_id:
+		tenant_max_cores, tenant_max_memory = get_tenant_limits() if enforce else (0, 0)
+		if not _add_to_scope(tenant_scope(tenant_id), cores, memory, tenant_max_cores, tenant_max_memory):
+			savepoint.rollback()
+			return False, _shortage(droplet, requested_by, count, tenant_scope(tenant_id), tenant_max_cores, tenant_max_memory, shortages)
+
+	for key in keys:
+		db.session.add(ResourceReservation(
+			id=key,
+			droplet_id=droplet.id,
+			tenant_id=tenant_id,
+			node_id=node_id,
+			cores=droplet.container_cores,
+			memory=droplet.container_memory
+		))
+	savepoint.commit()
+	return True, ""
+
+def commit_resources(key: str):
+	"""Mark a reservation as held by a running container"""
+	ResourceReservation.query.filter_by(id=key).update({'status': 'committed'}, synchronize_session=False)
+	db.session.commit()
+
+def _scopes(reservation) -> list:
+	scopes = [node_scope(reservation.node_id)]
+	if reservation.tenant_id:
+		scopes.append(tenant_scope(reservation.tenant_id))
+	return scopes
+
+def _held(reservation, status: str = None) -> Tuple[float, int]:
+	"""(cores, memory in MB) a reservation counts in the ledger, a paused container holds its memory only"""
+	if (status or reservation.status) == 'paused':
+		return 0, reservation.memory
+	return reservation.cores, reservation.memory
+
+def pause_resources(key: str) -> bool:
+	"""Give back the cores of a committed reservation whose container got paused, its memory stays reserved"""
+	reservation = ResourceReservation.query.get(key)
+	if not reservation:
+		return False
+	# Only the caller whose status change went through adjusts the ledger
+	if ResourceReservation.query.filter_by(id=key, status='committed').update({'status': 'paused'}, synchronize_session=False) != 1:
+		db.session.commit()
+		return False
+	for scope in _scopes(reservation):
+		_add_to_scope(scope, -reservation.cores, 0)
+	db.session.commit()
+	return True
+
+def resume_resources(key: str) -> bool:
+	"""
+	Take the cores of a reservation back when its container is unpaused
+
+	Resuming never waits for capacity, so the cores of a node can end up overcommitted
+	until instances are stopped. CPU is shared by CPU shares, memory was never given back.
+	"""
+	reservation = ResourceReservation.query.get(key)
+	if not reservation:
+		return False
+	if ResourceReservation.query.filter_by(id=key, status='paused').update({'status': 'committed'}, synchronize_session=False) != 1:
+		db.session.commit()
+		return False
+	for scope in _scopes(reservation):
+		_add_to_scope(scope, reservation.cores, 0)
+	db.session.commit()
+	return True
+
+def assign_resources_tenant(droplet, key: str, tenant_id, requested_by: str, shortages: list = None) -> Tuple[bool, str]:
+	"""
+	Count a reservation made without a tenant (warm pool) towards a tenant, within its limits
+
+	The tenant's ledger row is only incremented if it stays within the tenant limits, as in
+	reserve_resources, otherwise the reservation is left without a tenant and the shortage
+	is logged, or collected in the shortages list if one is given.
+	"""
+	reservation = ResourceReservation.query.get(key)
+	if not reservation or not tenant_id or reservation.tenant_id:
+		return True, ""
+
+	_ensure_ledger(tenant_scope(tenant_id))
+	savepoint = db.session.begin_nested()
+	if ResourceReservation.query.filter_by(id=key, tenant_id=None).update({'tenant_id': tenant_id}, synchronize_session=False) != 1:
+		# Assigned by another worker meanwhile
+		savepoint.rollback()
+		db.session.commit()
+		return True, ""
+
+	max_cores, max_memory = get_tenant_limits()
+	if not _add_to_scope(tenant_scope(tenant_id), reservation.cores, reservation.memory, max_cores, max_memory):
+		savepoint.rollback()
+		db.session.commit()
+		return False, _shortage(droplet, requested_by, 1, tenant_scope(tenant_id), max_cores, max_memory, shortages)
+	savepoint.commit()
+	db.session.commit()
+	return True, ""
+
+def release_resources(keys: list) -> int:
+	"""Give back the resources of reservations, safe to call twice for the same key, returns how many were released"""
+	released = 0
+	for reservation in ResourceReservation.query.filter(ResourceReservation.id.in_(list(keys))).all():
+		# Only the caller whose delete went through decrements the ledger, by what the status it deleted held
+		status = reservation.status
+		while ResourceReservation.query.filter_by(id=reservation.id, status=status).delete(synchronize_session=False) != 1:
+			# Paused or resumed meanwhile, or already released
+			status = db.session.query(ResourceReservation.status).filter_by(id=reservation.id).scalar()
+			if status is None:
+				break
+		if status is None:
+			continue
+		cores, memory = _held(reservation, status)
+		for scope in _scopes(reservation):
+			_add_to_scope(scope, -cores, -memory)
+		released += 1
+	db.session.commit()
+	return released
+
+def reconcile_resources(rebuild: bool = False):
+	"""
+	Bring reservations in line with the instances and warm containers that exist
+
+	Releases reservations whose container is gone and records the ones missing for
+	rows created outside of the ledger. With rebuild=True the ledger totals are also
+	recomputed from the reservations, used at startup.
+	"""
+	from models.droplet import Droplet, DropletInstance, WarmContainer
+	from models.user import User
+
+	# One statement each, a launch commits its row and its reservation together so it is seen whole or not at all.
+	# Reading the ids in separate queries would release the reservation of a launch committed in between.
+	orphans = [row.id for row in ResourceReservation.query.with_entities(ResourceReservation.id).filter(
+		~exists().where(DropletInstance.id == ResourceReservation.id),
+		~exists().where(WarmContainer.id == ResourceReservation.id)
+	).all()]
+	if orphans:
+		release_resources(orphans)
+
+	missing_instances = DropletInstance.query.filter(~exists().where(ResourceReservation.id == DropletInstance.id)).all()
+	missing_ids = {instance.id for instance in missing_instances}
+	# A claimed warm container shares its id with the instance it became
+	missing_warm = [warm for warm in WarmContainer.query.filter(~exists().where(ResourceReservation.id == WarmContainer.id)).all()
+		if warm.id not in missing_ids]
+	droplets = {droplet.id: droplet for droplet in Droplet.query.all()}
+	nodes = {node.id: node for node in DockerNode.query.all()}
+	tenants = {user.id: user.tenant_id for user in User.query.with_entities(User.id, User.tenant_id).all()}
+	for instance in missing_instances:
+		droplet = droplets.get(instance.droplet_id)
+		if droplet:
+			reserve_resources(droplet, [instance.id], tenants.get(instance.user_id), "reconcile", enforce=False, node=nodes.get(instance.node_id))
+			db.session.commit()
+			commit_resources(instance.id)
+	for warm in missing_warm:
+		droplet = droplets.get(warm.droplet_id)
+		if droplet:
+			reserve_resources(droplet, [warm.id], None, "reconcile", enforce=False, node=nodes.get(warm.node_id))
+			db.session.commit()
+
+	if rebuild:
+		totals = {HOST_SCOPE: [0, 0]}
+		for reservation in ResourceReservation.query.all():
+			cores, memory = _held(reservation)
+			for scope in _scopes(reservation):
+				totals.setdefault(scope, [0, 0])
+				totals[scope][0] += cores
+				totals[scope][1] += memory
+
+		ResourceLedger.query.delete()
+		for scope, (cores, memory) in totals.items():
+			db.session.add(ResourceLedger(scope=scope, cores=cores, memory=memory))
+		db.session.commit()
+
+	return len(orphans), len(missing_instances) + len(missing_warm)
@@ -24,6 +24,11 @@ class DropletCreateSchema(Schema):
     container_cores = fields.Float(allow_none=True)
     container_memory = fields.Float(allow_none=True)
     container_persistent_profile_path = fields.Str(allow_none=True)
+    readiness_probe = fields.Str(allow_none=True)
+    warm_pool_min = fields.Int(allow_none=True, validate=validate.Range(min=0))
+    warm_pool_max = fields.Int(allow_none=True, validate=validate.Range(min=0))
+    idle_timeout = fields.Int(allow_none=True, validate=validate.Range(min=0))
+    freeze_timeout = fields.Int(allow_none=True, validate=validate.Range(min=0))
     server_ip = fields.Str(allow_none=True)
     server_port = fields.Str(allow_none=True)
     server_username = fields.Str(allow_none=True)
@@ -0,0 +1,96 @@
+import math
+import time
+from datetime import datetime, timedelta
+from __init__ import db
+from models.droplet import LaunchPhase
+from utils.logger import log
+
+PERCENTILES = {"p50": 0.50, "p95": 0.95, "p99": 0.99}
+
+class PhaseTimer:
+	"""Times the consecutive phases of one launch, saved as LaunchPhase rows"""
+
+	def __init__(self):
+		self.phases = []  # (phase, seconds)
+		self._created = time.monotonic()
+		self._phase = None
+		self._started = None
+
+	def start(self, phase: str):
+		"""End the running phase and start the next one"""
+		now = time.monotonic()
+		self._close(now)
+		self._phase = phase
+		self._started = now
+
+	def stop(self):
+		self._close(time.monotonic())
+
+	def _close(self, now: float):
+		if self._phase is not None:
+			self.phases.append((self._phase, now - self._started))
+			self._phase = None
+
+	def record(self, phase: str, seconds: float):
+		"""Add a phase timed elsewhere, like the time a job waited in the queue"""
+		self.phases.append((phase, seconds))
+
+	def save(self, instance_id: str, droplet_id: str, node_id=None, success: bool = True, total: bool = True):
+		"""Write the phases in one commit, with a 'total' phase since the timer was created unless total=False"""
+		self.stop()
+		phases = self.phases + ([("total", time.monotonic() - self._created)] if total else [])
+		try:
+			db.session.add_all([LaunchPhase(
+				instance_id=instance_id,
+				droplet_id=droplet_id,
+				node_id=node_id,
+				phase=phase,
+				duration_ms=round(seconds * 1000),
+				success=success
+			) for phase, seconds in phases])
+			db.session.commit()
+		except Exception as e:
+			db.session.rollback()
+			log("ERROR", f"Error recording the launch timings of instance {instance_id}: {str(e)}")
+		self.phases = []
+
+def percentile(values: list, fraction: float) -> int:
+	"""Nearest rank percentile of a sorted list"""
+	return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+def _summarize(durations: dict) -> dict:
+	summary = {}
+	for phase, values in durations.items():
+		values.sort()
+		summary[phase] = {"count": len(values), **{name: percentile(values, fraction) for name, fraction in PERCENTILES.items()}}
+	return summary
+
+def get_phase_percentiles(since: datetime, include_failed: bool = False) -> dict:
+	"""
+	p50/p95/p99 of each launch phase in milliseconds since a time, overall, per droplet and per node
+
+	Percentiles are computed here, the database has no portable percentile function.
+	"""
+	query = db.session.query(LaunchPhase.phase, LaunchPhase.duration_ms, LaunchPhase.droplet_id, LaunchPhase.node_id) \
+		.filter(LaunchPhase.recorded_at >= since)
+	if not include_failed:
+		query = query.filter(LaunchPhase.success.is_(True))
+
+	overall, droplets, nodes = {}, {}, {}
+	for phase, duration_ms, droplet_id, node_id in query.all():
+		overall.setdefault(phase, []).append(duration_ms)
+		droplets.setdefault(droplet_id, {}).setdefault(phase, []).append(duration_ms)
+		nodes.setdefault(node_id or "local", {}).setdefault(phase, []).append(duration_ms)
+
+	return {
+		"phases": _summarize(overall),
+		"droplets": {droplet_id: _summarize(phases) for droplet_id, phases in droplets.items()},
+		"nodes": {node_id: _summarize(phases) for node_id, phases in nodes.items()}
+	}
+
+def prune_launch_phases(older_than_days: int = 14) -> int:
+	"""Delete the launch timings older than older_than_days"""
+	cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+	deleted = LaunchPhase.query.filter(LaunchPhase.recorded_at < cutoff).delete(synchronize_session=False)
+	db.session.commit()
+	return deleted
@@ -0,0 +1,51 @@
+import threading
+from collections import OrderedDict
+from flask_login import UserMixin
+from models.user import User
+from utils.permissions import Permissions
+
+# Users kept by each worker, the least recently loaded are dropped first
+USER_CACHE_SIZE = 1024
+
+_snapshots = OrderedDict()  # user id -> (version stamp, UserSnapshot)
+_snapshots_lock = threading.Lock()
+
+class UserSnapshot(UserMixin):
+	"""Detached, read only copy of a User row, served by the user loader instead of the row"""
+	FIELDS = ["id", "tenant_id", "username", "email", "auth_token", "created_at", "groups", "session_epoch"]
+
+	def __init__(self, user):
+		for field in self.FIELDS:
+			setattr(self, field, getattr(user, field))
+
+	def has_permission(self, permission):
+		return Permissions.check_permission(self.id, permission)
+
+	def get_groups(self):
+		return self.groups.split(',')
+
+def load_user_snapshot(user_id: str):
+	"""
+	Return the cached snapshot of a user, or None if the user does not exist
+
+	Snapshots are valid for the users and groups version stamp they were read at, the
+	database is only queried again after a user or group changed somewhere.
+	"""
+	version = Permissions.version()
+	with _snapshots_lock:
+		entry = _snapshots.get(user_id)
+		if entry is not None and entry[0] == version:
+			_snapshots.move_to_end(user_id)
+			return entry[1]
+
+	user = User.query.get(user_id)
+	if not user:
+		return None
+
+	snapshot = UserSnapshot(user)
+	with _snapshots_lock:
+		_snapshots[user_id] = (version, snapshot)
+		_snapshots.move_to_end(user_id)
+		while len(_snapshots) > USER_CACHE_SIZE:
+			_snapshots.popitem(last=False)
+	return snapshot